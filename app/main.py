@@ -1,13 +1,28 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from .routes import analyze, stream_ws, auth, guides # Import new routers
 from . import models
 from .database import engine
+from .services import executor, guide_index, jobs, llm_service
 
 # Create all database tables (on startup)
 models.Base.metadata.create_all(bind=engine)
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    guide_index.start_refresh()
+    yield
+    await guide_index.stop_refresh()
+    # Worker pools and the LLM client are created lazily on first use;
+    # tear them down on exit
+    await jobs.shutdown()
+    await llm_service.close_client()
+    executor.shutdown()
+
+
+app = FastAPI(lifespan=lifespan)
 
 # --- SECURITY FIX ---
 # Insecure CORS configuration: allow_origins=["*"] with allow_credentials=True
@@ -1,88 +1,392 @@
-import os
+import asyncio
 import base64
-import tempfile
+import hashlib
+import json
+import os
+from typing import List, Optional
 from fastapi import APIRouter, UploadFile, File, Form, HTTPException, Depends
-from fastapi.responses import JSONResponse, PlainTextResponse
-from app.services.llm_service import plan_actions
-from app.services.ocr_service import run_ocr
-from app.services.vision_service import analyze_ui
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from app.services.llm_service import plan_actions, plan_cache_stats
+from app.services.ocr_service import parse_regions, run_ocr_cached, run_ocr_regions
+from app.services.vision_service import analyze_screen
+from app.services.executor import run_io, ExecutorSaturated
+from app.services.ocr_cache import ocr_cache
+from app.services import metrics, singleflight
+from app.services.jobs import job_queue, JobQueueFull, JobStoreNotShared
+from app.services.deadline import Deadline, StageTimeout, timeout_counts
+from app.services.ocr_result import OcrResult
+from app.services.guide_index import match_guide
+from app.utils.image_utils import decode_image, decode_base64_image, encode_preview, image_info, PREVIEW_FORMATS
 from pydantic import BaseModel
-from PIL import Image
-from io import BytesIO
 
 from .. import auth, models
 
+# --- Config ---
+# Image echo in /analyze responses: "none", "original" (upload bytes as-is) or
+# "preview" (downscaled WebP/JPEG). Clients can override per request.
+ANALYZE_ECHO = os.getenv("ANALYZE_ECHO", "original")
+PREVIEW_FORMAT = os.getenv("PREVIEW_FORMAT", "webp")
+PREVIEW_MAX_WIDTH = int(os.getenv("PREVIEW_MAX_WIDTH", "960"))
+PREVIEW_QUALITY = int(os.getenv("PREVIEW_QUALITY", "75"))
+
+# Batch analysis: images per request and items analysed at the same time
+ANALYZE_BATCH_MAX_ITEMS = int(os.getenv("ANALYZE_BATCH_MAX_ITEMS", "50"))
+ANALYZE_BATCH_CONCURRENCY = int(os.getenv("ANALYZE_BATCH_CONCURRENCY", "8"))
+
+# Longest a GET /jobs/{id}?wait=... request may block
+JOB_MAX_WAIT = float(os.getenv("JOB_MAX_WAIT", "30"))
+
+ECHO_MODES = ("none", "original", "preview")
+
 router = APIRouter()
 
+
+async def _image_echo(raw: bytes, img, echo: str | None, preview_format: str | None) -> dict:
+    """
+    Response fields describing the uploaded image. Width/height/mime always
+    come from the header; pixels are only re-encoded for a preview.
+    """
+    width, height, mime = image_info(raw)
+    fields = {"image_width": width, "image_height": height}
+    echo = echo if echo in ECHO_MODES else ANALYZE_ECHO
+    if echo == "original":
+        fields["image_base64"] = base64.b64encode(raw).decode()
+        fields["image_mime"] = mime
+    elif echo == "preview":
+        fmt = preview_format if preview_format in PREVIEW_FORMATS else PREVIEW_FORMAT
+        data, mime, pw, ph = await run_io(encode_preview, img, fmt, PREVIEW_MAX_WIDTH, PREVIEW_QUALITY)
+        fields["image_base64"] = base64.b64encode(data).decode()
+        fields["image_mime"] = mime
+        fields["preview_width"] = pw
+        fields["preview_height"] = ph
+    return fields
+
+
+def _parse_regions_field(regions: str | None) -> list:
+    """`regions` form field: JSON list of [x1, y1, x2, y2] or {x, y, width, height}."""
+    if not regions:
+        return []
+    try:
+        return parse_regions(json.loads(regions))
+    except (ValueError, TypeError, KeyError):
+        raise HTTPException(status_code=400, detail="Invalid regions")
+
+
+async def _ocr(img, profile: str, regions: list, margin: int | None):
+    """Full-frame OCR, or only the regions of interest when the client sent some."""
+    if regions:
+        return await run_ocr_regions(img, regions, margin, profile)
+    return await run_ocr_cached(img, profile)
+
+
+def _budget(deadline_ms: int | None):
+    return deadline_ms / 1000 if deadline_ms else None
+
+
+async def _perceive(img, profile: str, regions: list, margin: int | None, deadline: Deadline):
+    """
+    OCR and vision within `deadline`. A stage that runs out of time yields an
+    empty result instead of failing the request. Returns (ocr, vision, timed_out).
+    """
+    timed_out = []
+    try:
+        ocr = await deadline.run("ocr", _ocr(img, profile, regions, margin))
+    except StageTimeout:
+        ocr = OcrResult.empty()
+        timed_out.append("ocr")
+    try:
+        vision = await deadline.run("vision", analyze_screen(img))
+    except StageTimeout:
+        vision = {"width": img.width, "height": img.height, "elements": [], "summary": {}}
+        timed_out.append("vision")
+    return ocr, vision, timed_out
+
+
+async def _plan(vision, ocr, question: str, use_cache: bool, deadline: Deadline, timed_out: list,
+                user=None) -> dict:
+    """
+    Steps from a recorded guide `user` can access that matches the question
+    and screen, else LLM steps within what is left of `deadline`. Without
+    them (no time left, or no OCR text to ground them on) the OCR lines and
+    vision summary are returned instead, flagged as partial.
+    """
+    timed_out = list(timed_out)
+    result = None
+    if "ocr" not in timed_out:
+        result = await match_guide(question, ocr, user)
+    if result is None and "ocr" not in timed_out:
+        try:
+            result = await deadline.run("llm", plan_actions(vision, ocr, question, use_cache))
+        except StageTimeout:
+            timed_out.append("llm")
+    if result is None:
+        metrics.incr("deadline.partial")
+        return {"steps": [], "partial": True, "timed_out": timed_out,
+                "ocr_lines": ocr.lines(), "vision": vision}
+    if timed_out:
+        metrics.incr("deadline.partial")
+        return {**result, "partial": True, "timed_out": timed_out}
+    return {**result, "partial": False}
+
 @router.post("/analyze")
 async def analyze_screen_file(
     file: UploadFile = File(...),
     question: str = Form(...),
+    profile: str = Form("balanced"),
+    use_cache: bool = Form(True),
+    echo: str = Form(None),
+    preview_format: str = Form(None),
+    mode: str = Form("sync"),
+    regions: str = Form(None),
+    margin: int = Form(None),
+    deadline_ms: int = Form(None),
+    use_guides: bool = Form(True),
     current_user: models.User = Depends(auth.get_current_user)
 ):
     """
-    Standard analysis endpoint for uploaded files (Keeping this unchanged)
+    Standard analysis endpoint for uploaded files.
+    `profile` trades OCR speed for accuracy: "fast", "balanced" or "accurate".
+    `use_cache=false` forces a fresh LLM answer instead of a cached one.
+    `echo` controls whether the image comes back: "none", "original" (the
+    uploaded bytes untouched) or "preview" (downscaled `preview_format`,
+    "webp" or "jpeg").
+    `mode=async` answers 202 with a job id right away; poll
+    GET /jobs/{job_id} (optionally with ?wait=seconds) for the result.
+    `regions` (JSON list of [x1, y1, x2, y2] or {x, y, width, height} in image
+    pixels) limits OCR to those areas plus `margin` px; boxes stay in
+    full-image coordinates.
+    `deadline_ms` caps the whole analysis (default ANALYZE_DEADLINE); when a
+    stage runs out of time the result has "partial": true and lists the
+    stages in "timed_out".
+    When one of the user's guides (owned, shared or public) clearly covers
+    the question on this screen its steps are returned with "source":
+    "guide" and the LLM is skipped; `use_guides=false` always asks the LLM.
     """
-    tmp_path = None
-    try:
-        with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(file.filename)[1]) as tmp:
-            tmp.write(await file.read())
-            tmp_path = tmp.name
-
-        ocr_items = run_ocr(tmp_path)
-        vision = analyze_ui(tmp_path)
-        result = plan_actions(vision, ocr_items, question)
-
-        with Image.open(tmp_path) as img:
-            width, height = img.size
-            buffered = BytesIO()
-            img.save(buffered, format="PNG")
-            image_base64 = base64.b64encode(buffered.getvalue()).decode()
+    rois = _parse_regions_field(regions)
+    raw = await file.read()
 
+    async def run():
+        # For async jobs the clock starts when the job does
+        deadline = Deadline(_budget(deadline_ms))
         return {
             "success": True,
-            "result": {
-                **result,
-                "image_base64": image_base64,
-                "image_width": width,
-                "image_height": height,
-            }
+            "result": await _analyze_upload(raw, question, profile, use_cache, echo, preview_format,
+                                            rois, margin, deadline, current_user if use_guides else None),
         }
 
+    if mode == "async":
+        return await _submit_job(run, current_user)
+    try:
+        return await run()
+    except ExecutorSaturated:
+        raise HTTPException(status_code=503, detail="Server is busy, please retry shortly")
+    except StageTimeout:
+        raise HTTPException(status_code=504, detail="Screen analysis timed out")
     except Exception as e:
         # Avoid leaking internal error details
         print(f"Error in analyze_screen_file: {e}")
         raise HTTPException(status_code=500, detail="An error occurred during screen analysis")
 
-    finally:
-        if tmp_path and os.path.exists(tmp_path):
-            os.remove(tmp_path)
+
+async def _analyze_upload(raw: bytes, question: str, profile: str, use_cache: bool,
+                          echo: str | None, preview_format: str | None,
+                          regions: list = (), margin: int | None = None,
+                          deadline: Deadline | None = None, user=None) -> dict:
+    deadline = deadline or Deadline()
+    # Decode once; every stage works on the same in-memory image
+    img = await deadline.run("decode", run_io(decode_image, raw))
+
+    ocr, vision, timed_out = await _perceive(img, profile, regions, margin, deadline)
+    result = await _plan(vision, ocr, question, use_cache, deadline, timed_out, user)
+    return {**result, **await _image_echo(raw, img, echo, preview_format)}
+
+
+# -------- ASYNC JOBS -------- #
+def _public_job(job: dict) -> dict:
+    return {k: v for k, v in job.items() if k != "owner"}
+
+
+async def _submit_job(run, user) -> JSONResponse:
+    """Queue `run` as a background job and answer 202 with where to poll."""
+    try:
+        job = await job_queue.submit(run, owner=user.id)
+    except JobQueueFull:
+        raise HTTPException(status_code=503, detail="Too many queued analyses, please retry shortly")
+    except JobStoreNotShared:
+        raise HTTPException(status_code=501, detail="Async analysis is not available on this server; use mode=sync")
+    return JSONResponse(status_code=202, content={
+        "job_id": job["id"],
+        "status": job["status"],
+        "status_url": f"/api/analyze/jobs/{job['id']}",
+    })
+
+
+@router.get("/jobs/{job_id}")
+async def get_job(
+    job_id: str,
+    wait: float = 0,
+    current_user: models.User = Depends(auth.get_current_user)
+):
+    """
+    Status and, once finished, the result of an analysis job.
+    `wait` (seconds, max JOB_MAX_WAIT) long-polls until the job finishes.
+    """
+    job = await job_queue.store.wait(job_id, min(max(wait, 0.0), JOB_MAX_WAIT))
+    if job is None or job["owner"] != current_user.id:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return _public_job(job)
+
+
+# -------- BATCH ANALYSIS -------- #
+def _item_error(index: int, e: Exception) -> dict:
+    if isinstance(e, ExecutorSaturated):
+        return {"index": index, "success": False, "error": "Server is busy, please retry shortly"}
+    if isinstance(e, StageTimeout):
+        return {"index": index, "success": False, "error": "Screen analysis timed out"}
+    print(f"Error in batch item {index}: {e}")
+    return {"index": index, "success": False, "error": "An error occurred during screen analysis"}
+
+
+@router.post("/analyze_batch")
+async def analyze_batch(
+    files: List[UploadFile] = File(...),
+    questions: List[str] = Form(...),
+    profile: str = Form("balanced"),
+    use_cache: bool = Form(True),
+    echo: str = Form("none"),
+    preview_format: str = Form(None),
+    stream: bool = Form(False),
+    mode: str = Form("sync"),
+    regions: str = Form(None),
+    margin: int = Form(None),
+    deadline_ms: int = Form(None),
+    use_guides: bool = Form(True),
+    current_user: models.User = Depends(auth.get_current_user)
+):
+    """
+    Analyse many screenshots in one request. Send one `questions` entry per
+    file, or a single question for all of them. Items run concurrently and
+    identical images are decoded and OCR'd once.
+
+    Returns {"success": true, "results": [...]} in upload order, or with
+    `stream=true` an NDJSON stream of items in completion order. Each item is
+    {"index", "success", "result"} or {"index", "success": false, "error"};
+    a failing item never fails the batch. `mode=async` runs the whole batch
+    as a background job (see GET /jobs/{job_id}). `regions`/`margin` (as for
+    /analyze) apply to every image; `deadline_ms` is the budget of each
+    item, counted from when the item starts running.
+    """
+    rois = _parse_regions_field(regions)
+    if len(files) > ANALYZE_BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"At most {ANALYZE_BATCH_MAX_ITEMS} images per batch")
+    if len(questions) not in (1, len(files)):
+        raise HTTPException(status_code=400, detail="Send one question, or one per file")
+    if len(questions) == 1:
+        questions = questions * len(files)
+
+    uploads = [await f.read() for f in files]
+    budget = _budget(deadline_ms)
+    semaphore = asyncio.Semaphore(ANALYZE_BATCH_CONCURRENCY)
+    # Decode + OCR + vision once per distinct image in the batch
+    perceived = {}
+
+    async def perceive(raw: bytes, deadline: Deadline):
+        img = await deadline.run("decode", run_io(decode_image, raw))
+        return (img, *await _perceive(img, profile, rois, margin, deadline))
+
+    async def run_item(index: int) -> dict:
+        raw = uploads[index]
+        try:
+            async with semaphore:
+                # Budgeted from here: items queued for a slot must not spend their time waiting
+                deadline = Deadline(budget)
+                digest = hashlib.sha256(raw).digest()
+                if digest not in perceived:
+                    perceived[digest] = asyncio.ensure_future(perceive(raw, deadline))
+                else:
+                    metrics.incr("analyze_batch.duplicate")
+                img, ocr, vision, timed_out = await asyncio.shield(perceived[digest])
+                result = await _plan(vision, ocr, questions[index], use_cache, deadline, timed_out,
+                                     current_user if use_guides else None)
+                return {
+                    "index": index,
+                    "success": True,
+                    "result": {**result, **await _image_echo(raw, img, echo, preview_format)},
+                }
+        except Exception as e:
+            return _item_error(index, e)
+
+    metrics.incr("analyze_batch.requests")
+    metrics.incr("analyze_batch.items", len(uploads))
+
+    async def run_all():
+        return {"success": True, "results": list(await asyncio.gather(*map(run_item, range(len(uploads)))))}
+
+    if mode == "async":
+        return await _submit_job(run_all, current_user)
+    if not stream:
+        return await run_all()
+
+    tasks = [asyncio.ensure_future(run_item(i)) for i in range(len(uploads))]
+
+    async def ndjson():
+        try:
+            for finished in asyncio.as_completed(tasks):
+                yield json.dumps(await finished) + "\n"
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(ndjson(), media_type="application/x-ndjson")
+
+
+# -------- PIPELINE METRICS -------- #
+@router.get("/metrics")
+async def analysis_metrics(current_user: models.User = Depends(auth.get_current_user)):
+    """
+    Per-worker counters for the analysis pipeline (cache hit/miss, ...).
+    """
+    return {
+        "counters": metrics.snapshot(),
+        "ocr_cache": ocr_cache.stats(),
+        "llm_cache": plan_cache_stats(),
+        "timeouts": timeout_counts(),
+        "coalescing": singleflight.stats(),
+    }
 
 
 # -------- NEW LIVE SCREEN ANALYSIS ENDPOINT -------- #
 class AnalyzeLiveRequest(BaseModel):
     image_base64: str
     question: str
+    # Live analysis favours latency by default
+    profile: str = "fast"
+    use_cache: bool = True
+    # Optional regions of interest ([x1, y1, x2, y2] or {x, y, width, height})
+    regions: Optional[list] = None
+    margin: Optional[int] = None
+    deadline_ms: Optional[int] = None
+    use_guides: bool = True
 
 @router.post("/analyze_live")
 async def analyze_live(
     req: AnalyzeLiveRequest,
     current_user: models.User = Depends(auth.get_current_user)
 ):
-    tmp_path = None
+    try:
+        rois = parse_regions(req.regions)
+    except (ValueError, TypeError, KeyError):
+        raise HTTPException(status_code=400, detail="Invalid regions")
     try:
         # Decode image
-        image_data = req.image_base64.split(",")[-1]
-        image_bytes = base64.b64decode(image_data)
-
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".png") as tmp:
-            tmp.write(image_bytes)
-            tmp_path = tmp.name
+        deadline = Deadline(_budget(req.deadline_ms))
+        image_bytes = decode_base64_image(req.image_base64)
+        img = await deadline.run("decode", run_io(decode_image, image_bytes))
 
         # Run Analysis
-        ocr_items = run_ocr(tmp_path)
-        vision = analyze_ui(tmp_path)
-        result = plan_actions(vision, ocr_items, req.question)
+        ocr, vision, timed_out = await _perceive(img, req.profile, rois, req.margin, deadline)
+        result = await _plan(vision, ocr, req.question, req.use_cache, deadline, timed_out,
+                             current_user if req.use_guides else None)
 
         steps = result.get("steps", [])
         
@@ -95,10 +399,11 @@ async def analyze_live(
         # 🆕 RETURN RAW TEXT: No JSON structure, just the string.
         return JSONResponse(content=formatted_text)
 
+    except ExecutorSaturated:
+        raise HTTPException(status_code=503, detail="Server is busy, please retry shortly")
+    except StageTimeout:
+        raise HTTPException(status_code=504, detail="Live analysis timed out")
     except Exception as e:
         # Avoid leaking internal error details
         print(f"Error in analyze_live: {e}")
         raise HTTPException(status_code=500, detail="An error occurred during live analysis")
-    finally:
-        if tmp_path and os.path.exists(tmp_path):
-            os.remove(tmp_path)
\ No newline at end of file
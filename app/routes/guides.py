@@ -1,5 +1,5 @@
 # app/routes/guides.py
-from fastapi import APIRouter, Depends, HTTPException, status,Request,Query,BackgroundTasks
+from fastapi import APIRouter, Depends, HTTPException, status,Request,Query,BackgroundTasks,UploadFile,File,Form
 from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 from sqlalchemy import or_
@@ -17,10 +17,22 @@ from reportlab.pdfgen import canvas
 
 from .. import database, models, auth
 from ..schemas import GuideCreate, Guide, GuideUpdate
+from ..services.guide_index import guide_index, recommend_guides, GUIDE_RECOMMEND_LIMIT, GUIDE_RECOMMEND_MAX_LIMIT
+from ..services.executor import run_io, ExecutorSaturated
+from ..services.ocr_service import run_ocr_cached
+from ..utils.image_utils import decode_image
 import json
 
 router = APIRouter()
 
+
+def reindex_guide(db_guide: models.Guide):
+    """Keep the in-memory guide matcher in step with a committed change."""
+    try:
+        guide_index.upsert(db_guide)
+    except Exception as e:
+        print(f"[NexAura] Warning: failed to re-index guide {db_guide.id}: {e}")
+
 # Where screenshots will be stored on disk (relative to your app root)
 SCREENSHOT_ROOT = Path("guide_screenshots")
 
@@ -363,6 +375,7 @@ async def delete_guide(
     try:
         db.delete(db_guide)
         db.commit()
+        guide_index.remove(guide_id)
     except Exception as e:
         db.rollback()
         print(f"Error deleting guide: {e}")
@@ -390,6 +403,38 @@ async def search_public_guides(
     return query.all()
 
 
+# --- SCREEN RECOMMENDATION ENDPOINT ---
+@router.post("/recommend")
+async def recommend_guides_for_screen(
+    file: UploadFile = File(None),
+    text: str = Form(None),
+    question: str = Form(""),
+    limit: int = Form(GUIDE_RECOMMEND_LIMIT),
+    profile: str = Form("fast"),
+    current_user: models.User = Depends(auth.get_current_user),
+):
+    """
+    Guides (owned, shared or public) that apply to what is on screen, best
+    first. Send a screenshot as `file` (it is OCR'd) or the screen's text
+    as `text`; an optional `question` narrows the ranking.
+    """
+    if file is None and not text:
+        raise HTTPException(status_code=400, detail="Send a screenshot file or the screen text")
+    limit = max(1, min(limit, GUIDE_RECOMMEND_MAX_LIMIT))
+    try:
+        if file is not None:
+            img = await run_io(decode_image, await file.read())
+            ocr = await run_ocr_cached(img, profile)
+            text = " ".join([text or "", *ocr.text.tolist()])
+        guides = await recommend_guides(text, current_user, question, limit)
+    except ExecutorSaturated:
+        raise HTTPException(status_code=503, detail="Server is busy, please retry shortly")
+    except Exception as e:
+        print(f"Error recommending guides: {e}")
+        raise HTTPException(status_code=500, detail="An error occurred while recommending guides")
+    return {"guides": guides}
+
+
 # --- ACCESS CLAIM ENDPOINT ---
 @router.post("/share/access/{share_token}", response_model=Guide)
 async def claim_guide_access(
@@ -412,6 +457,7 @@ async def claim_guide_access(
         try:
             db.commit()
             db.refresh(db_guide)
+            reindex_guide(db_guide)
         except Exception as e:
             db.rollback()
             print(f"Error claiming access: {e}")
@@ -547,6 +593,7 @@ async def update_guide(
     try:
         db.commit()
         db.refresh(db_guide)
+        reindex_guide(db_guide)
 
         # Hydrate steps and shared emails for response
         if "rich_steps_payload" in locals() and rich_steps_payload:
@@ -614,6 +661,7 @@ async def create_guide(
 
         db.commit()
         db.refresh(db_guide)
+        reindex_guide(db_guide)
 
         # Hydrate rich fields
         try:
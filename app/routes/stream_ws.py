@@ -1,17 +1,40 @@
 # app/routes/stream_ws.py
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Query, status
-import base64
-import tempfile
 import json
-import os
+from types import SimpleNamespace
 from jose import JWTError, jwt
 from ..auth import SECRET_KEY, ALGORITHM
-from app.services.ocr_service import run_ocr
-from app.services.vision_service import analyze_ui
-from app.services.llm_service import plan_actions
+from .. import database, models
+from app.services.frame_diff import FrameState
+from app.services.ocr_service import parse_regions, run_ocr_regions
+from app.services.vision_service import analyze_screen
+from app.services.llm_service import plan_actions, stream_plan_actions
+from app.services.executor import run_io, ExecutorSaturated
+from app.services.frame_scheduler import FramePipeline
+from app.services.deadline import Deadline, StageTimeout
+from app.services.conversation import Conversation
+from app.services.guide_index import match_guide
+from app.services.ocr_result import OcrResult
+from app.services import metrics
+from app.utils.image_utils import decode_image, decode_base64_image
+from app.utils.ws_protocol import FrameError, unpack_frame, reply_format, encode_reply
 
 router = APIRouter()
 
+
+def _load_user(email: str):
+    """User for guide access checks; unknown users only see public and shared guides."""
+    db = database.SessionLocal()
+    try:
+        user = db.query(models.User).filter(models.User.email == email).first()
+        if user is not None:
+            return SimpleNamespace(id=user.id, email=user.email)
+    except Exception as e:
+        print(f"Could not load websocket user: {e}")
+    finally:
+        db.close()
+    return SimpleNamespace(id=None, email=email)
+
 @router.websocket("/screen")
 async def websocket_endpoint(websocket: WebSocket, token: str = Query(None)):
     if token is None:
@@ -29,44 +52,204 @@ async def websocket_endpoint(websocket: WebSocket, token: str = Query(None)):
         return
 
     await websocket.accept()
+    user = await run_io(_load_user, email)
+    # Previous frame + OCR words, so each new frame only re-reads what changed
+    frame_state = FrameState()
+    # Earlier screens and answers, so follow-ups only send what changed
+    conversation = Conversation()
+    frame_counter = 0
+
+    # Replies mirror the request: JSON text for text frames, msgpack (or
+    # JSON bytes) for binary frames
+    async def send(message: dict, reply=None):
+        if reply is None:
+            await websocket.send_text(json.dumps(message))
+        else:
+            await websocket.send_bytes(encode_reply(message, reply))
+
+    async def read_text(img, frame: dict):
+        profile = frame["payload"].get("profile", "fast")
+        if frame["regions"]:
+            # targeted question: only read the regions of interest
+            return await run_ocr_regions(img, frame["regions"], frame["payload"].get("margin"), profile)
+        return await frame_state.ocr(img, profile)
+
+    # Stage 1: decode, OCR and vision. Runs one frame at a time so FrameState
+    # always diffs against the previous frame. Every stage runs within the
+    # frame's deadline; a stage out of time leaves an empty result and marks
+    # the frame partial.
+    async def perceive(frame: dict):
+        frame_id, reply = frame["frame_id"], frame["reply"]
+        deadline, timed_out = frame["deadline"], frame["timed_out"]
+        try:
+            # decode once, in memory
+            img = await deadline.run("decode", run_io(decode_image, frame.pop("image")))
+
+            try:
+                ocr = await deadline.run("ocr", read_text(img, frame))
+            except StageTimeout:
+                ocr = OcrResult.empty()
+                timed_out.append("ocr")
+            # binary clients get the compact column form of the word table
+            frame["ocr"] = ocr
+            frame["ocr_items"] = ocr.to_columns() if reply else ocr.to_items()
+            if frame["stream"]:
+                await send({"type": "ocr", "frame_id": frame_id,
+                            "ocr": frame["ocr_items"], "ocr_lines": ocr.lines()}, reply)
+            try:
+                frame["vision"] = await deadline.run("vision", analyze_screen(img))
+            except StageTimeout:
+                frame["vision"] = {"width": img.width, "height": img.height, "elements": [], "summary": {}}
+                timed_out.append("vision")
+            if frame["stream"]:
+                await send({"type": "vision", "frame_id": frame_id, "vision": frame["vision"]}, reply)
+            return frame
+        except ExecutorSaturated:
+            await send({"error": "server busy", "frame_id": frame_id}, reply)
+        except StageTimeout:
+            await send({"error": "timed out", "frame_id": frame_id}, reply)
+        except Exception as e:
+            print(f"Error processing frame: {e}")
+            await send({"error": "processing failed", "frame_id": frame_id}, reply)
+        return None
+
+    # Stage 2: the LLM answer, overlapping with the next frame's stage 1.
+    # Without time left (or OCR text) the frame is answered without LLM
+    # steps: "llm" is null and "partial" is true.
+    async def answer(frame: dict):
+        frame_id, reply = frame["frame_id"], frame["reply"]
+        payload = frame["payload"]
+        question = payload.get("question", "")
+        use_cache = bool(payload.get("use_cache", True))
+        ocr, vision = frame["ocr"], frame["vision"]
+        deadline, timed_out = frame["deadline"], frame["timed_out"]
+        # context=false asks without the session history; reset_context=true starts over
+        if payload.get("reset_context"):
+            conversation.reset()
+        session = conversation if payload.get("context", True) else None
+        try:
+            # A recorded guide that covers the question answers without the LLM
+            guided = None
+            if payload.get("use_guides", True) and "ocr" not in timed_out:
+                guided = await match_guide(question, ocr, user)
+
+            if frame["stream"]:
+                steps = []
+
+                async def stream_steps():
+                    async for event in stream_plan_actions(vision, ocr, question, use_cache, session):
+                        if "step" in event:
+                            steps.append(event["step"])
+                            await send({"type": "llm_step", "frame_id": frame_id,
+                                        "index": event["index"], "step": event["step"]}, reply)
+                        else:
+                            return event["result"]
+
+                if guided is not None:
+                    for index, step in enumerate(guided["steps"]):
+                        await send({"type": "llm_step", "frame_id": frame_id, "index": index, "step": step}, reply)
+                    llm_response = guided
+                else:
+                    llm_response = await plan_within(deadline, timed_out, stream_steps())
+                if llm_response is None and steps:
+                    llm_response = {"steps": steps}
+                await send({"type": "llm", "frame_id": frame_id, "llm": llm_response,
+                            "partial": bool(timed_out), "timed_out": timed_out}, reply)
+                return
+
+            llm_response = guided or await plan_within(deadline, timed_out,
+                                                       plan_actions(vision, ocr, question, use_cache, session))
+
+            await send({
+                "frame_id": frame_id,
+                "ocr": frame["ocr_items"],
+                "ocr_lines": ocr.lines(),
+                "vision": vision,
+                "llm": llm_response,
+                "partial": bool(timed_out),
+                "timed_out": timed_out,
+            }, reply)
+        except Exception as e:
+            print(f"Error processing frame: {e}")
+            await send({"error": "processing failed", "frame_id": frame_id}, reply)
+
+    async def plan_within(deadline, timed_out, call):
+        """Await the LLM `call` within the deadline; None (and a partial frame) otherwise."""
+        if "ocr" in timed_out:
+            call.close()
+            result = None
+        else:
+            try:
+                result = await deadline.run("llm", call)
+            except StageTimeout:
+                timed_out.append("llm")
+                result = None
+        if timed_out:
+            metrics.incr("deadline.partial")
+        return result
+
+    # Latest frame wins: older frames are dropped or cancelled and the client
+    # is told which frame ids will get no result
+    async def skipped(frame_id, reason, latest_id):
+        await send({"type": "skipped", "frame_id": frame_id, "reason": reason,
+                    "latest_frame_id": latest_id}, last_reply)
+
+    pipeline = FramePipeline([perceive, answer], skipped)
+    last_reply = None
+
     try:
         while True:
-            data = await websocket.receive_text()  # expects JSON with base64 image and question
-            try:
-                payload = json.loads(data)
-            except json.JSONDecodeError:
-                await websocket.send_text(json.dumps({"error": "invalid json"}))
-                continue
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(message.get("code", 1000))
 
-            b64 = payload.get("image")
-            question = payload.get("question", "")
-            if not b64:
-                await websocket.send_text(json.dumps({"error":"no image"}))
+            if message.get("bytes") is not None:
+                # binary frame: length-prefixed JSON header + raw image bytes
+                try:
+                    payload, image_bytes = unpack_frame(message["bytes"])
+                except FrameError as e:
+                    await send({"error": str(e)}, "json")
+                    continue
+                reply = reply_format(payload)
+            else:
+                reply = None
+                try:
+                    payload = json.loads(message.get("text") or "")
+                except json.JSONDecodeError:
+                    await send({"error": "invalid json"})
+                    continue
+                # legacy text frame: base64 data-URL image
+                b64 = payload.get("image")
+                try:
+                    image_bytes = decode_base64_image(b64) if b64 else None
+                except ValueError:
+                    image_bytes = None
+
+            frame_counter += 1
+            frame_id = payload.get("frame_id", frame_counter)
+            if not image_bytes:
+                await send({"error": "no image", "frame_id": frame_id}, reply)
                 continue
 
-            tmp_path = None
+            # optional regions of interest: [[x1, y1, x2, y2] | {x, y, width, height}, ...]
             try:
-                # decode
-                header, b64data = (b64.split(",", 1) if "," in b64 else (None, b64))
-                img_bytes = base64.b64decode(b64data)
-                with tempfile.NamedTemporaryFile(suffix=".png", delete=False) as tf:
-                    tmp_path = tf.name
-                    tf.write(img_bytes)
-
-                ocr_items = run_ocr(tmp_path)
-                vision = analyze_ui(tmp_path)
-                llm_response = plan_actions(vision, ocr_items, question)
-
-                await websocket.send_text(json.dumps({
-                    "ocr": ocr_items,
-                    "vision": vision,
-                    "llm": llm_response
-                }))
-            except Exception as e:
-                print(f"Error processing frame: {e}")
-                await websocket.send_text(json.dumps({"error": "processing failed"}))
-            finally:
-                if tmp_path and os.path.exists(tmp_path):
-                    os.remove(tmp_path)
+                regions = parse_regions(payload.get("regions"))
+            except (ValueError, TypeError, KeyError):
+                await send({"error": "invalid regions", "frame_id": frame_id}, reply)
+                continue
+
+            last_reply = reply
+            # deadline_ms: end-to-end budget for this frame, counted from arrival
+            budget = payload.get("deadline_ms")
+            deadline = Deadline(budget / 1000 if isinstance(budget, (int, float)) and budget > 0 else None)
+            await pipeline.submit(frame_id, {
+                "frame_id": frame_id, "payload": payload, "image": image_bytes, "reply": reply,
+                "regions": regions,
+                "deadline": deadline, "timed_out": [],
+                # stream=true: push OCR, vision and each LLM step as soon as ready
+                "stream": bool(payload.get("stream", False)),
+            })
     except WebSocketDisconnect:
         print("client disconnected")
+    finally:
+        await pipeline.close()
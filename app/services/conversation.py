@@ -0,0 +1,142 @@
+# app/services/conversation.py
+import json
+import os
+from collections import deque
+
+from app.services import metrics
+from app.services.prompt_compaction import estimate_tokens
+
+# --- Config ---
+# Rolling input-token budget for a session's history plus the new turn
+SESSION_TOKEN_BUDGET = int(os.getenv("SESSION_TOKEN_BUDGET", "3000"))
+SESSION_MAX_TURNS = int(os.getenv("SESSION_MAX_TURNS", "8"))
+# Above this share of changed lines the whole screen is sent again
+SESSION_FULL_SCREEN_RATIO = float(os.getenv("SESSION_FULL_SCREEN_RATIO", "0.6"))
+
+SESSION_PROMPT = """
+This is a conversation about the same user interface. The first message describes the whole screen; later
+messages may only describe what changed since the previous message: "added" and "removed" lines (and "ui_added",
+"ui_removed" elements) per region, or "screen_unchanged": true. Apply the changes to your picture of the screen.
+"""
+
+
+def _labels(compacted: dict) -> set:
+    """(section, region, label) for every line and UI element of a compacted screen."""
+    found = set()
+    for section in ("regions", "ui"):
+        for region, labels in (compacted.get(section) or {}).items():
+            found.update((section, region, label) for label in labels)
+    return found
+
+
+def _grouped(entries, section: str) -> dict:
+    out = {}
+    for sec, region, label in sorted(entries):
+        if sec == section:
+            out.setdefault(region, []).append(label)
+    return out
+
+
+def screen_delta(previous: dict, current: dict):
+    """
+    What changed between two compacted screens, e.g.
+    {"added": {"center": ["Saved"]}, "removed": {"bottom-right": ["Save"]}}.
+    Empty when nothing changed; None when a full screen should be sent
+    (different size, or most of the text changed).
+    """
+    prev_screen, cur_screen = previous["screen"], current["screen"]
+    if (prev_screen.get("width"), prev_screen.get("height")) != (cur_screen.get("width"), cur_screen.get("height")):
+        return None
+    before, after = _labels(previous), _labels(current)
+    added, removed = after - before, before - after
+    if len(added) + len(removed) > SESSION_FULL_SCREEN_RATIO * max(len(before | after), 1):
+        return None
+    delta = {}
+    for key, entries, section in (("added", added, "regions"), ("removed", removed, "regions"),
+                                  ("ui_added", added, "ui"), ("ui_removed", removed, "ui")):
+        grouped = _grouped(entries, section)
+        if grouped:
+            delta[key] = grouped
+    if cur_screen != prev_screen:
+        delta["screen"] = cur_screen
+    return delta
+
+
+class Conversation:
+    """
+    Per-connection LLM context for the screen stream: remembers the screen
+    the model last saw and the previous turns, so each new turn only sends
+    what changed since then. History is trimmed oldest-first to stay within
+    `budget` tokens; once the last full screen falls out, the next turn
+    sends the whole screen again.
+    """
+
+    def __init__(self, budget: int = SESSION_TOKEN_BUDGET, max_turns: int = SESSION_MAX_TURNS):
+        self.budget = budget
+        self.max_turns = max(1, max_turns)
+        self.turns = deque()  # {"user", "assistant", "full", "tokens"}
+        self.screen = None    # compacted screen as of the last answered turn
+        self._pending = None
+
+    def __len__(self):
+        return len(self.turns)
+
+    def reset(self):
+        self.turns.clear()
+        self.screen = None
+        self._pending = None
+
+    def _user_content(self, compacted: dict, question: str, full: bool) -> tuple:
+        if full:
+            return json.dumps({**compacted, "user_question": question}, separators=(",", ":")), "full"
+        delta = screen_delta(self.screen, compacted)
+        if delta is None:
+            return self._user_content(compacted, question, True)
+        if not delta:
+            return json.dumps({"screen_unchanged": True, "user_question": question},
+                              separators=(",", ":")), "unchanged"
+        return json.dumps({"screen_changes": delta, "user_question": question},
+                          separators=(",", ":")), "delta"
+
+    def messages(self, system_prompt: str, compacted: dict, question: str) -> list:
+        """
+        Chat messages for a new turn: system prompt, the kept history and the
+        new user message (a delta when possible). Call record() with the
+        answer to commit the turn.
+        """
+        content, kind = self._user_content(compacted, question, self.screen is None)
+        history = list(self.turns)
+        while history and (len(history) >= self.max_turns
+                           or sum(t["tokens"] for t in history) + estimate_tokens(content) > self.budget):
+            history.pop(0)
+            metrics.incr("session.trimmed")
+        if kind != "full" and not any(t["full"] for t in history):
+            # The screen the deltas build on is gone from the context
+            content, kind = self._user_content(compacted, question, True)
+            while history and sum(t["tokens"] for t in history) + estimate_tokens(content) > self.budget:
+                history.pop(0)
+                metrics.incr("session.trimmed")
+
+        metrics.incr(f"session.{kind}")
+        self._pending = {"history": history, "user": content, "full": kind == "full", "screen": compacted}
+        messages = [{"role": "system", "content": system_prompt + SESSION_PROMPT}]
+        for turn in history:
+            messages.append({"role": "user", "content": turn["user"]})
+            messages.append({"role": "assistant", "content": turn["assistant"]})
+        messages.append({"role": "user", "content": content})
+        return messages
+
+    def record(self, result: dict):
+        """Commit the pending turn with the model's answer."""
+        pending, self._pending = self._pending, None
+        if pending is None:
+            return
+        answer = json.dumps({"steps": (result or {}).get("steps") or []}, separators=(",", ":"))
+        self.turns = deque(pending["history"])
+        self.turns.append({
+            "user": pending["user"],
+            "assistant": answer,
+            "full": pending["full"],
+            "tokens": estimate_tokens(pending["user"]) + estimate_tokens(answer),
+        })
+        self.screen = pending["screen"]
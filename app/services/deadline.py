@@ -0,0 +1,95 @@
+# app/services/deadline.py
+import asyncio
+import contextvars
+import os
+import time
+
+from app.services import metrics
+
+# --- Config ---
+# End-to-end budget of one analysis (seconds); clients may ask for less
+ANALYZE_DEADLINE = float(os.getenv("ANALYZE_DEADLINE", "30"))
+ANALYZE_MAX_DEADLINE = float(os.getenv("ANALYZE_MAX_DEADLINE", "120"))
+# Kept back from every stage so there is time left to build the response
+DEADLINE_RESERVE = float(os.getenv("DEADLINE_RESERVE", "0.25"))
+# The LLM is skipped (partial result) when less than this is left
+LLM_MIN_BUDGET = float(os.getenv("LLM_MIN_BUDGET", "2"))
+
+# Longest share of the whole budget each stage may take; the LLM gets the rest
+STAGE_SHARES = {"decode": 0.15, "ocr": 0.5, "vision": 0.25, "llm": 1.0}
+STAGE_MIN_BUDGET = {"llm": LLM_MIN_BUDGET}
+STAGES = tuple(STAGE_SHARES)
+
+# Wall-clock expiry of the stage running in this context, for work that
+# outlives a cancelled await (e.g. a tesseract subprocess in the OCR pool)
+_stage_expires = contextvars.ContextVar("stage_expires", default=None)
+
+
+class StageTimeout(Exception):
+    """A pipeline stage ran out of time (or was not started for lack of it)."""
+
+    def __init__(self, stage: str):
+        super().__init__(f"{stage} stage timed out")
+        self.stage = stage
+
+
+class Deadline:
+    """
+    End-to-end time budget of one analysis. Each stage gets at most its
+    STAGE_SHARES slice of the budget and never more than what is left.
+    """
+
+    def __init__(self, budget: float | None = None, timer=time.monotonic):
+        self.budget = resolve_budget(budget)
+        self._timer = timer
+        self.expires = timer() + self.budget
+
+    @property
+    def remaining(self) -> float:
+        return max(0.0, self.expires - self._timer())
+
+    def timeout_for(self, stage: str) -> float:
+        return max(0.0, min(self.remaining - DEADLINE_RESERVE, STAGE_SHARES[stage] * self.budget))
+
+    async def run(self, stage: str, awaitable):
+        """Await `awaitable` within the stage's timeout, else raise StageTimeout."""
+        timeout = self.timeout_for(stage)
+        if timeout <= STAGE_MIN_BUDGET.get(stage, 0.0):
+            if asyncio.iscoroutine(awaitable):
+                awaitable.close()
+            metrics.incr(f"deadline.skipped.{stage}")
+            raise StageTimeout(stage)
+        token = _stage_expires.set(time.time() + timeout)
+        try:
+            # asyncio.timeout, unlike wait_for, never swallows an outside cancel
+            async with asyncio.timeout(timeout):
+                return await awaitable
+        except TimeoutError:
+            metrics.incr(f"deadline.timeout.{stage}")
+            raise StageTimeout(stage)
+        finally:
+            _stage_expires.reset(token)
+
+
+def stage_remaining() -> float | None:
+    """Seconds left for the stage the caller runs in, or None outside Deadline.run."""
+    expires = _stage_expires.get()
+    return None if expires is None else max(0.0, expires - time.time())
+
+
+def resolve_budget(budget: float | None) -> float:
+    """Client-requested budget in seconds, capped at ANALYZE_MAX_DEADLINE."""
+    if budget is None or budget <= 0:
+        return ANALYZE_DEADLINE
+    return min(float(budget), ANALYZE_MAX_DEADLINE)
+
+
+def timeout_counts() -> dict:
+    """Per-stage {stage: {"timeout": n, "skipped": n}} for the metrics endpoint."""
+    return {
+        stage: {
+            "timeout": metrics.get(f"deadline.timeout.{stage}"),
+            "skipped": metrics.get(f"deadline.skipped.{stage}"),
+        }
+        for stage in STAGES
+    }
@@ -0,0 +1,148 @@
+# app/services/executor.py
+import asyncio
+import multiprocessing
+import os
+import threading
+from concurrent.futures import BrokenExecutor, Executor, ProcessPoolExecutor, ThreadPoolExecutor
+
+from app.services import metrics
+
+# --- Config ---
+# CPU-bound work (OCR, image analysis) runs in a process pool so Tesseract and
+# PIL/NumPy work never blocks the event loop. Set OCR_EXECUTOR=thread to keep
+# it in-process (useful for tests and single-core hosts).
+OCR_EXECUTOR = os.getenv("OCR_EXECUTOR", "process")
+OCR_WORKERS = int(os.getenv("OCR_WORKERS", str(os.cpu_count() or 2)))
+OCR_QUEUE_LIMIT = int(os.getenv("OCR_QUEUE_LIMIT", "32"))
+# How OCR worker processes start. The pool is created lazily, after the io
+# pool's threads exist, so plain fork would copy a multi-threaded process;
+# forkserver forks clean workers from a helper with the OCR modules preloaded.
+OCR_MP_START = os.getenv("OCR_MP_START", "forkserver")
+
+# Blocking I/O and GIL-releasing native work (image decoding, hashing) runs in
+# a thread pool. LLM calls are native asyncio (see llm_service).
+IO_WORKERS = int(os.getenv("IO_WORKERS", "16"))
+IO_QUEUE_LIMIT = int(os.getenv("IO_QUEUE_LIMIT", "64"))
+
+
+class ExecutorSaturated(Exception):
+    """Raised when a pool already has its maximum number of pending tasks."""
+
+
+class BoundedExecutor:
+    """
+    Wraps a concurrent.futures executor with a cap on pending tasks
+    (running + queued). Submissions beyond the cap fail fast with
+    ExecutorSaturated instead of piling up behind a slow stage. A pool that
+    breaks (e.g. a worker process crashed or was OOM-killed) fails the calls
+    it had and is replaced for the next ones.
+    """
+
+    def __init__(self, name: str, factory, max_workers: int, queue_limit: int):
+        self.name = name
+        self.max_workers = max(1, max_workers)
+        self.queue_limit = max(self.max_workers, queue_limit)
+        # Called once in every worker when the pool starts (e.g. to warm an OCR engine)
+        self.initializer = None
+        self._factory = factory
+        self._executor: Executor | None = None
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            self._executor = self._factory(max_workers=self.max_workers, initializer=self.initializer)
+        return self._executor
+
+    async def run(self, fn, *args):
+        with self._lock:
+            if self._pending >= self.queue_limit:
+                raise ExecutorSaturated(f"{self.name} pool is saturated")
+            self._pending += 1
+            executor = self._get_executor()
+        try:
+            try:
+                future = executor.submit(fn, *args)
+            except BrokenExecutor:
+                # Broken by an earlier call; start a new pool and try once more
+                self._discard(executor)
+                with self._lock:
+                    executor = self._get_executor()
+                future = executor.submit(fn, *args)
+        except BaseException:
+            self._release()
+            raise
+        # Released when the work really ends: a caller that gives up (stage
+        # timeout) must not free a slot whose worker is still busy
+        future.add_done_callback(self._release)
+        try:
+            return await asyncio.wrap_future(future)
+        except BrokenExecutor:
+            self._discard(executor)
+            raise
+
+    def _discard(self, executor: Executor):
+        """Drop a broken pool so the next call creates a new one."""
+        with self._lock:
+            if self._executor is not executor:
+                return
+            self._executor = None
+        metrics.incr(f"executor.{self.name}.rebuilt")
+        print(f"[NexAura] Warning: {self.name} pool broke (worker crashed?); starting a new one")
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def _release(self, _future=None):
+        with self._lock:
+            self._pending -= 1
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _ocr_factory(max_workers: int, initializer=None) -> Executor:
+    if OCR_EXECUTOR == "thread":
+        return ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ocr",
+                                  initializer=initializer)
+    # Long-lived worker processes: each keeps its OCR engine loaded between calls
+    return ProcessPoolExecutor(max_workers=max_workers, initializer=initializer,
+                               mp_context=_mp_context())
+
+
+def _mp_context():
+    if OCR_MP_START not in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context()
+    context = multiprocessing.get_context(OCR_MP_START)
+    if OCR_MP_START == "forkserver":
+        context.set_forkserver_preload(["app.services.ocr_service", "app.services.vision_service"])
+    return context
+
+
+def _io_factory(max_workers: int, initializer=None) -> Executor:
+    return ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="io",
+                              initializer=initializer)
+
+
+cpu_pool = BoundedExecutor("ocr", _ocr_factory, OCR_WORKERS, OCR_QUEUE_LIMIT)
+io_pool = BoundedExecutor("io", _io_factory, IO_WORKERS, IO_QUEUE_LIMIT)
+
+
+async def run_cpu(fn, *args):
+    """Run a CPU-bound callable (OCR, vision) off the event loop."""
+    return await cpu_pool.run(fn, *args)
+
+
+async def run_io(fn, *args):
+    """Run a blocking I/O-bound callable (decode, hashing) off the event loop."""
+    return await io_pool.run(fn, *args)
+
+
+def shutdown():
+    cpu_pool.shutdown()
+    io_pool.shutdown()
@@ -0,0 +1,167 @@
+# app/services/frame_diff.py
+import os
+
+import numpy as np
+from PIL import Image
+
+from app.services import metrics
+from app.services.executor import run_io
+from app.services.ocr_result import OcrResult
+from app.services.ocr_service import ocr_images, run_ocr_cached
+from app.utils.image_utils import merge_boxes
+
+# --- Config ---
+FRAME_TILE_SIZE = int(os.getenv("FRAME_TILE_SIZE", "64"))
+# Per-pixel grayscale delta that counts as a change (absorbs JPEG noise)
+FRAME_PIXEL_THRESHOLD = int(os.getenv("FRAME_PIXEL_THRESHOLD", "24"))
+# Changed pixels needed before a tile is considered dirty
+FRAME_TILE_MIN_PIXELS = int(os.getenv("FRAME_TILE_MIN_PIXELS", "4"))
+# Above this fraction of dirty tiles a full-frame OCR is cheaper
+FRAME_FULL_OCR_RATIO = float(os.getenv("FRAME_FULL_OCR_RATIO", "0.5"))
+# Extra pixels around a dirty region so words on its edge are read whole
+FRAME_REGION_PADDING = int(os.getenv("FRAME_REGION_PADDING", "8"))
+
+
+def dirty_tiles(prev: np.ndarray, cur: np.ndarray, tile: int = FRAME_TILE_SIZE,
+                threshold: int = FRAME_PIXEL_THRESHOLD,
+                min_pixels: int = FRAME_TILE_MIN_PIXELS) -> np.ndarray:
+    """
+    Compare two equally sized grayscale frames and return a boolean
+    (rows, cols) grid marking tiles with at least `min_pixels` changed pixels.
+    """
+    h, w = cur.shape
+    changed = np.abs(cur.astype(np.int16) - prev.astype(np.int16)) > threshold
+    rows, cols = -(-h // tile), -(-w // tile)
+    padded = np.zeros((rows * tile, cols * tile), dtype=bool)
+    padded[:h, :w] = changed
+    counts = padded.reshape(rows, tile, cols, tile).sum(axis=(1, 3))
+    return counts >= min_pixels
+
+
+def tile_regions(mask: np.ndarray, tile: int, width: int, height: int):
+    """
+    Group 4-connected dirty tiles and return one [x1, y1, x2, y2] pixel box
+    per group, clipped to the frame.
+    """
+    seen = np.zeros_like(mask)
+    regions = []
+    for r, c in zip(*np.nonzero(mask)):
+        if seen[r, c]:
+            continue
+        stack = [(r, c)]
+        seen[r, c] = True
+        r1, c1, r2, c2 = r, c, r, c
+        while stack:
+            y, x = stack.pop()
+            r1, c1, r2, c2 = min(r1, y), min(c1, x), max(r2, y), max(c2, x)
+            for ny, nx in ((y - 1, x), (y + 1, x), (y, x - 1), (y, x + 1)):
+                if 0 <= ny < mask.shape[0] and 0 <= nx < mask.shape[1] \
+                        and mask[ny, nx] and not seen[ny, nx]:
+                    seen[ny, nx] = True
+                    stack.append((ny, nx))
+        regions.append([int(c1 * tile), int(r1 * tile),
+                        int(min((c2 + 1) * tile, width)), int(min((r2 + 1) * tile, height))])
+    return regions
+
+
+def _touching(boxes: np.ndarray, region) -> np.ndarray:
+    """Mask of (N, 4) boxes that overlap `region`."""
+    return ((boxes[:, 0] < region[2]) & (region[0] < boxes[:, 2])
+            & (boxes[:, 1] < region[3]) & (region[1] < boxes[:, 3]))
+
+
+def _centered_in(boxes: np.ndarray, region) -> np.ndarray:
+    """Mask of (N, 4) boxes whose centre lies inside `region`."""
+    cx = (boxes[:, 0] + boxes[:, 2]) / 2
+    cy = (boxes[:, 1] + boxes[:, 3]) / 2
+    return (region[0] <= cx) & (cx < region[2]) & (region[1] <= cy) & (cy < region[3])
+
+
+def _grow(regions, boxes: np.ndarray, pad: int, width: int, height: int) -> list:
+    """
+    Grow regions over the previous words they touch (plus `pad`) until no
+    word touches a region without lying inside it, so every touched word is
+    re-read whole and none is half dropped. Regions that meet are merged.
+    """
+    regions = merge_boxes(regions)
+    while True:
+        grown = False
+        for region in regions:
+            hit = boxes[_touching(boxes, region)]
+            if not len(hit):
+                continue
+            bigger = [max(0, min(region[0], int(hit[:, 0].min()) - pad)),
+                      max(0, min(region[1], int(hit[:, 1].min()) - pad)),
+                      min(width, max(region[2], int(hit[:, 2].max()) + pad)),
+                      min(height, max(region[3], int(hit[:, 3].max()) + pad))]
+            if bigger != region:
+                region[:] = bigger
+                grown = True
+        if not grown:
+            return regions
+        regions = merge_boxes(regions)
+
+
+class FrameState:
+    """
+    Per-connection OCR state for the screen stream. Each new frame is diffed
+    against the previous one on a tile grid; only changed regions are sent to
+    Tesseract and merged with the cached words from the unchanged tiles.
+    """
+
+    def __init__(self, tile: int = FRAME_TILE_SIZE):
+        self.tile = tile
+        self.gray: np.ndarray | None = None
+        self.result: OcrResult | None = None
+
+    def reset(self):
+        self.gray = None
+        self.result = None
+
+    def _plan(self, img: Image.Image):
+        """Return (gray, regions); regions is None when a full OCR is needed."""
+        gray = np.asarray(img.convert("L"))
+        if self.gray is None or self.result is None or self.gray.shape != gray.shape:
+            return gray, None
+        mask = dirty_tiles(self.gray, gray, self.tile)
+        if mask.mean() > FRAME_FULL_OCR_RATIO:
+            return gray, None
+        h, w = gray.shape
+        regions = tile_regions(mask, self.tile, w, h)
+        return gray, _grow(regions, self.result.boxes, FRAME_REGION_PADDING, w, h)
+
+    async def ocr(self, img: Image.Image, profile: str | None = None) -> OcrResult:
+        gray, regions = await run_io(self._plan, img)
+
+        if regions is None:
+            metrics.incr("frame_diff.full")
+            result = await run_ocr_cached(img, profile)
+        elif not regions:
+            metrics.incr("frame_diff.unchanged")
+            result = self.result
+        else:
+            metrics.incr("frame_diff.partial")
+            metrics.incr("frame_diff.regions", len(regions))
+            w, h = img.size
+            pad = FRAME_REGION_PADDING
+            crops = [
+                (max(0, r[0] - pad), max(0, r[1] - pad), min(w, r[2] + pad), min(h, r[3] + pad))
+                for r in regions
+            ]
+            # All dirty crops go to one warm OCR worker as a single batch
+            results, _ = await ocr_images(
+                [img.crop(box) for box in crops], [(box[0], box[1]) for box in crops], profile
+            )
+            # Regions are grown so every previous word they touch lies inside
+            # one; old and new words are then owned by the same centre rule
+            prev = self.result
+            stale = np.zeros(len(prev), dtype=bool)
+            for region in regions:
+                stale |= _centered_in(prev.boxes, region)
+            fresh = [found.select(_centered_in(found.boxes, region))
+                     for region, found in zip(regions, results)]
+            result = OcrResult.concat([prev.select(~stale)] + fresh).sorted()
+
+        self.gray = gray
+        self.result = result
+        return result
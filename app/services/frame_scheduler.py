@@ -0,0 +1,113 @@
+# app/services/frame_scheduler.py
+import asyncio
+import os
+from collections import deque
+
+from app.services import metrics
+
+# --- Config ---
+# Cancel the frame in the first stage when a newer one arrives
+WS_CANCEL_INFLIGHT = os.getenv("WS_CANCEL_INFLIGHT", "true").lower() not in ("0", "false", "no")
+# After this many back-to-back cancellations the in-flight frame is allowed to
+# finish, so a client sending faster than we can answer still gets results
+WS_MAX_CONSECUTIVE_CANCELS = int(os.getenv("WS_MAX_CONSECUTIVE_CANCELS", "2"))
+# Frames allowed to wait in front of each stage; the oldest is dropped beyond that
+WS_STAGE_QUEUE_SIZE = int(os.getenv("WS_STAGE_QUEUE_SIZE", "1"))
+
+
+class FramePipeline:
+    """
+    Per-connection, latest-frame-wins pipeline for the screen stream.
+
+    `stages` are async callables run in order; each stage has its own worker,
+    so frame N+1 can be in stage 0 (decode/OCR) while frame N is in stage 1
+    (LLM). A stage returns the input for the next stage, or None to stop the
+    frame there. Each stage processes one frame at a time in arrival order, so
+    results are delivered in order.
+
+    At most `queue_size` frames wait in front of a stage; a newer frame drops
+    the oldest waiting one ("superseded") and, when enabled, cancels the frame
+    in stage 0 ("cancelled"). `on_skip(frame_id, reason, latest_id)` is awaited
+    for every frame that will not get a result.
+    """
+
+    def __init__(self, stages, on_skip, queue_size: int = WS_STAGE_QUEUE_SIZE,
+                 cancel_inflight: bool = WS_CANCEL_INFLIGHT,
+                 max_consecutive_cancels: int = WS_MAX_CONSECUTIVE_CANCELS):
+        self.stages = list(stages)
+        self.on_skip = on_skip
+        self.queue_size = max(1, queue_size)
+        self.cancel_inflight = cancel_inflight
+        self.max_consecutive_cancels = max_consecutive_cancels
+        self._queues = [deque() for _ in self.stages]        # (frame_id, item) waiting
+        self._wakeups = [asyncio.Event() for _ in self.stages]
+        self._current = [None] * len(self.stages)           # (frame_id, task) running
+        self._revoked = set()                                # cancelled tasks, even if they finish anyway
+        self._workers = []
+        self._cancels = 0
+        self._closed = False
+
+    async def submit(self, frame_id, frame):
+        metrics.incr("ws.frames")
+        await self._enqueue(0, frame_id, frame)
+
+        current = self._current[0]
+        if (current is not None and self.cancel_inflight and not current[1].done()
+                and self._cancels < self.max_consecutive_cancels):
+            self._cancels += 1
+            current[1].cancel()
+            self._revoked.add(current[1])
+            metrics.incr("ws.cancelled")
+            await self.on_skip(current[0], "cancelled", frame_id)
+
+        if not self._workers:
+            self._workers = [asyncio.create_task(self._run(i)) for i in range(len(self.stages))]
+
+    async def _enqueue(self, stage: int, frame_id, item):
+        queue = self._queues[stage]
+        while len(queue) >= self.queue_size:
+            stale_id, _ = queue.popleft()
+            metrics.incr("ws.skipped")
+            await self.on_skip(stale_id, "superseded", frame_id)
+        queue.append((frame_id, item))
+        self._wakeups[stage].set()
+
+    async def _run(self, stage: int):
+        queue, wakeup = self._queues[stage], self._wakeups[stage]
+        while True:
+            await wakeup.wait()
+            wakeup.clear()
+            while queue:
+                frame_id, item = queue.popleft()
+                task = asyncio.create_task(self.stages[stage](item))
+                self._current[stage] = (frame_id, task)
+                try:
+                    result = await task
+                except asyncio.CancelledError:
+                    if self._closed or not task.cancelled():
+                        raise
+                    self._revoked.discard(task)
+                    continue
+                except Exception as e:
+                    print(f"Frame {frame_id} failed in stage {stage}: {e}")
+                    continue
+                finally:
+                    self._current[stage] = None
+                if task in self._revoked:
+                    # The client was already told this frame was cancelled
+                    self._revoked.discard(task)
+                    continue
+                if stage == 0:
+                    self._cancels = 0
+                if result is not None and stage + 1 < len(self.stages):
+                    await self._enqueue(stage + 1, frame_id, result)
+
+    async def close(self):
+        """Cancel queued and in-flight work (connection closed)."""
+        self._closed = True
+        for queue in self._queues:
+            queue.clear()
+        tasks = list(self._workers) + [c[1] for c in self._current if c is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,522 @@
+# app/services/guide_index.py
+import asyncio
+import math
+import os
+import re
+import threading
+import time
+from collections import Counter
+from contextlib import suppress
+
+import numpy as np
+
+from sqlalchemy.orm import selectinload
+
+from app import database, models
+from app.services import metrics
+from app.services.executor import run_io
+
+# --- Config ---
+GUIDE_MATCH_ENABLED = os.getenv("GUIDE_MATCH_ENABLED", "true").lower() not in ("0", "false", "no")
+# Confidence (0-1) above which a recorded guide answers instead of the LLM
+GUIDE_MATCH_THRESHOLD = float(os.getenv("GUIDE_MATCH_THRESHOLD", "0.55"))
+# Share of the confidence that comes from the question; the rest from the screen
+GUIDE_MATCH_QUESTION_WEIGHT = float(os.getenv("GUIDE_MATCH_QUESTION_WEIGHT", "0.7"))
+# Share of one step's words that must be on screen before a guide can match at all
+GUIDE_MATCH_MIN_COVERAGE = float(os.getenv("GUIDE_MATCH_MIN_COVERAGE", "0.5"))
+# Background reload from the database, to pick up guides written by other workers
+GUIDE_INDEX_REFRESH = float(os.getenv("GUIDE_INDEX_REFRESH", "300"))
+# Deleted/replaced rows tolerated before the index is rebuilt (at least the live count)
+GUIDE_INDEX_COMPACT_MIN = int(os.getenv("GUIDE_INDEX_COMPACT_MIN", "1024"))
+# Top BM25 hits for the question that are scored for a confident match
+GUIDE_MATCH_CANDIDATES = int(os.getenv("GUIDE_MATCH_CANDIDATES", "20"))
+GUIDE_BM25_K1 = float(os.getenv("GUIDE_BM25_K1", "1.2"))
+GUIDE_BM25_B = float(os.getenv("GUIDE_BM25_B", "0.75"))
+# Guides returned by the recommendation endpoint, and the weight of question words there
+GUIDE_RECOMMEND_LIMIT = int(os.getenv("GUIDE_RECOMMEND_LIMIT", "5"))
+GUIDE_RECOMMEND_MAX_LIMIT = int(os.getenv("GUIDE_RECOMMEND_MAX_LIMIT", "50"))
+GUIDE_RECOMMEND_QUESTION_BOOST = float(os.getenv("GUIDE_RECOMMEND_QUESTION_BOOST", "2"))
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+STOPWORDS = frozenset("""
+a an and are as at be by can do does for from how i in into is it me my of on or please
+show so tell that the then this to up what when where which with you your
+""".split())
+
+
+# Instruction verbs that name an action, not something shown on screen
+ACTION_WORDS = frozenset("""
+choose click enter find go navigate open press scroll select tap type
+""".split())
+
+
+def tokenize(text: str) -> list:
+    """Lower-cased word tokens without stopwords and single characters."""
+    return [t for t in _TOKEN.findall((text or "").lower()) if len(t) > 1 and t not in STOPWORDS]
+
+
+def doc_from_guide(guide) -> dict:
+    """Index document for a models.Guide (steps and access list loaded)."""
+    steps = sorted(guide.steps or [], key=lambda s: s.step_number)
+    return {
+        "id": guide.id,
+        "name": guide.name,
+        "shortcut": guide.shortcut,
+        "description": guide.description or "",
+        "owner_id": guide.owner_id,
+        "is_public": bool(guide.is_public),
+        "emails": {a.email for a in guide.access_list or []},
+        "steps": [s.instruction for s in steps if s.instruction],
+    }
+
+
+def can_access(doc: dict, user) -> bool:
+    """Owner, public, or shared with the user's email (as for GET /guides/search)."""
+    return (doc["is_public"] or doc["owner_id"] == getattr(user, "id", None)
+            or getattr(user, "email", None) in doc["emails"])
+
+
+class _Column:
+    """Append-only NumPy column that doubles its capacity when full."""
+
+    def __init__(self, dtype, capacity: int = 8):
+        self.data = np.zeros(capacity, dtype=dtype)
+        self.size = 0
+
+    def append(self, value):
+        if self.size == len(self.data):
+            self.data = np.concatenate([self.data, np.zeros_like(self.data)])
+        self.data[self.size] = value
+        self.size += 1
+
+    def view(self) -> np.ndarray:
+        return self.data[:self.size]
+
+
+class GuideIndex:
+    """
+    In-memory BM25 index over guide names, descriptions and step
+    instructions. Every indexed guide is a row; each term keeps a posting
+    list of (row, term frequency) as NumPy columns, so a query scores all
+    guides with a few vectorized operations per query term.
+
+    Updates append a new row and tombstone the old one; the index is
+    rebuilt once tombstones outnumber live rows. Loaded lazily from the
+    database and kept current by the guide routes.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._loaded_at = None
+        # {guide id: doc or None} written while a reload builds aside
+        self._changes = None
+        self._reset()
+
+    def _reset(self):
+        self._vocab = {}          # term -> term id
+        self._df = _Column(np.int32)
+        self._post_rows = []      # term id -> _Column of rows
+        self._post_tf = []        # term id -> _Column of term frequencies
+        self._row_of = {}         # guide id -> row
+        self._row_docs = []       # row -> doc (None once dropped)
+        self._length = _Column(np.float32)
+        self._owner = _Column(np.int64)
+        self._public = _Column(np.bool_)
+        self._has_steps = _Column(np.bool_)
+        self._alive = _Column(np.bool_)
+        self._terms = {}          # guide id -> Counter of text terms
+        self._title_terms = {}    # guide id -> Counter of name/shortcut/description terms
+        self._step_terms = {}     # guide id -> [set of on-screen words per step]
+        self._shared = {}         # email -> set of guide ids
+        self._total_length = 0
+        self._dead = 0
+
+    def __len__(self):
+        return len(self._row_of)
+
+    # --- maintenance ---
+    def add(self, doc: dict):
+        with self._lock:
+            self._insert(doc)
+            self._note(doc["id"], doc)
+
+    def _note(self, guide_id, doc):
+        if self._changes is not None:
+            self._changes[guide_id] = doc
+
+    def _insert(self, doc: dict):
+        text = " ".join([doc["name"], doc["name"], doc["shortcut"], doc["description"], *doc["steps"]])
+        terms = Counter(tokenize(text))
+        self._drop(doc["id"])
+        row = len(self._row_docs)
+        self._row_of[doc["id"]] = row
+        self._row_docs.append(doc)
+        self._terms[doc["id"]] = terms
+        self._title_terms[doc["id"]] = Counter(tokenize(" ".join(
+            [doc["name"], doc["name"], doc["shortcut"], doc["description"]])))
+        self._step_terms[doc["id"]] = [set(tokenize(step)) - ACTION_WORDS for step in doc["steps"]]
+        length = sum(terms.values())
+        self._length.append(length)
+        self._total_length += length
+        self._owner.append(doc["owner_id"] if doc["owner_id"] is not None else -1)
+        self._public.append(doc["is_public"])
+        self._has_steps.append(bool(doc["steps"]))
+        self._alive.append(True)
+        for email in doc["emails"]:
+            self._shared.setdefault(email, set()).add(doc["id"])
+        for term, count in terms.items():
+            tid = self._vocab.get(term)
+            if tid is None:
+                tid = self._vocab[term] = len(self._post_rows)
+                self._post_rows.append(_Column(np.int32, 4))
+                self._post_tf.append(_Column(np.float32, 4))
+                self._df.append(0)
+            self._post_rows[tid].append(row)
+            self._post_tf[tid].append(count)
+            self._df.data[tid] += 1
+
+    def remove(self, guide_id: int):
+        with self._lock:
+            self._drop(guide_id)
+            self._note(guide_id, None)
+
+    def _drop(self, guide_id):
+        row = self._row_of.pop(guide_id, None)
+        if row is None:
+            return
+        doc = self._row_docs[row]
+        terms = self._terms.pop(guide_id)
+        self._title_terms.pop(guide_id, None)
+        self._step_terms.pop(guide_id, None)
+        self._row_docs[row] = None
+        self._alive.data[row] = False
+        self._total_length -= sum(terms.values())
+        for term in terms:
+            self._df.data[self._vocab[term]] -= 1
+        for email in doc["emails"]:
+            ids = self._shared.get(email)
+            if ids is not None:
+                ids.discard(guide_id)
+                if not ids:
+                    del self._shared[email]
+        self._dead += 1
+        if self._dead > max(GUIDE_INDEX_COMPACT_MIN, len(self._row_of)):
+            self._compact()
+
+    def _compact(self):
+        """Rebuild without tombstoned rows and postings."""
+        docs = [doc for doc in self._row_docs if doc is not None]
+        self._reset()
+        for doc in docs:
+            self._insert(doc)
+        metrics.incr("guide_index.compactions")
+
+    def upsert(self, guide):
+        """Re-index a guide after it was created or changed (no-op before the first load)."""
+        if self._loaded_at is not None:
+            self.add(doc_from_guide(guide))
+
+    def get(self, guide_id):
+        """Indexed doc of a guide, or None."""
+        with self._lock:
+            row = self._row_of.get(guide_id)
+            return None if row is None else self._row_docs[row]
+
+    def refresh_guides(self, db, guide_ids) -> dict:
+        """
+        Re-read `guide_ids` from the database, re-indexing the ones that
+        changed and dropping the ones that are gone. Returns {id: doc} of
+        those that still exist.
+        """
+        guides = db.query(models.Guide).options(
+            selectinload(models.Guide.steps), selectinload(models.Guide.access_list)
+        ).filter(models.Guide.id.in_(list(guide_ids))).all()
+        docs = {g.id: doc_from_guide(g) for g in guides}
+        with self._lock:
+            for guide_id in guide_ids:
+                doc = docs.get(guide_id)
+                if doc is None:
+                    self._drop(guide_id)
+                    self._note(guide_id, None)
+                elif guide_id not in self._row_of or self._row_docs[self._row_of[guide_id]] != doc:
+                    self._insert(doc)
+                    self._note(guide_id, doc)
+        return docs
+
+    @property
+    def loaded(self) -> bool:
+        return self._loaded_at is not None
+
+    def load(self, db):
+        """
+        Replace the index with every guide in the database. The new index is
+        built aside and swapped in, so queries never wait for a rebuild;
+        guides changed while it was built are applied again on top.
+        """
+        with self._lock:
+            self._changes = {}
+        try:
+            guides = db.query(models.Guide).options(
+                selectinload(models.Guide.steps), selectinload(models.Guide.access_list)).all()
+            fresh = GuideIndex()
+            for guide in guides:
+                fresh._insert(doc_from_guide(guide))
+            with self._lock:
+                old = self._adopt(fresh)
+                for guide_id, doc in self._changes.items():
+                    if doc is None:
+                        self._drop(guide_id)
+                    else:
+                        self._insert(doc)
+        finally:
+            with self._lock:
+                self._changes = None
+        # The old index is freed here, outside the lock
+        old = None
+        self._loaded_at = time.monotonic()
+        metrics.incr("guide_index.loads")
+
+    def _adopt(self, other: "GuideIndex") -> dict:
+        """Take over the rows and postings of `other` (caller holds the lock); returns the old ones."""
+        own = ("_lock", "_load_lock", "_loaded_at", "_changes")
+        state = {k: v for k, v in vars(other).items() if k not in own}
+        old = {k: self.__dict__[k] for k in state}
+        self.__dict__.update(state)
+        return old
+
+    def ensure_loaded(self):
+        """Load on first use; concurrent first callers wait for one load."""
+        if self._loaded_at is not None:
+            return
+        with self._load_lock:
+            if self._loaded_at is None:
+                self._reload()
+
+    def reload(self):
+        """Reload from the database (the background refresh)."""
+        with self._load_lock:
+            self._reload()
+
+    def _reload(self):
+        db = database.SessionLocal()
+        try:
+            self.load(db)
+        except Exception as e:
+            print(f"Could not load guide index: {e}")
+            if self._loaded_at is None:
+                # Serve an empty index until the next background refresh
+                self._loaded_at = time.monotonic()
+        finally:
+            db.close()
+
+    # --- scoring (callers hold the lock) ---
+    def _bm25(self, weights: dict) -> np.ndarray:
+        """BM25 score of every row for {term id: query weight}."""
+        scores = np.zeros(len(self._row_docs), dtype=np.float32)
+        live = len(self._row_of)
+        if not live:
+            return scores
+        avgdl = max(self._total_length / live, 1.0)
+        lengths = self._length.view()
+        for tid, weight in weights.items():
+            df = int(self._df.data[tid])
+            if not df:
+                continue
+            idf = math.log(1 + (live - df + 0.5) / (df + 0.5))
+            rows, tf = self._post_rows[tid].view(), self._post_tf[tid].view()
+            # Rows are unique within a posting list, so fancy-index += is safe
+            scores[rows] += (weight * idf) * tf * (GUIDE_BM25_K1 + 1) / (
+                tf + GUIDE_BM25_K1 * (1 - GUIDE_BM25_B + GUIDE_BM25_B * lengths[rows] / avgdl))
+        return scores
+
+    def _top(self, scores: np.ndarray, user, limit: int) -> list:
+        """Best-scoring rows `user` can access and that have steps, best first."""
+        rows = np.flatnonzero(scores > 0)
+        rows = rows[self._alive.data[rows] & self._has_steps.data[rows]]
+        allowed = self._public.data[rows].copy()
+        user_id = getattr(user, "id", None)
+        if user_id is not None:
+            allowed |= self._owner.data[rows] == user_id
+        shared = self._shared.get(getattr(user, "email", None))
+        if shared:
+            allowed |= np.isin(rows, [self._row_of[g] for g in shared])
+        rows = rows[allowed]
+        if len(rows) > limit:
+            rows = rows[np.argpartition(-scores[rows], limit - 1)[:limit]]
+        return rows[np.argsort(-scores[rows], kind="stable")].tolist()
+
+    def _weights(self, terms: dict) -> dict:
+        return {self._vocab[t]: w for t, w in terms.items() if t in self._vocab}
+
+    def _idf(self, term: str) -> float:
+        tid = self._vocab.get(term)
+        df = int(self._df.data[tid]) if tid is not None else 0
+        return math.log((len(self._row_of) + 1) / (df + 1)) + 1
+
+    def _screen_coverage(self, guide_id, screen: set) -> float:
+        """Largest idf-weighted share of one step's words visible on screen."""
+        best = 0.0
+        for words in self._step_terms[guide_id]:
+            total = sum(self._idf(t) for t in words)
+            if total:
+                best = max(best, sum(self._idf(t) for t in words if t in screen) / total)
+        return best
+
+    def match(self, question: str, screen_text: str, user, threshold: float = GUIDE_MATCH_THRESHOLD):
+        """
+        Best guide the user can access for `question` on a screen showing
+        `screen_text`, or None below `threshold`. The top BM25 candidates
+        for the question must show at least GUIDE_MATCH_MIN_COVERAGE of
+        some step's words on screen; their confidence then mixes the TF-IDF
+        cosine of the question with the guide's name and description, and
+        that screen coverage.
+        """
+        query = Counter(tokenize(question))
+        if not query:
+            return None
+        screen = set(tokenize(screen_text))
+        with self._lock:
+            candidates = self._top(self._bm25(self._weights(query)), user, GUIDE_MATCH_CANDIDATES)
+            idf = {t: self._idf(t) for t in query}
+            q_norm = math.sqrt(sum((c * idf[t]) ** 2 for t, c in query.items()))
+            best = None
+            for row in candidates:
+                doc = self._row_docs[row]
+                coverage = self._screen_coverage(doc["id"], screen)
+                if coverage < GUIDE_MATCH_MIN_COVERAGE:
+                    continue
+                weights = {t: c * self._idf(t) for t, c in self._title_terms[doc["id"]].items()}
+                d_norm = math.sqrt(sum(w * w for w in weights.values()))
+                dot = sum(c * idf[t] * weights.get(t, 0.0) for t, c in query.items())
+                cosine = dot / (q_norm * d_norm) if d_norm else 0.0
+                score = GUIDE_MATCH_QUESTION_WEIGHT * cosine + (1 - GUIDE_MATCH_QUESTION_WEIGHT) * coverage
+                if best is None or score > best[0]:
+                    best = (score, doc)
+        if best is None or best[0] < threshold:
+            metrics.incr("guide_match.miss")
+            return None
+        metrics.incr("guide_match.hit")
+        score, doc = best
+        return {"id": doc["id"], "name": doc["name"], "shortcut": doc["shortcut"],
+                "score": round(score, 3), "steps": list(doc["steps"])}
+
+    def recommend(self, screen_text: str, user, question: str = "", limit: int = GUIDE_RECOMMEND_LIMIT) -> list:
+        """
+        Guides the user can access ranked by BM25 relevance to what is on
+        screen. Every distinct screen word counts once (menus repeat words);
+        words of an optional `question` count GUIDE_RECOMMEND_QUESTION_BOOST
+        times as much.
+        """
+        terms = dict.fromkeys(tokenize(screen_text), 1.0)
+        for term, count in Counter(tokenize(question)).items():
+            terms[term] = terms.get(term, 0.0) + GUIDE_RECOMMEND_QUESTION_BOOST * count
+        if not terms or limit <= 0:
+            return []
+        with self._lock:
+            scores = self._bm25(self._weights(terms))
+            rows = self._top(scores, user, limit)
+            found = [(self._row_docs[row], float(scores[row])) for row in rows]
+        metrics.incr("guide_recommend.queries")
+        return [{"id": doc["id"], "name": doc["name"], "shortcut": doc["shortcut"],
+                 "description": doc["description"], "step_count": len(doc["steps"]),
+                 "score": round(score, 3)} for doc, score in found]
+
+
+def guide_answer(match: dict) -> dict:
+    """plan_actions-shaped result built from a matched guide."""
+    return {
+        "steps": match["steps"],
+        "source": "guide",
+        "guide": {k: match[k] for k in ("id", "name", "shortcut", "score")},
+    }
+
+
+def confirm_access(guide_ids, user) -> dict:
+    """
+    {id: current doc} of the guides in `guide_ids` that `user` can still
+    access, read from the database: another worker may have deleted,
+    unshared or made private a guide since this worker's index last saw it.
+    Fails closed.
+    """
+    db = database.SessionLocal()
+    try:
+        docs = guide_index.refresh_guides(db, guide_ids)
+    except Exception as e:
+        print(f"Could not confirm guide access: {e}")
+        return {}
+    finally:
+        db.close()
+    allowed = {guide_id: doc for guide_id, doc in docs.items() if doc["steps"] and can_access(doc, user)}
+    if len(allowed) < len(guide_ids):
+        metrics.incr("guide_index.revoked", len(guide_ids) - len(allowed))
+    return allowed
+
+
+async def match_guide(question: str, ocr, user):
+    """Guide answer for the analyze pipeline, or None to ask the LLM."""
+    if not GUIDE_MATCH_ENABLED or user is None:
+        return None
+    screen_text = " ".join(ocr.text.tolist()) if len(ocr) else ""
+
+    def run():
+        guide_index.ensure_loaded()
+        # A stale match is re-indexed by confirm_access; the retry sees the fix
+        for _ in range(2):
+            match = guide_index.match(question, screen_text, user)
+            if match is None:
+                return None
+            doc = confirm_access([match["id"]], user).get(match["id"])
+            if doc is not None:
+                return {**match, "name": doc["name"], "shortcut": doc["shortcut"], "steps": list(doc["steps"])}
+        return None
+
+    match = await run_io(run)
+    return guide_answer(match) if match else None
+
+
+async def recommend_guides(screen_text: str, user, question: str = "", limit: int = GUIDE_RECOMMEND_LIMIT) -> list:
+    """Ranked guides for a screen, off the event loop, checked against the database."""
+
+    def run():
+        guide_index.ensure_loaded()
+        # Ask for spares so guides revoked elsewhere do not shorten the list
+        ranked = guide_index.recommend(screen_text, user, question, 2 * limit)
+        allowed = confirm_access([g["id"] for g in ranked], user) if ranked else {}
+        return [{**g, "name": allowed[g["id"]]["name"], "shortcut": allowed[g["id"]]["shortcut"],
+                 "description": allowed[g["id"]]["description"], "step_count": len(allowed[g["id"]]["steps"])}
+                for g in ranked if g["id"] in allowed][:limit]
+
+    return await run_io(run)
+
+
+guide_index = GuideIndex()
+_refresh_task = None
+
+
+async def _refresh_loop():
+    while True:
+        await asyncio.sleep(GUIDE_INDEX_REFRESH)
+        if not guide_index.loaded:
+            continue
+        try:
+            await run_io(guide_index.reload)
+        except Exception as e:
+            # e.g. a saturated io pool under load; try again next round
+            print(f"Guide index refresh failed: {e}")
+
+
+def start_refresh():
+    """Reload the index every GUIDE_INDEX_REFRESH seconds, outside any request."""
+    global _refresh_task
+    if GUIDE_INDEX_REFRESH > 0 and (_refresh_task is None or _refresh_task.done()):
+        _refresh_task = asyncio.get_running_loop().create_task(_refresh_loop())
+
+
+async def stop_refresh():
+    global _refresh_task
+    task, _refresh_task = _refresh_task, None
+    if task is not None:
+        task.cancel()
+        with suppress(asyncio.CancelledError):
+            await task
@@ -0,0 +1,253 @@
+# app/services/jobs.py
+import asyncio
+import json
+import multiprocessing
+import os
+import threading
+import time
+import uuid
+
+from cachetools import TTLCache
+
+from app.services import metrics
+from app.services.executor import ExecutorSaturated
+
+# --- Config ---
+# "memory" keeps jobs in this worker process; "redis" shares them between
+# uvicorn workers (needs REDIS_URL, e.g. redis://localhost:6379/0). With the
+# memory store async jobs are refused when several uvicorn workers serve the
+# app, as polls would land on workers that never saw the job.
+JOB_STORE = os.getenv("JOB_STORE", "memory")
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+# Finished (and abandoned) jobs are forgotten after this many seconds
+JOB_TTL = int(os.getenv("JOB_TTL", "3600"))
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+# Jobs waiting for a worker; submissions beyond this are rejected
+JOB_QUEUE_LIMIT = int(os.getenv("JOB_QUEUE_LIMIT", "100"))
+JOB_MAX_ENTRIES = int(os.getenv("JOB_MAX_ENTRIES", "10000"))
+
+FINAL_STATES = ("done", "failed")
+
+
+class JobQueueFull(Exception):
+    """Raised when JOB_QUEUE_LIMIT jobs are already waiting."""
+
+
+class JobStoreNotShared(Exception):
+    """Raised when jobs would live in one of several worker processes."""
+
+
+def several_workers() -> bool:
+    """
+    Whether this process is one of several app workers. WEB_CONCURRENCY
+    (uvicorn's --workers default) decides when set; otherwise uvicorn runs
+    the app in a spawned child process only for --workers > 1 (or --reload).
+    """
+    configured = os.getenv("WEB_CONCURRENCY")
+    if configured:
+        return int(configured) > 1
+    return multiprocessing.parent_process() is not None
+
+
+# --- Job stores ---
+class JobStore:
+    """Keeps job records: {id, owner, status, created_at, finished_at, result, error}."""
+
+    # Whether every app worker process sees the same jobs
+    shared = True
+
+    async def save(self, job: dict):
+        raise NotImplementedError
+
+    async def get(self, job_id: str) -> dict | None:
+        raise NotImplementedError
+
+    async def wait(self, job_id: str, timeout: float) -> dict | None:
+        """Return the job once it is finished, or as it is after `timeout` seconds."""
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+
+class MemoryJobStore(JobStore):
+    """Process-local store; jobs are only visible to the worker that ran them."""
+
+    shared = False
+
+    def __init__(self, ttl: int = JOB_TTL, max_entries: int = JOB_MAX_ENTRIES):
+        self._jobs = TTLCache(maxsize=max_entries, ttl=ttl)
+        self._lock = threading.Lock()
+        self._events = {}  # job id -> [event, number of waiters]
+
+    async def save(self, job: dict):
+        with self._lock:
+            self._jobs[job["id"]] = dict(job)
+        if job["status"] in FINAL_STATES:
+            entry = self._events.pop(job["id"], None)
+            if entry is not None:
+                entry[0].set()
+
+    async def get(self, job_id: str) -> dict | None:
+        with self._lock:
+            job = self._jobs.get(job_id)
+        return dict(job) if job is not None else None
+
+    async def wait(self, job_id: str, timeout: float) -> dict | None:
+        job = await self.get(job_id)
+        if job is None or job["status"] in FINAL_STATES or timeout <= 0:
+            return job
+        entry = self._events.setdefault(job_id, [asyncio.Event(), 0])
+        entry[1] += 1
+        try:
+            await asyncio.wait_for(entry[0].wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            # The last waiter to give up removes the event
+            entry[1] -= 1
+            if entry[1] == 0 and self._events.get(job_id) is entry:
+                del self._events[job_id]
+        return await self.get(job_id)
+
+
+class RedisJobStore(JobStore):
+    """Shared store: one JSON value per job with a TTL, plus a pub/sub channel for waiters."""
+
+    def __init__(self, url: str = REDIS_URL, ttl: int = JOB_TTL, prefix: str = "nexaura:job:"):
+        import redis.asyncio as redis
+
+        self.redis = redis.from_url(url)
+        self.ttl = ttl
+        self.prefix = prefix
+
+    async def save(self, job: dict):
+        key = self.prefix + job["id"]
+        await self.redis.set(key, json.dumps(job), ex=self.ttl)
+        if job["status"] in FINAL_STATES:
+            await self.redis.publish(key, job["status"])
+
+    async def get(self, job_id: str) -> dict | None:
+        raw = await self.redis.get(self.prefix + job_id)
+        return json.loads(raw) if raw is not None else None
+
+    async def wait(self, job_id: str, timeout: float) -> dict | None:
+        key = self.prefix + job_id
+        async with self.redis.pubsub() as pubsub:
+            # Subscribe before reading so a completion in between is not missed
+            await pubsub.subscribe(key)
+            job = await self.get(job_id)
+            deadline = time.monotonic() + timeout
+            while job is not None and job["status"] not in FINAL_STATES:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=remaining)
+                if message is not None:
+                    job = await self.get(job_id)
+        return job
+
+    async def close(self):
+        await self.redis.aclose()
+
+
+def build_store(kind: str = JOB_STORE) -> JobStore:
+    if kind == "redis":
+        return RedisJobStore()
+    return MemoryJobStore()
+
+
+# --- Worker queue ---
+class JobQueue:
+    """
+    Bounded queue of analysis jobs drained by JOB_WORKERS asyncio workers.
+    The heavy stages already run in the OCR/IO pools, so workers only need
+    to cap how many jobs are in flight at once.
+    """
+
+    def __init__(self, store: JobStore, workers: int = JOB_WORKERS, limit: int = JOB_QUEUE_LIMIT):
+        self.store = store
+        self.workers = max(1, workers)
+        self.limit = max(1, limit)
+        self._queue = None
+        self._loop = None
+        self._tasks = []
+
+    def _ensure_workers(self):
+        loop = asyncio.get_running_loop()
+        if self._queue is None or self._loop is not loop:
+            self._queue = asyncio.Queue(maxsize=self.limit)
+            self._loop = loop
+            self._tasks = [loop.create_task(self._worker(self._queue)) for _ in range(self.workers)]
+
+    @property
+    def depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    async def submit(self, job_fn, owner) -> dict:
+        """
+        Queue `job_fn` (an async callable returning a JSON-able result) and
+        return the new job record. Raises JobQueueFull when the queue is full
+        and JobStoreNotShared when other workers could not see the job.
+        """
+        if not self.store.shared and several_workers():
+            metrics.incr("jobs.rejected")
+            raise JobStoreNotShared("async jobs need JOB_STORE=redis with several workers")
+        self._ensure_workers()
+        if self._queue.full():
+            metrics.incr("jobs.rejected")
+            raise JobQueueFull("analysis job queue is full")
+        job = {
+            "id": uuid.uuid4().hex,
+            "owner": owner,
+            "status": "queued",
+            "created_at": time.time(),
+            "finished_at": None,
+            "result": None,
+            "error": None,
+        }
+        await self.store.save(job)
+        self._queue.put_nowait((job, job_fn))
+        metrics.incr("jobs.submitted")
+        return job
+
+    async def _worker(self, queue: asyncio.Queue):
+        while True:
+            job, job_fn = await queue.get()
+            try:
+                job["status"] = "running"
+                await self.store.save(job)
+                try:
+                    job["result"] = await job_fn()
+                    job["status"] = "done"
+                    metrics.incr("jobs.done")
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    print(f"Job {job['id']} failed: {e}")
+                    job["status"] = "failed"
+                    job["error"] = ("Server is busy, please retry shortly" if isinstance(e, ExecutorSaturated)
+                                    else "An error occurred during screen analysis")
+                    metrics.incr("jobs.failed")
+                job["finished_at"] = time.time()
+                await self.store.save(job)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Could not record job {job['id']}: {e}")
+            finally:
+                queue.task_done()
+
+    async def close(self):
+        tasks, self._tasks, self._queue = self._tasks, [], None
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await self.store.close()
+
+
+job_queue = JobQueue(build_store())
+
+
+async def shutdown():
+    await job_queue.close()
@@ -1,17 +1,57 @@
 import os
+import re
+import copy
 import json
+import random
+import asyncio
+import hashlib
+import threading
+import httpx
 import openai
+from cachetools import TTLCache
 from dotenv import load_dotenv
 
+from app.services import metrics
+from app.services.ocr_result import OcrResult
+from app.services.prompt_compaction import compact_screen, estimate_tokens
+from app.services.singleflight import SingleFlight
+
 # Load environment variables
 load_dotenv()
 
-# Initialize OpenAI client
-openai.api_key = os.getenv("OPENAI_API_KEY")
+# --- Client config ---
+# Point at a local stub server for tests/benchmarks, e.g. http://127.0.0.1:8080/v1
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL") or None
+LLM_MODEL = os.getenv("LLM_MODEL", "gpt-4o")
+# Per-attempt HTTP timeout and the overall deadline across retries (seconds)
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "20"))
+LLM_DEADLINE = float(os.getenv("LLM_DEADLINE", "45"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+LLM_RETRY_BASE_DELAY = float(os.getenv("LLM_RETRY_BASE_DELAY", "0.5"))
+# Completions in flight per worker process; extra callers wait their turn
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "20"))
+
+RETRYABLE_ERRORS = (
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+    openai.RateLimitError,
+    openai.InternalServerError,
+)
+
+# --- Response cache config ---
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "true").lower() not in ("0", "false", "no")
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", "600"))
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "2048"))
+
+FALLBACK_RESULT = {"steps": ["Sorry, I couldn't generate the steps. Please try again."]}
 
 SYSTEM_PROMPT = """
 You are an assistant that reads a description of a user interface and provides a concise sequence of steps
-to accomplish the user's requested task. Return a JSON object with fields:
+to accomplish the user's requested task. The screen text is given as lines grouped by screen region
+(top-left, top, top-right, left, center, right, bottom-left, bottom, bottom-right); "x3" marks a label seen 3 times.
+"ui" lists detected buttons, inputs, panels and icons per region with the text inside them.
+Return a JSON object with fields:
 - steps: list of human-friendly steps
 - highlights: optional list of regions {x,y,w,h,reason}
 Instructions for steps:
@@ -19,30 +59,333 @@ Instructions for steps:
 - Be concise and actionable
 """
 
-def plan_actions(vision, ocr_items, user_question: str):
-    prompt = json.dumps({
-        "vision": vision,
-        "ocr_items": ocr_items,
-        "user_question": user_question
-    }, indent=2)
+# One async client per worker, shared by every request for the app's lifetime.
+# It is created lazily on first use (tests swap in a stub client) and bound to
+# the event loop that created it.
+_client = None
+_client_loop = None
+_semaphore = None
+_semaphore_loop = None
 
-    resp = openai.chat.completions.create(
-        model="gpt-4o",
-        response_format={ "type": "json_object" }, # <--- FORCES CLEAN JSON
-        messages=[
+
+def _build_client():
+    http_client = httpx.AsyncClient(
+        limits=httpx.Limits(
+            max_connections=LLM_MAX_CONNECTIONS,
+            max_keepalive_connections=LLM_MAX_CONNECTIONS,
+        ),
+        timeout=httpx.Timeout(LLM_TIMEOUT, connect=5.0),
+    )
+    return openai.AsyncOpenAI(
+        api_key=os.getenv("OPENAI_API_KEY"),
+        base_url=OPENAI_BASE_URL,
+        http_client=http_client,
+        max_retries=0,  # retries are handled in _complete with a shared deadline
+    )
+
+
+def get_client():
+    global _client, _client_loop
+    loop = asyncio.get_running_loop()
+    if _client is None or (_client_loop is not None and _client_loop is not loop):
+        _client = _build_client()
+        _client_loop = loop
+    return _client
+
+
+def _get_semaphore() -> asyncio.Semaphore:
+    global _semaphore, _semaphore_loop
+    loop = asyncio.get_running_loop()
+    if _semaphore is None or _semaphore_loop is not loop:
+        _semaphore = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+        _semaphore_loop = loop
+    return _semaphore
+
+
+async def close_client():
+    """Close the pooled HTTP connections (called on app shutdown)."""
+    global _client, _client_loop
+    client, _client, _client_loop = _client, None, None
+    if client is not None and hasattr(client, "close"):
+        await client.close()
+
+
+async def _create_with_retries(**kwargs):
+    """
+    chat.completions.create with per-attempt timeouts and bounded,
+    jittered exponential-backoff retries inside LLM_DEADLINE.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + LLM_DEADLINE
+    attempt = 0
+    while True:
+        remaining = deadline - loop.time()
+        if remaining <= 0:
+            metrics.incr("llm.deadline_exceeded")
+            raise TimeoutError("LLM deadline exceeded")
+        try:
+            metrics.incr("llm.calls")
+            return await get_client().chat.completions.create(
+                timeout=min(LLM_TIMEOUT, remaining), **kwargs
+            )
+        except RETRYABLE_ERRORS as e:
+            attempt += 1
+            if attempt > LLM_MAX_RETRIES:
+                raise
+            delay = random.uniform(0, LLM_RETRY_BASE_DELAY * (2 ** attempt))
+            if loop.time() + delay >= deadline:
+                raise
+            metrics.incr("llm.retries")
+            print(f"LLM call failed ({type(e).__name__}), retry {attempt} in {delay:.2f}s")
+            await asyncio.sleep(delay)
+
+
+async def _complete(**kwargs):
+    """One completion under the per-worker concurrency cap."""
+    async with _get_semaphore():
+        return await _create_with_retries(**kwargs)
+
+
+async def _complete_stream(**kwargs):
+    """
+    Streamed completion under the concurrency cap: yields content fragments
+    as they arrive. Only opening the stream is retried.
+    """
+    async with _get_semaphore():
+        stream = await _create_with_retries(stream=True, **kwargs)
+        async for chunk in stream:
+            if not chunk.choices:
+                continue
+            content = chunk.choices[0].delta.content
+            if content:
+                yield content
+
+
+class StepExtractor:
+    """
+    Pulls complete entries of the "steps" array out of a JSON answer while it
+    is still being streamed, so each step can be sent as soon as it is known.
+    """
+
+    _decoder = json.JSONDecoder()
+    _steps_start = re.compile(r'"steps"\s*:\s*\[')
+    _separator = re.compile(r"[\s,]*")
+
+    def __init__(self):
+        self.buffer = ""
+        self.pos = None
+        self.done = False
+
+    def feed(self, fragment: str) -> list:
+        self.buffer += fragment
+        found = []
+        if self.done:
+            return found
+        if self.pos is None:
+            m = self._steps_start.search(self.buffer)
+            if not m:
+                return found
+            self.pos = m.end()
+        while True:
+            i = self._separator.match(self.buffer, self.pos).end()
+            if i >= len(self.buffer):
+                return found
+            if self.buffer[i] == "]":
+                self.done = True
+                return found
+            try:
+                value, end = self._decoder.raw_decode(self.buffer, i)
+            except json.JSONDecodeError:
+                return found  # entry not complete yet
+            self.pos = end
+            found.append(value)
+
+
+# --- Response cache ---
+_plan_cache = TTLCache(maxsize=LLM_CACHE_MAX_ENTRIES, ttl=LLM_CACHE_TTL)
+_plan_cache_lock = threading.Lock()
+
+
+def normalize_question(question: str) -> str:
+    """Case-fold, collapse whitespace and drop trailing punctuation."""
+    return re.sub(r"\s+", " ", (question or "").strip().lower()).rstrip(" ?.!")
+
+
+def plan_fingerprint(vision, ocr_items, user_question: str) -> str:
+    """
+    Canonical key for a planning request: OCR text in reading order
+    (whitespace/case normalised), the vision summary and the question.
+    Confidence values and exact word/element boxes are left out on purpose so the
+    same page answers the same question for every user.
+    `ocr_items` may be an OcrResult or a legacy list of word dicts.
+    """
+    if isinstance(ocr_items, OcrResult):
+        ocr_text = " ".join(ocr_items.sorted().text.tolist())
+    else:
+        words = sorted(ocr_items or [], key=lambda it: (it["box"][1], it["box"][0]))
+        ocr_text = " ".join(it["text"] for it in words)
+    canonical = json.dumps({
+        "ocr": re.sub(r"\s+", " ", ocr_text).strip().lower(),
+        # Element boxes move by a pixel between captures; the type counts don't
+        "vision": {k: v for k, v in (vision or {}).items() if k not in ("note", "elements")},
+        "question": normalize_question(user_question),
+    }, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def clear_plan_cache():
+    with _plan_cache_lock:
+        _plan_cache.clear()
+
+
+def plan_cache_stats() -> dict:
+    with _plan_cache_lock:
+        size = len(_plan_cache)
+    return {
+        "enabled": LLM_CACHE_ENABLED,
+        "entries": size,
+        "max_entries": LLM_CACHE_MAX_ENTRIES,
+        "hits": metrics.get("llm_cache.hit"),
+        "misses": metrics.get("llm_cache.miss"),
+    }
+
+
+def _cache_get(key):
+    with _plan_cache_lock:
+        cached = _plan_cache.get(key)
+    metrics.incr("llm_cache.hit" if cached is not None else "llm_cache.miss")
+    return copy.deepcopy(cached) if cached is not None else None
+
+
+def _cache_put(key, result):
+    with _plan_cache_lock:
+        _plan_cache[key] = copy.deepcopy(result)
+
+
+def _request_args(vision, ocr_items, user_question: str, session=None, compacted=None) -> dict:
+    # `compacted`: compact_screen's (screen, stats) when the caller already has it
+    screen, stats = compacted or compact_screen(vision, ocr_items)
+    metrics.incr("prompt.requests")
+    metrics.incr("prompt.original_tokens", stats["original_tokens"])
+    metrics.incr("prompt.compacted_tokens", stats["compacted_tokens"])
+    if session is not None:
+        # Follow-up turn: history plus only what changed on screen
+        messages = session.messages(SYSTEM_PROMPT, screen, user_question)
+        metrics.incr("prompt.session_tokens", sum(estimate_tokens(m["content"]) for m in messages[1:]))
+    else:
+        prompt = json.dumps({**screen, "user_question": user_question}, separators=(",", ":"))
+        messages = [
             {"role": "system", "content": SYSTEM_PROMPT},
             {"role": "user", "content": prompt}
-        ],
+        ]
+    return dict(
+        model=LLM_MODEL,
+        response_format={ "type": "json_object" }, # <--- FORCES CLEAN JSON
+        messages=messages,
         max_tokens=600
     )
-    
-    text = resp.choices[0].message.content
-    
+
+
+def _remember(session, screen: dict, user_question: str, result: dict):
+    """Record a session's first turn (answered from cache or a plain call) as its full screen."""
+    if session is None or result == FALLBACK_RESULT:
+        return
+    session.messages(SYSTEM_PROMPT, screen, user_question)
+    session.record(result)
+
+
+def _parse_result(text):
     try:
         # Since we forced JSON mode, this will parse perfectly every time
-        result = json.loads(text)
+        return json.loads(text)
     except Exception as e:
         print(f"Failed to parse LLM response: {e}")
-        result = {"steps": ["Sorry, I couldn't generate the steps. Please try again."]}
-        
-    return result
\ No newline at end of file
+        return None
+
+
+# Identical questions about the same screen asked at the same time share one completion
+_plan_flight = SingleFlight("llm")
+
+
+async def plan_actions(vision, ocr_items, user_question: str, use_cache: bool = True, session=None):
+    """
+    Steps for `user_question` about the screen. With a `session`
+    (conversation.Conversation) follow-up questions are asked in context,
+    sending only what changed since the previous turn.
+    """
+    # Sessions need the compacted screen as well as the request; build it once
+    compacted = compact_screen(vision, ocr_items) if session is not None else None
+    if session is not None and len(session):
+        # Follow-ups depend on earlier turns: no shared cache or coalescing
+        resp = await _complete(**_request_args(vision, ocr_items, user_question, session, compacted))
+        result = _parse_result(resp.choices[0].message.content)
+        if result is None:
+            return copy.deepcopy(FALLBACK_RESULT)
+        session.record(result)
+        return result
+
+    key = plan_fingerprint(vision, ocr_items, user_question)
+    cacheable = use_cache and LLM_CACHE_ENABLED
+    result = _cache_get(key) if cacheable else None
+    if result is None:
+        # An answer still being generated is fresh, so use_cache=False callers may join it too
+        result = await _plan_flight.do(key, _plan_uncached, vision, ocr_items, user_question, cacheable, key,
+                                       compacted)
+        # Every caller gets its own copy of the shared answer
+        result = copy.deepcopy(result)
+    if compacted is not None:
+        _remember(session, compacted[0], user_question, result)
+    return result
+
+
+async def _plan_uncached(vision, ocr_items, user_question: str, cacheable: bool, key: str, compacted=None):
+    resp = await _complete(**_request_args(vision, ocr_items, user_question, compacted=compacted))
+    result = _parse_result(resp.choices[0].message.content)
+    if result is None:
+        # Don't cache failures; the next request should try again
+        return FALLBACK_RESULT
+
+    if cacheable:
+        _cache_put(key, result)
+    return result
+
+
+async def stream_plan_actions(vision, ocr_items, user_question: str, use_cache: bool = True, session=None):
+    """
+    Streaming variant of plan_actions. Yields {"step": ..., "index": i} for
+    each step as soon as the model has finished writing it, then a final
+    {"result": {...}} with the complete parsed answer.
+    """
+    follow_up = session is not None and len(session) > 0
+    compacted = compact_screen(vision, ocr_items) if session is not None else None
+    key = None
+    if use_cache and LLM_CACHE_ENABLED and not follow_up:
+        key = plan_fingerprint(vision, ocr_items, user_question)
+        cached = _cache_get(key)
+        if cached is not None:
+            for i, step in enumerate(cached.get("steps") or []):
+                yield {"step": step, "index": i}
+            if compacted is not None:
+                _remember(session, compacted[0], user_question, cached)
+            yield {"result": cached}
+            return
+
+    extractor = StepExtractor()
+    index = 0
+    args = _request_args(vision, ocr_items, user_question, session if follow_up else None, compacted)
+    async for fragment in _complete_stream(**args):
+        for step in extractor.feed(fragment):
+            yield {"step": step, "index": index}
+            index += 1
+
+    result = _parse_result(extractor.buffer)
+    if result is None:
+        yield {"result": copy.deepcopy(FALLBACK_RESULT)}
+        return
+    if key is not None:
+        _cache_put(key, result)
+    if follow_up:
+        session.record(result)
+    elif compacted is not None:
+        _remember(session, compacted[0], user_question, result)
+    yield {"result": result}
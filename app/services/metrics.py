@@ -0,0 +1,28 @@
+# app/services/metrics.py
+import threading
+from collections import defaultdict
+
+# Process-local counters for the analysis pipeline (cache hits, timeouts, ...).
+# Each uvicorn worker keeps its own set.
+_counters: dict[str, int] = defaultdict(int)
+_lock = threading.Lock()
+
+
+def incr(name: str, amount: int = 1):
+    with _lock:
+        _counters[name] += amount
+
+
+def get(name: str) -> int:
+    with _lock:
+        return _counters.get(name, 0)
+
+
+def snapshot() -> dict[str, int]:
+    with _lock:
+        return dict(sorted(_counters.items()))
+
+
+def reset():
+    with _lock:
+        _counters.clear()
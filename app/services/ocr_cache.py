@@ -0,0 +1,76 @@
+# app/services/ocr_cache.py
+import hashlib
+import os
+import threading
+import time
+
+from cachetools import TTLCache
+from PIL import Image
+
+from app.services import metrics
+
+# --- Config ---
+OCR_CACHE_MAX_BYTES = int(os.getenv("OCR_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+OCR_CACHE_TTL = float(os.getenv("OCR_CACHE_TTL", "300"))
+
+
+def pixel_digest(img: Image.Image) -> bytes:
+    """
+    blake2b digest of the grayscale pixels Tesseract reads. Any changed
+    pixel changes it, so screens that differ by a single word or digit
+    never share a cache entry (a perceptual hash cannot promise that).
+    """
+    gray = img if img.mode == "L" else img.convert("L")
+    return hashlib.blake2b(gray.tobytes(), digest_size=16).digest()
+
+
+def _result_size(result) -> int:
+    # In-memory footprint of an OcrResult plus a little object overhead
+    return 256 + result.nbytes
+
+
+class OcrCache:
+    """
+    LRU + TTL cache of OCR results keyed by image size and pixel digest,
+    bounded by an approximate byte budget.
+    """
+
+    def __init__(self, max_bytes: int = OCR_CACHE_MAX_BYTES, ttl: float = OCR_CACHE_TTL,
+                 timer=time.monotonic):
+        self._cache = TTLCache(maxsize=max_bytes, ttl=ttl, timer=timer, getsizeof=_result_size)
+        self._lock = threading.Lock()
+
+    def key_for(self, img: Image.Image, *extra):
+        """Cache key: image dimensions, pixel digest and any OCR options."""
+        return (img.size, pixel_digest(img)) + tuple(extra)
+
+    def get(self, key):
+        with self._lock:
+            result = self._cache.get(key)
+        metrics.incr("ocr_cache.hit" if result is not None else "ocr_cache.miss")
+        return result
+
+    def put(self, key, result):
+        with self._lock:
+            try:
+                self._cache[key] = result
+            except ValueError:
+                # Single result larger than the whole cache; skip it
+                pass
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._cache),
+                "bytes": self._cache.currsize,
+                "max_bytes": self._cache.maxsize,
+                "hits": metrics.get("ocr_cache.hit"),
+                "misses": metrics.get("ocr_cache.miss"),
+            }
+
+
+ocr_cache = OcrCache()
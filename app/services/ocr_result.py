@@ -0,0 +1,164 @@
+# app/services/ocr_result.py
+import numpy as np
+
+
+class OcrResult:
+    """
+    Struct-of-arrays view of Tesseract's word table.
+
+    Columns (one row per word):
+      text  -- str array
+      conf  -- float32 confidence (0-100)
+      boxes -- int32 (N, 4) [x1, y1, x2, y2] in original-image pixels
+      block, line -- int32 group ids (line ids are unique across blocks)
+
+    Services pass this around; dicts are only built at the API edge via
+    to_items() / lines() / blocks().
+    """
+
+    __slots__ = ("text", "conf", "boxes", "block", "line")
+
+    def __init__(self, text, conf, boxes, block, line):
+        self.text = np.asarray(text, dtype=str)
+        self.conf = np.asarray(conf, dtype=np.float32)
+        self.boxes = np.asarray(boxes, dtype=np.int32).reshape(-1, 4)
+        self.block = np.asarray(block, dtype=np.int32)
+        self.line = np.asarray(line, dtype=np.int32)
+
+    @classmethod
+    def empty(cls):
+        return cls([], [], np.zeros((0, 4)), [], [])
+
+    @classmethod
+    def from_tesseract(cls, data: dict, scale: float = 1.0, offset=(0, 0), min_conf: float = 0.0):
+        """
+        Build from an image_to_data DICT. Drops empty and low-confidence
+        words, maps boxes back through `scale` and shifts them by `offset`.
+        """
+        if not data.get("text"):
+            return cls.empty()
+        text = np.char.strip(np.asarray(data["text"], dtype=str))
+        conf = np.asarray(data["conf"], dtype=np.float32)
+        keep = (np.char.str_len(text) > 0) & (conf >= min_conf)
+
+        left = np.asarray(data["left"], dtype=np.float32)[keep]
+        top = np.asarray(data["top"], dtype=np.float32)[keep]
+        width = np.asarray(data["width"], dtype=np.float32)[keep]
+        height = np.asarray(data["height"], dtype=np.float32)[keep]
+        boxes = np.stack([left, top, left + width, top + height], axis=1)
+        boxes = np.rint(boxes / scale).astype(np.int32) + np.asarray(
+            [offset[0], offset[1], offset[0], offset[1]], dtype=np.int32
+        )
+
+        block_num = np.asarray(data["block_num"], dtype=np.int64)[keep]
+        par_num = np.asarray(data["par_num"], dtype=np.int64)[keep]
+        line_num = np.asarray(data["line_num"], dtype=np.int64)[keep]
+        # Tesseract numbers lines within a paragraph; make them frame-unique
+        line_key = (block_num << 32) | (par_num << 16) | line_num
+        _, line = np.unique(line_key, return_inverse=True)
+        _, block = np.unique(block_num, return_inverse=True)
+        return cls(text[keep], conf[keep], boxes, block, line)
+
+    def __len__(self):
+        return len(self.text)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(getattr(self, name).nbytes for name in self.__slots__)
+
+    def select(self, mask) -> "OcrResult":
+        return OcrResult(self.text[mask], self.conf[mask], self.boxes[mask],
+                         self.block[mask], self.line[mask])
+
+    def sorted(self) -> "OcrResult":
+        """Reading order: top to bottom, then left to right."""
+        order = np.lexsort((self.boxes[:, 0], self.boxes[:, 1]))
+        return self.select(order)
+
+    @classmethod
+    def concat(cls, results) -> "OcrResult":
+        """Concatenate results, renumbering groups so ids stay unique."""
+        results = [r for r in results if len(r)]
+        if not results:
+            return cls.empty()
+        blocks, lines = [], []
+        block_base = line_base = 0
+        for r in results:
+            blocks.append(r.block + block_base)
+            lines.append(r.line + line_base)
+            block_base += int(r.block.max()) + 1
+            line_base += int(r.line.max()) + 1
+        return cls(
+            np.concatenate([r.text for r in results]),
+            np.concatenate([r.conf for r in results]),
+            np.concatenate([r.boxes for r in results]),
+            np.concatenate(blocks),
+            np.concatenate(lines),
+        )
+
+    def _group(self, ids):
+        """Merged box, mean confidence and member order for each group id."""
+        if not len(self):
+            return []
+        uniq, inverse = np.unique(ids, return_inverse=True)
+        n = len(uniq)
+        x1 = np.full(n, np.iinfo(np.int32).max, dtype=np.int32)
+        y1 = x1.copy()
+        x2 = np.full(n, np.iinfo(np.int32).min, dtype=np.int32)
+        y2 = x2.copy()
+        np.minimum.at(x1, inverse, self.boxes[:, 0])
+        np.minimum.at(y1, inverse, self.boxes[:, 1])
+        np.maximum.at(x2, inverse, self.boxes[:, 2])
+        np.maximum.at(y2, inverse, self.boxes[:, 3])
+        conf = np.bincount(inverse, weights=self.conf, minlength=n) / np.bincount(inverse, minlength=n)
+        # Words of each group in left-to-right order
+        order = np.lexsort((self.boxes[:, 0], inverse))
+        starts = np.searchsorted(inverse[order], np.arange(n))
+        members = np.split(order, starts[1:])
+        return [
+            (int(uniq[g]), [int(x1[g]), int(y1[g]), int(x2[g]), int(y2[g])], float(conf[g]), members[g])
+            for g in range(n)
+        ]
+
+    def lines(self) -> list:
+        """[{text, box, conf, block}, ...] with one entry per text line, in reading order."""
+        out = []
+        for _, box, conf, members in self._group(self.line):
+            out.append({
+                "text": " ".join(self.text[members].tolist()),
+                "box": box,
+                "conf": round(conf, 2),
+                "block": int(self.block[members[0]]),
+            })
+        out.sort(key=lambda l: (l["box"][1], l["box"][0]))
+        return out
+
+    def blocks(self) -> list:
+        """[{text, box, conf}, ...] with one entry per Tesseract block."""
+        by_block = {}
+        for line in self.lines():
+            by_block.setdefault(line["block"], []).append(line)
+        out = []
+        for lines in by_block.values():
+            out.append({
+                "text": "\n".join(l["text"] for l in lines),
+                "box": [min(l["box"][0] for l in lines), min(l["box"][1] for l in lines),
+                        max(l["box"][2] for l in lines), max(l["box"][3] for l in lines)],
+                "conf": round(sum(l["conf"] for l in lines) / len(lines), 2),
+            })
+        return out
+
+    def to_columns(self) -> dict:
+        """Compact wire form: {text: [...], conf: [...], boxes: [[x1,y1,x2,y2], ...]}."""
+        return {
+            "text": self.text.tolist(),
+            "conf": np.round(self.conf, 1).tolist(),
+            "boxes": self.boxes.tolist(),
+        }
+
+    def to_items(self) -> list:
+        """Legacy word list: [{text, box: [x1,y1,x2,y2], conf}, ...]."""
+        return [
+            {"text": t, "conf": float(c), "box": b}
+            for t, c, b in zip(self.text.tolist(), self.conf.tolist(), self.boxes.tolist())
+        ]
@@ -1,24 +1,455 @@
 # app/services/ocr_service.py
-from PIL import Image
+import asyncio
+import math
+import os
+import threading
+import time
+
+import numpy as np
 import pytesseract
 
-def run_ocr(image_path: str):
-    """
-    Return a list of dict: [{text, box: [x1,y1,x2,y2], conf}, ...]
-    """
-    img = Image.open(image_path).convert("RGB")
-    data = pytesseract.image_to_data(img, output_type=pytesseract.Output.DICT)
-
-    items = []
-    n = len(data['text'])
-    for i in range(n):
-        txt = data['text'][i].strip()
-        if not txt:
-            continue
-        items.append({
-            "text": txt,
-            "conf": float(data['conf'][i]),
-            "box": [int(data['left'][i]), int(data['top'][i]),
-                    int(data['left'][i] + data['width'][i]), int(data['top'][i] + data['height'][i])]
-        })
-    return items
+from app.services import metrics
+from app.services.deadline import stage_remaining
+from app.services.executor import cpu_pool, run_cpu, run_io
+from app.services.ocr_cache import ocr_cache
+from app.services.ocr_preprocess import prepare_for_ocr, resolve_profile, target_width
+from app.services.ocr_result import OcrResult
+from app.services.singleflight import SingleFlight
+from app.utils.image_utils import load_image, merge_boxes
+
+try:
+    import tesserocr
+except ImportError:  # optional: needs the tesseract C headers to build
+    tesserocr = None
+
+# --- Config ---
+# tesserocr (default): warm in-process API, no fork or language-data load per
+# image; falls back to pytesseract when tesserocr cannot be loaded.
+# "pytesseract" forces the subprocess engine ("auto" is kept as an alias of the default).
+OCR_ENGINE = os.getenv("OCR_ENGINE", "tesserocr")
+OCR_LANG = os.getenv("OCR_LANG", "eng")
+# Words below this Tesseract confidence are dropped (non-word rows report -1)
+OCR_MIN_CONF = float(os.getenv("OCR_MIN_CONF", "0"))
+# Longest a single OCR worker call may run; within an analysis the OCR
+# stage's remaining budget is used when shorter. Tesseract is killed (or
+# stopped) at the limit so a hung call cannot hold a pool worker forever.
+OCR_CALL_TIMEOUT = float(os.getenv("OCR_CALL_TIMEOUT", "30"))
+# Region-of-interest OCR: pixels added around each region, and how many
+# regions one request may ask for
+OCR_ROI_MARGIN = int(os.getenv("OCR_ROI_MARGIN", "48"))
+OCR_ROI_MAX_REGIONS = int(os.getenv("OCR_ROI_MAX_REGIONS", "8"))
+# Tiled OCR: large frames are split into overlapping tiles that are OCR'd in
+# parallel across the OCR pool. "auto" tiles frames whose OCR input reaches
+# OCR_TILE_MIN_PIXELS (scripts/bench_ocr_tiling.py finds the crossover);
+# "on" always tiles, "off" never does. Sizes are in OCR-input pixels.
+OCR_TILING = os.getenv("OCR_TILING", "auto")
+OCR_TILE_SIZE = int(os.getenv("OCR_TILE_SIZE", "1024"))
+# Should exceed the widest word, so every word fits whole in some tile
+OCR_TILE_OVERLAP = int(os.getenv("OCR_TILE_OVERLAP", "128"))
+# Measured crossover with one OCR worker (tesserocr, accurate profile): tiling
+# loses at 2560x1080 OCR input (0.87x) and wins from 2560x1440 (2.05x). More
+# workers move it lower; re-run the benchmark on the target hardware.
+OCR_TILE_MIN_PIXELS = int(os.getenv("OCR_TILE_MIN_PIXELS", str(2560 * 1440)))
+
+TSV_COLUMNS = ("level", "page_num", "block_num", "par_num", "line_num", "word_num",
+               "left", "top", "width", "height", "conf", "text")
+
+
+# --- OCR engines ---
+class OcrEngine:
+    """Returns Tesseract's word table in pytesseract's image_to_data DICT layout."""
+
+    name = "base"
+
+    def image_to_data(self, img, timeout: float | None = None) -> dict:
+        raise NotImplementedError
+
+
+class PytesseractEngine(OcrEngine):
+    """Shells out to the tesseract binary; pays a fork + model load per image."""
+
+    name = "pytesseract"
+
+    def image_to_data(self, img, timeout: float | None = None) -> dict:
+        # pytesseract kills the tesseract subprocess after `timeout` (0 = none)
+        try:
+            return pytesseract.image_to_data(img, lang=OCR_LANG, output_type=pytesseract.Output.DICT,
+                                             timeout=timeout or 0)
+        except RuntimeError as e:
+            # ...and reports it as a RuntimeError; callers expect TimeoutError
+            if str(e) == "Tesseract process timeout":
+                raise TimeoutError("tesseract timed out") from e
+            raise
+
+
+class TesserocrEngine(OcrEngine):
+    """Keeps one initialised Tesseract API (language data loaded) for reuse."""
+
+    name = "tesserocr"
+
+    def __init__(self):
+        self.api = tesserocr.PyTessBaseAPI(lang=OCR_LANG)
+
+    def image_to_data(self, img, timeout: float | None = None) -> dict:
+        self.api.SetImage(img)
+        # Recognize stops (and returns False) once `timeout` ms have passed
+        if not self.api.Recognize(int(timeout * 1000) if timeout else 0):
+            raise TimeoutError("tesseract did not finish within its budget")
+        tsv = self.api.GetTSVText(0)
+        data = {col: [] for col in TSV_COLUMNS}
+        for row in tsv.splitlines():
+            cells = row.split("\t")
+            if len(cells) < len(TSV_COLUMNS):
+                cells.append("")
+            for col, value in zip(TSV_COLUMNS, cells):
+                data[col].append(value if col == "text" else int(float(value)))
+        return data
+
+
+# One engine per worker thread/process, created once and kept warm
+_local = threading.local()
+
+
+_fallback_warned = False
+
+
+def _new_engine() -> OcrEngine:
+    global _fallback_warned
+    if OCR_ENGINE != "pytesseract":
+        if tesserocr is None:
+            if not _fallback_warned:
+                _fallback_warned = True
+                print("[NexAura] Warning: tesserocr is not installed; OCR falls back to pytesseract")
+        else:
+            try:
+                return TesserocrEngine()
+            except Exception as e:
+                print(f"[NexAura] Warning: could not start tesserocr ({e}); OCR falls back to pytesseract")
+    return PytesseractEngine()
+
+
+def get_engine() -> OcrEngine:
+    engine = getattr(_local, "engine", None)
+    if engine is None:
+        engine = _local.engine = _new_engine()
+    return engine
+
+
+def warm_engine():
+    """OCR pool initializer: load the language data before the first request."""
+    print(f"OCR worker ready (engine={get_engine().name})")
+
+
+cpu_pool.initializer = warm_engine
+
+
+def ocr_expiry() -> float:
+    """
+    Wall-clock time by which OCR started now must finish: the current OCR
+    stage's deadline, capped at OCR_CALL_TIMEOUT.
+    """
+    remaining = stage_remaining()
+    return time.time() + (OCR_CALL_TIMEOUT if remaining is None else min(OCR_CALL_TIMEOUT, remaining))
+
+
+def _time_left(expires: float | None) -> float | None:
+    if expires is None:
+        return None
+    left = expires - time.time()
+    if left <= 0:
+        raise TimeoutError("OCR budget spent before tesseract started")
+    return left
+
+
+def run_ocr(image, offset=(0, 0), profile=None, expires: float | None = None) -> OcrResult:
+    """
+    OCR one image and return an OcrResult (struct-of-arrays word table with
+    block/line grouping). Call .to_items() for the legacy list of dicts.
+
+    `image` may be a file path, raw image bytes, a PIL image or a NumPy array.
+    `offset` is added to every box, so a crop can report full-frame coordinates.
+    `profile` ("fast", "balanced", "accurate") picks how far the image is
+    downscaled before OCR; boxes are always in original-image pixels.
+    `expires` (wall-clock time, see ocr_expiry) bounds the tesseract call.
+    """
+    img, scale = prepare_for_ocr(load_image(image), profile)
+    data = get_engine().image_to_data(img, _time_left(expires))
+    return OcrResult.from_tesseract(data, scale=scale, offset=offset, min_conf=OCR_MIN_CONF)
+
+
+def run_ocr_batch(images, offsets=None, profile=None, expires: float | None = None):
+    """
+    OCR several images in one worker call. Returns (results, started, finished)
+    so the caller can split queue wait from execution time.
+    """
+    started = time.time()
+    offsets = offsets or [(0, 0)] * len(images)
+    results = [run_ocr(img, off, profile, expires) for img, off in zip(images, offsets)]
+    return results, started, time.time()
+
+
+async def ocr_images(images, offsets=None, profile=None):
+    """
+    Send a batch of images to one warm OCR worker.
+    Returns (results, timing) where timing holds queue_ms and exec_ms.
+    """
+    submitted = time.time()
+    results, started, finished = await run_cpu(run_ocr_batch, images, offsets, profile, ocr_expiry())
+    timing = {
+        "queue_ms": round(max(0.0, started - submitted) * 1000, 2),
+        "exec_ms": round((finished - started) * 1000, 2),
+        "images": len(images),
+    }
+    metrics.incr("ocr.calls")
+    metrics.incr("ocr.images", len(images))
+    metrics.incr("ocr.queue_ms", int(timing["queue_ms"]))
+    metrics.incr("ocr.exec_ms", int(timing["exec_ms"]))
+    return results, timing
+
+
+# Identical frames OCR'd at the same time (same cache key) share one run
+_ocr_flight = SingleFlight("ocr")
+
+
+async def run_ocr_cached(img, profile=None):
+    """
+    Async entry point used by the routes: look the frame up in the
+    pixel-digest cache and only run Tesseract (in the OCR pool) on a miss.
+    Concurrent misses for the same frame share one OCR run.
+    """
+    profile = resolve_profile(profile)
+    key = await run_io(ocr_cache.key_for, img, profile)
+    result = ocr_cache.get(key)
+    if result is None:
+        result = await _ocr_flight.do(key, _ocr_frame, key, img, profile)
+    return result
+
+
+async def _ocr_frame(key, img, profile):
+    if tiling_wanted(img.size, profile):
+        result = await run_ocr_tiled(img, profile)
+    else:
+        (result,), _ = await ocr_images([img], profile=profile)
+    ocr_cache.put(key, result)
+    return result
+
+
+# --- Tiled OCR ---
+def tiling_wanted(size, profile=None) -> bool:
+    """
+    Whether a frame of `size` should be OCR'd in tiles. Uses the profile's
+    non-dense OCR width, so the estimate never needs the pixels.
+    """
+    if OCR_TILING in ("on", "off"):
+        return OCR_TILING == "on"
+    w, h = size
+    ocr_w = target_width(w, 0.0, profile)
+    return ocr_w * h * ocr_w / max(w, 1) >= OCR_TILE_MIN_PIXELS
+
+
+def _spans(length: int, size: int, overlap: int):
+    if length <= size:
+        return [(0, length)]
+    step = max(1, size - overlap)
+    count = -(-(length - overlap) // step)
+    # The last tile is pulled back to end at the edge, so every tile is full size
+    return [(s, s + size) for s in (min(i * step, length - size) for i in range(count))]
+
+
+def tile_grid(width: int, height: int, size: int = OCR_TILE_SIZE,
+              overlap: int = OCR_TILE_OVERLAP) -> list:
+    """Overlapping [x1, y1, x2, y2] tiles covering a width x height image, row-major."""
+    return [[x1, y1, x2, y2]
+            for y1, y2 in _spans(height, size, overlap)
+            for x1, x2 in _spans(width, size, overlap)]
+
+
+def _prepare_tiles(img, profile, size, overlap):
+    gray, scale = prepare_for_ocr(img, profile)
+    grid = tile_grid(*gray.size, size, overlap)
+    return [gray.crop(tuple(t)) for t in grid], grid, scale
+
+
+def ocr_tile(tile, offset, scale, expires: float | None = None) -> OcrResult:
+    """Worker side: OCR one prepared (grayscale, downscaled) tile."""
+    data = get_engine().image_to_data(tile, _time_left(expires))
+    return OcrResult.from_tesseract(data, scale=scale, offset=offset, min_conf=OCR_MIN_CONF)
+
+
+def _clipped(boxes: np.ndarray, tile, width: int, height: int, tol: float) -> np.ndarray:
+    """Mask of boxes touching a tile edge that is not an image edge (cut-off words)."""
+    x1, y1, x2, y2 = tile
+    return (((boxes[:, 0] <= x1 + tol) & (x1 > tol)) | ((boxes[:, 2] >= x2 - tol) & (x2 < width - tol))
+            | ((boxes[:, 1] <= y1 + tol) & (y1 > tol)) | ((boxes[:, 3] >= y2 - tol) & (y2 < height - tol)))
+
+
+def _iou(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """Pairwise IoU of (N, 4) and (M, 4) boxes."""
+    a, b = a.astype(np.float64), b.astype(np.float64)
+    iw = np.clip(np.minimum(a[:, None, 2], b[None, :, 2]) - np.maximum(a[:, None, 0], b[None, :, 0]), 0, None)
+    ih = np.clip(np.minimum(a[:, None, 3], b[None, :, 3]) - np.maximum(a[:, None, 1], b[None, :, 1]), 0, None)
+    inter = iw * ih
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    return inter / np.maximum(area_a[:, None] + area_b[None, :] - inter, 1)
+
+
+def _dedupe(result: OcrResult, owner: np.ndarray, tiles) -> np.ndarray:
+    """Keep mask dropping the lower-confidence copy of words read by two tiles."""
+    boxes = result.boxes
+    shared = np.zeros(len(result), dtype=bool)
+    for i, (x1, y1, x2, y2) in enumerate(tiles):
+        shared |= ((owner != i) & (boxes[:, 0] < x2) & (x1 < boxes[:, 2])
+                   & (boxes[:, 1] < y2) & (y1 < boxes[:, 3]))
+    keep = np.ones(len(result), dtype=bool)
+    idx = np.nonzero(shared)[0]
+    if len(idx) < 2:
+        return keep
+    dup = (_iou(boxes[idx], boxes[idx]) >= 0.5) & (owner[idx][:, None] != owner[idx][None, :])
+    alive = np.ones(len(idx), dtype=bool)
+    for a in np.argsort(-result.conf[idx], kind="stable"):
+        if alive[a]:
+            alive &= ~dup[a]
+    keep[idx] = alive
+    return keep
+
+
+def _join_lines(result: OcrResult, owner: np.ndarray) -> OcrResult:
+    """Give one line id to line pieces from neighbouring tiles that continue each other."""
+    uniq, inverse = np.unique(result.line, return_inverse=True)
+    n = len(uniq)
+    x1 = np.full(n, np.iinfo(np.int32).max)
+    y1 = x1.copy()
+    x2 = np.full(n, np.iinfo(np.int32).min)
+    y2 = x2.copy()
+    np.minimum.at(x1, inverse, result.boxes[:, 0])
+    np.minimum.at(y1, inverse, result.boxes[:, 1])
+    np.maximum.at(x2, inverse, result.boxes[:, 2])
+    np.maximum.at(y2, inverse, result.boxes[:, 3])
+    tile = np.zeros(n, dtype=np.int64)
+    tile[inverse] = owner
+
+    h = y2 - y1
+    v_overlap = np.minimum(y2[:, None], y2[None, :]) - np.maximum(y1[:, None], y1[None, :])
+    gap = np.maximum(x1[:, None], x1[None, :]) - np.minimum(x2[:, None], x2[None, :])
+    join = ((tile[:, None] != tile[None, :])
+            & (v_overlap >= 0.5 * np.minimum(h[:, None], h[None, :]))
+            & (gap <= 1.5 * np.maximum(h[:, None], h[None, :])))
+    labels = np.arange(n)
+    for a, b in zip(*np.nonzero(np.triu(join, 1))):
+        ra, rb = labels[a], labels[b]
+        if ra != rb:
+            labels[labels == max(ra, rb)] = min(ra, rb)
+    return OcrResult(result.text, result.conf, result.boxes, result.block, labels[inverse])
+
+
+def merge_tiles(results, tiles, size, tol: float = 2.0) -> OcrResult:
+    """
+    Combine per-tile results (boxes in image pixels, `tiles` in the same
+    space). Words cut by an inner tile edge are dropped in favour of the
+    whole copy from the neighbouring tile, words read whole by two tiles
+    are kept once, and lines split across tiles are joined again.
+    """
+    width, height = size
+    kept, owners = [], []
+    for i, (result, tile) in enumerate(zip(results, tiles)):
+        result = result.select(~_clipped(result.boxes, tile, width, height, tol))
+        kept.append(result)
+        owners.append(np.full(len(result), i))
+    merged = OcrResult.concat(kept)
+    if not len(merged):
+        return merged
+    owner = np.concatenate(owners)
+    keep = _dedupe(merged, owner, tiles)
+    return _join_lines(merged.select(keep), owner[keep])
+
+
+async def run_ocr_tiled(img, profile=None, tile_size: int = None, overlap: int = None) -> OcrResult:
+    """
+    OCR a large frame as overlapping tiles spread over the OCR pool, so one
+    4K/ultrawide screenshot uses several cores. Returns one merged OcrResult
+    in original-image pixels, in reading order.
+    """
+    size = tile_size or OCR_TILE_SIZE
+    overlap = OCR_TILE_OVERLAP if overlap is None else overlap
+    crops, grid, scale = await run_io(_prepare_tiles, img, profile, size, overlap)
+    started = time.time()
+    expires = ocr_expiry()
+    results = await asyncio.gather(*(
+        run_cpu(ocr_tile, crop, (round(t[0] / scale), round(t[1] / scale)), scale, expires)
+        for crop, t in zip(crops, grid)
+    ))
+    metrics.incr("ocr.calls")
+    metrics.incr("ocr.images")
+    metrics.incr("ocr.tiled")
+    metrics.incr("ocr.tiles", len(grid))
+    metrics.incr("ocr.exec_ms", int((time.time() - started) * 1000))
+    tiles = [[v / scale for v in t] for t in grid]
+    return merge_tiles(results, tiles, img.size, tol=2.0 / scale).sorted()
+
+
+def parse_regions(regions) -> list:
+    """
+    Normalise client regions to [x1, y1, x2, y2] image pixels. Accepts
+    [x1, y1, x2, y2] lists or {x, y, width, height} dicts (the recorded
+    target.vision.bbox shape). Raises ValueError on malformed input.
+    """
+    if not regions:
+        return []
+    if len(regions) > OCR_ROI_MAX_REGIONS:
+        raise ValueError(f"at most {OCR_ROI_MAX_REGIONS} regions")
+    boxes = []
+    for region in regions:
+        if isinstance(region, dict):
+            x, y = float(region["x"]), float(region["y"])
+            box = [x, y, x + float(region["width"]), y + float(region["height"])]
+        else:
+            box = [float(v) for v in region]
+            if len(box) != 4:
+                raise ValueError("a region needs 4 numbers")
+        # json.loads accepts NaN, Infinity and 1e400; int() would not
+        if not all(math.isfinite(v) for v in box):
+            raise ValueError("region coordinates must be finite")
+        if box[2] <= box[0] or box[3] <= box[1]:
+            raise ValueError("empty region")
+        boxes.append([int(v) for v in box])
+    return boxes
+
+
+def roi_crops(size, regions, margin: int = OCR_ROI_MARGIN) -> list:
+    """Grow regions by `margin`, clamp them to the image and merge overlaps."""
+    w, h = size
+    grown = []
+    for x1, y1, x2, y2 in regions:
+        box = [max(0, x1 - margin), max(0, y1 - margin), min(w, x2 + margin), min(h, y2 + margin)]
+        if box[2] > box[0] and box[3] > box[1]:
+            grown.append(box)
+    return merge_boxes(grown)
+
+
+async def run_ocr_regions(img, regions, margin=None, profile=None):
+    """
+    OCR only the given regions of interest (plus `margin` px around them).
+    The crops go to one warm OCR worker as a batch; boxes in the returned
+    OcrResult are in full-image coordinates. Results are cached per frame
+    and region set like run_ocr_cached.
+    """
+    profile = resolve_profile(profile)
+    crops = roi_crops(img.size, regions, OCR_ROI_MARGIN if margin is None else max(0, int(margin)))
+    if not crops:
+        return OcrResult.empty()
+    key = await run_io(ocr_cache.key_for, img, profile, tuple(map(tuple, crops)))
+    result = ocr_cache.get(key)
+    if result is None:
+        result = await _ocr_flight.do(key, _ocr_crops, key, img, crops, profile)
+    return result
+
+
+async def _ocr_crops(key, img, crops, profile):
+    metrics.incr("ocr.roi_requests")
+    metrics.incr("ocr.roi_pixels", sum((b[2] - b[0]) * (b[3] - b[1]) for b in crops))
+    results, _ = await ocr_images([img.crop(tuple(box)) for box in crops],
+                                  [(box[0], box[1]) for box in crops], profile)
+    result = OcrResult.concat(results).sorted()
+    ocr_cache.put(key, result)
+    return result
@@ -0,0 +1,157 @@
+# app/services/prompt_compaction.py
+import json
+import math
+import os
+import re
+
+import numpy as np
+
+from app.services.ocr_result import OcrResult
+
+# --- Config ---
+# Approximate input-token budget for the screen description sent to the LLM
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "1200"))
+# Lines with a lower mean OCR confidence are treated as noise
+PROMPT_MIN_CONF = float(os.getenv("PROMPT_MIN_CONF", "40"))
+# Text shown inside a UI element label is cut to this many characters
+ELEMENT_LABEL_CHARS = 40
+# Characters per OCR word besides its text in the old indented prompt
+# ({"text", "conf", "box": [...]} at indent=2, measured on 1080p screens)
+LEGACY_WORD_CHARS = 136
+
+REGION_NAMES = (
+    ("top-left", "top", "top-right"),
+    ("left", "center", "right"),
+    ("bottom-left", "bottom", "bottom-right"),
+)
+
+_HAS_WORD = re.compile(r"[A-Za-z0-9]")
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough GPT token count (~4 characters per token for English UI text)."""
+    return math.ceil(len(text) / 4)
+
+
+def _as_lines(ocr) -> list:
+    """Line dicts from an OcrResult, or one pseudo-line per word for legacy lists."""
+    if isinstance(ocr, OcrResult):
+        return ocr.lines()
+    return [{"text": it["text"], "box": it["box"], "conf": it.get("conf", 100.0)} for it in ocr or []]
+
+
+def region_of(box, width: int, height: int) -> str:
+    """Name of the 3x3 screen cell containing the centre of `box`."""
+    cx = (box[0] + box[2]) / 2
+    cy = (box[1] + box[3]) / 2
+    col = min(2, max(0, int(3 * cx / max(width, 1))))
+    row = min(2, max(0, int(3 * cy / max(height, 1))))
+    return REGION_NAMES[row][col]
+
+
+def _element_labels(elements, lines, width: int, height: int) -> list:
+    """
+    (region, label, order) for each detected UI element, labelled with the
+    OCR text inside it, e.g. 'button "Save"'. Panels are listed without text.
+    """
+    if not elements:
+        return []
+    centers = np.asarray([[(l["box"][0] + l["box"][2]) / 2, (l["box"][1] + l["box"][3]) / 2]
+                          for l in lines]).reshape(-1, 2)
+    out = []
+    for el in elements:
+        x1, y1, x2, y2 = el["box"]
+        label = el["type"]
+        if el["type"] != "panel" and len(centers):
+            inside = np.flatnonzero((centers[:, 0] >= x1) & (centers[:, 0] <= x2)
+                                    & (centers[:, 1] >= y1) & (centers[:, 1] <= y2))
+            text = " ".join(lines[i]["text"] for i in inside)
+            if text:
+                label = f'{label} "{text[:ELEMENT_LABEL_CHARS]}"'
+        out.append((region_of(el["box"], width, height), label, (y1, x1)))
+    return out
+
+
+def compact_screen(vision, ocr, budget: int = PROMPT_TOKEN_BUDGET,
+                   min_conf: float = PROMPT_MIN_CONF):
+    """
+    Turn OCR output and detected UI elements into a compact, region-grouped
+    screen description:
+      {"screen": {...}, "ui": {"bottom-right": ['button "Save"']},
+       "regions": {"top-left": ["Settings", "Save x2"], ...}}
+
+    Words are merged into lines, low-confidence noise is dropped, positions
+    are quantised to a 3x3 grid, repeated labels within a region are
+    collapsed, and lines are admitted by confidence until the token budget
+    is used up. Returns (screen, stats).
+    """
+    lines = _as_lines(ocr)
+    vision = vision or {}
+    width = vision.get("width") or max((l["box"][2] for l in lines), default=1)
+    height = vision.get("height") or max((l["box"][3] for l in lines), default=1)
+
+    # 1. drop noise, 2. quantise, 3. dedupe labels per region
+    entries = {}
+    for line in lines:
+        text = re.sub(r"\s+", " ", line["text"]).strip()
+        if line["conf"] < min_conf or not _HAS_WORD.search(text):
+            continue
+        key = (region_of(line["box"], width, height), text.lower())
+        entry = entries.get(key)
+        if entry is None:
+            entries[key] = {"region": key[0], "text": text, "count": 1,
+                            "conf": line["conf"], "order": (line["box"][1], line["box"][0])}
+        else:
+            entry["count"] += 1
+            entry["conf"] = max(entry["conf"], line["conf"])
+
+    # UI elements go first: they are few and carry the layout
+    screen = {k: v for k, v in vision.items() if k not in ("note", "elements")}
+    used = estimate_tokens(json.dumps({"screen": screen, "regions": {}}))
+    ui = {}
+    for region, label, _ in sorted(_element_labels(vision.get("elements"), lines, width, height),
+                                   key=lambda e: e[2]):
+        cost = estimate_tokens(label) + 1
+        if used + cost > budget:
+            break
+        used += cost
+        ui.setdefault(region, []).append(label)
+
+    # 4. admit the most confident lines until the budget is spent
+    admitted = []
+    for entry in sorted(entries.values(), key=lambda e: -e["conf"]):
+        label = entry["text"] if entry["count"] == 1 else f"{entry['text']} x{entry['count']}"
+        cost = estimate_tokens(label) + 1
+        if used + cost > budget:
+            continue
+        used += cost
+        admitted.append((entry, label))
+
+    regions = {}
+    for entry, label in sorted(admitted, key=lambda pair: pair[0]["order"]):
+        regions.setdefault(entry["region"], []).append(label)
+    compacted = {"screen": screen, "regions": regions}
+    if ui:
+        compacted["ui"] = ui
+
+    stats = {
+        "lines": len(lines),
+        "kept_lines": len(admitted),
+        "original_tokens": _legacy_tokens(vision, ocr),
+        "compacted_tokens": estimate_tokens(json.dumps(compacted, separators=(",", ":"))),
+    }
+    return compacted, stats
+
+
+def _legacy_tokens(vision, ocr) -> int:
+    """
+    Size of the old prompt (vision plus every OCR word as indented JSON),
+    estimated from the word texts instead of serialising them all.
+    """
+    if isinstance(ocr, OcrResult):
+        words, chars = len(ocr), int(np.char.str_len(ocr.text).sum()) if len(ocr) else 0
+    else:
+        items = list(ocr or [])
+        words, chars = len(items), sum(len(it["text"]) for it in items)
+    return estimate_tokens(json.dumps({"vision": vision}, indent=2)) + math.ceil(
+        (chars + words * LEGACY_WORD_CHARS) / 4)
@@ -0,0 +1,61 @@
+# app/services/singleflight.py
+import asyncio
+import contextvars
+
+from app.services import metrics
+
+_flights = {}
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key: the first caller starts
+    the work, callers arriving while it runs await the same task. The task
+    runs in an empty context and each caller applies its own timeout around
+    the wait. Nothing is kept once it finishes (results are cached elsewhere).
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._calls = {}
+        _flights[name] = self
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._calls)
+
+    async def do(self, key, fn, *args):
+        """Run `fn(*args)` for `key`, or join the run already in flight."""
+        task = self._calls.get(key)
+        if task is None or task.get_loop() is not asyncio.get_running_loop():
+            metrics.incr(f"singleflight.{self.name}.leader")
+            # A clean context: the shared run must not inherit the leader's
+            # request state (e.g. its OCR stage deadline) and bound everyone by it
+            task = asyncio.get_running_loop().create_task(fn(*args), context=contextvars.Context())
+            self._calls[key] = task
+            task.add_done_callback(lambda t: self._forget(key, t))
+        else:
+            metrics.incr(f"singleflight.{self.name}.shared")
+        # A caller that gives up (deadline, disconnect) must not cancel the
+        # work for everyone else waiting on it
+        return await asyncio.shield(task)
+
+    def _forget(self, key, task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+
+    def stats(self) -> dict:
+        leaders = metrics.get(f"singleflight.{self.name}.leader")
+        shared = metrics.get(f"singleflight.{self.name}.shared")
+        calls = leaders + shared
+        return {
+            "calls": calls,
+            "shared": shared,
+            "dedupe_rate": round(shared / calls, 4) if calls else 0.0,
+            "in_flight": self.in_flight,
+        }
+
+
+def stats() -> dict:
+    """Coalescing counters for every SingleFlight, for the metrics endpoint."""
+    return {name: flight.stats() for name, flight in sorted(_flights.items())}
@@ -1,13 +1,194 @@
 # app/services/vision_service.py
-from PIL import Image
+import math
+import os
+
 import numpy as np
+from PIL import Image
+
+from app.services.executor import run_cpu, run_io
+from app.utils.image_utils import load_image
+
+# --- Config ---
+# Detection runs on a grayscale copy downscaled to at most this width
+VISION_WIDTH = int(os.getenv("VISION_WIDTH", "640"))
+# Minimum neighbour difference (0-255) that counts as an edge
+VISION_EDGE_THRESHOLD = int(os.getenv("VISION_EDGE_THRESHOLD", "8"))
+# Share of a box outline that must be edge pixels to count as a rectangle
+VISION_MIN_BORDER = float(os.getenv("VISION_MIN_BORDER", "0.75"))
+VISION_MAX_ELEMENTS = int(os.getenv("VISION_MAX_ELEMENTS", "60"))
 
-def analyze_ui(image_path: str):
+ELEMENT_TYPES = ("button", "input", "panel", "icon")
+
+
+def downscale_gray(image):
     """
-    Very small heuristic: return image size and top-level
-    bounding boxes of text elements (from OCR you passed).
-    For now just return image dims — later call GPT-4V or another vision model.
+    Grayscale copy of `image` reduced by an integer factor so its width is at
+    most VISION_WIDTH. Returns (gray uint8 array, factor, (width, height)).
     """
-    img = Image.open(image_path)
+    img = image if isinstance(image, Image.Image) else load_image(image)
     w, h = img.size
-    return {"width": w, "height": h, "note": "replace with GPT-4V or YOLO-based UI detection"}
+    factor = max(1, math.ceil(w / VISION_WIDTH))
+    small = img.reduce(factor) if factor > 1 else img
+    return np.asarray(small.convert("L")), factor, (w, h)
+
+
+def edge_map(gray: np.ndarray, threshold: int = VISION_EDGE_THRESHOLD) -> np.ndarray:
+    """Boolean map of pixels that differ from their right or lower neighbour."""
+    px = gray.astype(np.int16)
+    edges = np.zeros(px.shape, dtype=bool)
+    edges[:, :-1] |= np.abs(np.diff(px, axis=1)) > threshold
+    edges[:-1, :] |= np.abs(np.diff(px, axis=0)) > threshold
+    return edges
+
+
+def _runs(mask: np.ndarray):
+    """Horizontal runs of True pixels as (row, start, end) arrays, row-major order."""
+    h, w = mask.shape
+    padded = np.zeros((h, w + 2), dtype=np.int8)
+    padded[:, 1:-1] = mask
+    d = np.diff(padded, axis=1)
+    rows, starts = np.nonzero(d == 1)
+    _, ends = np.nonzero(d == -1)
+    return rows, starts, ends - 1
+
+
+def _union(n: int, a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """Vectorised union-find: root label (smallest member index) for each of n nodes."""
+    labels = np.arange(n)
+    while len(a):
+        la, lb = labels[a], labels[b]
+        diff = la != lb
+        if not diff.any():
+            break
+        a, b, la, lb = a[diff], b[diff], la[diff], lb[diff]
+        # Labels only ever decrease, so labels[i] <= i and pointer jumping terminates
+        np.minimum.at(labels, np.maximum(la, lb), np.minimum(la, lb))
+        while True:
+            jumped = labels[labels]
+            if np.array_equal(jumped, labels):
+                break
+            labels = jumped
+    return labels
+
+
+def connected_components(mask: np.ndarray):
+    """
+    8-connected components of `mask` via run-length encoding.
+    Returns (boxes (N, 4) as inclusive [x1, y1, x2, y2], pixel counts).
+    """
+    rows, starts, ends = _runs(mask)
+    n = len(rows)
+    if n == 0:
+        return np.zeros((0, 4), dtype=np.int64), np.zeros(0, dtype=np.int64)
+    stride = mask.shape[1] + 2
+    start_key = rows * stride + starts
+    end_key = rows * stride + ends
+    # Runs in the row above that overlap (or touch diagonally) each run
+    lo = np.searchsorted(end_key, (rows - 1) * stride + starts - 1, side="left")
+    hi = np.searchsorted(start_key, (rows - 1) * stride + ends + 1, side="right")
+    count = np.maximum(hi - lo, 0)
+    a = np.repeat(np.arange(n), count)
+    b = np.arange(count.sum()) - np.repeat(np.cumsum(count) - count, count) + np.repeat(lo, count)
+
+    _, comp = np.unique(_union(n, a, b), return_inverse=True)
+    k = int(comp.max()) + 1
+    boxes = np.empty((k, 4), dtype=np.int64)
+    boxes[:, :2] = np.iinfo(np.int64).max
+    boxes[:, 2:] = np.iinfo(np.int64).min
+    np.minimum.at(boxes[:, 0], comp, starts)
+    np.minimum.at(boxes[:, 1], comp, rows)
+    np.maximum.at(boxes[:, 2], comp, ends)
+    np.maximum.at(boxes[:, 3], comp, rows)
+    pixels = np.bincount(comp, weights=ends - starts + 1, minlength=k).astype(np.int64)
+    return boxes, pixels
+
+
+def _border_coverage(edges: np.ndarray, box) -> float:
+    """Mean share of edge pixels along the four sides of `box` (1px tolerance)."""
+    x1, y1, x2, y2 = box
+    top = edges[y1:y1 + 2, x1:x2 + 1].any(axis=0).mean()
+    bottom = edges[max(y1, y2 - 1):y2 + 1, x1:x2 + 1].any(axis=0).mean()
+    left = edges[y1:y2 + 1, x1:x1 + 2].any(axis=1).mean()
+    right = edges[y1:y2 + 1, max(x1, x2 - 1):x2 + 1].any(axis=1).mean()
+    return float(top + bottom + left + right) / 4
+
+
+def _classify(w: int, h: int, screen_w: int, screen_h: int, filled: bool):
+    """Element type for a rectangle of w x h original pixels, or None."""
+    aspect = w / max(h, 1)
+    if w * h >= 0.04 * screen_w * screen_h or (w >= 240 and h >= 120):
+        return "panel"
+    if h <= 64 and aspect >= 4 and not filled:
+        return "input"
+    if 16 <= h <= 80 and 1.2 <= aspect <= 12:
+        return "button"
+    if w <= 64 and h <= 64 and 0.6 <= aspect <= 1.6:
+        return "icon"
+    return None
+
+
+def detect_elements(gray: np.ndarray, factor: int = 1) -> list:
+    """
+    Find rectangular UI elements in a (downscaled) grayscale screenshot.
+
+    Edge pixels are grouped into connected components; components whose
+    bounding box outline is mostly edges are rectangles. Those are typed by
+    size, aspect ratio and whether their interior is filled with a colour
+    different from their surroundings. Boxes are returned in original-image
+    pixels (`factor` is the downscale factor).
+    """
+    sh, sw = gray.shape
+    edges = edge_map(gray)
+    boxes, pixels = connected_components(edges)
+    if not len(boxes):
+        return []
+    bw = boxes[:, 2] - boxes[:, 0] + 1
+    bh = boxes[:, 3] - boxes[:, 1] + 1
+    # Outlines are sparse; text and icons fill most of their box with edges
+    keep = (bw >= 6) & (bh >= 4) & (pixels < 0.6 * bw * bh) & (bw < sw - 1)
+    found = []
+    for box in boxes[keep].tolist():
+        score = _border_coverage(edges, box)
+        if score < VISION_MIN_BORDER:
+            continue
+        x1, y1, x2, y2 = box
+        inner = gray[y1 + 2:y2 - 1, x1 + 2:x2 - 1]
+        outer = gray[max(0, y1 - 2):min(sh, y2 + 3), max(0, x1 - 2):min(sw, x2 + 3)]
+        filled = inner.size > 0 and abs(float(np.median(inner)) - float(outer[0].mean())) > 20
+        kind = _classify((x2 - x1 + 1) * factor, (y2 - y1 + 1) * factor,
+                         sw * factor, sh * factor, filled)
+        if kind is None:
+            continue
+        found.append({
+            "type": kind,
+            "box": [x1 * factor, y1 * factor, (x2 + 1) * factor, (y2 + 1) * factor],
+            "score": round(score, 2),
+        })
+    found.sort(key=lambda e: (-e["score"], -(e["box"][2] - e["box"][0]) * (e["box"][3] - e["box"][1])))
+    found = found[:VISION_MAX_ELEMENTS]
+    found.sort(key=lambda e: (e["box"][1], e["box"][0]))
+    return found
+
+
+def _summary(width: int, height: int, elements: list) -> dict:
+    counts = {}
+    for el in elements:
+        counts[el["type"]] = counts.get(el["type"], 0) + 1
+    return {"width": width, "height": height, "elements": elements, "summary": counts}
+
+
+def analyze_ui(image):
+    """
+    Detect buttons, inputs, panels and icons on a screenshot.
+    Returns {width, height, elements: [{type, box, score}], summary: {type: count}}.
+
+    `image` may be a file path, raw image bytes, a PIL image or a NumPy array.
+    """
+    gray, factor, (w, h) = downscale_gray(image)
+    return _summary(w, h, detect_elements(gray, factor))
+
+
+async def analyze_screen(img: Image.Image) -> dict:
+    """analyze_ui for the request path: downscale on the I/O pool, detect on the CPU pool."""
+    gray, factor, (w, h) = await run_io(downscale_gray, img)
+    return _summary(w, h, await run_cpu(detect_elements, gray, factor))
@@ -1,8 +1,94 @@
 # app/utils/image_utils.py
+import base64
+from io import BytesIO
+
+import numpy as np
 from PIL import Image, ImageDraw
 
+
+def decode_image(data: bytes) -> Image.Image:
+    """
+    Decode raw PNG/JPEG/WebP bytes into an RGB PIL image, fully loaded.
+    This is the single decode every analysis stage shares.
+    """
+    with Image.open(BytesIO(data)) as img:
+        return img.convert("RGB")
+
+
+def decode_base64_image(data: str) -> bytes:
+    """Strip an optional data-URL prefix and return the raw image bytes."""
+    if "," in data:
+        _, data = data.split(",", 1)
+    return base64.b64decode(data)
+
+
+def image_info(data: bytes):
+    """(width, height, mime type) from the image header only; pixels are not decoded."""
+    with Image.open(BytesIO(data)) as img:
+        return img.width, img.height, Image.MIME.get(img.format, "application/octet-stream")
+
+
+PREVIEW_FORMATS = {"webp": ("WEBP", "image/webp"), "jpeg": ("JPEG", "image/jpeg")}
+
+
+def encode_preview(img: Image.Image, fmt: str = "webp", max_width: int = 960, quality: int = 75):
+    """
+    Downscaled WebP/JPEG copy of `img` for echoing back to the client.
+    Returns (bytes, mime, width, height).
+    """
+    pil_format, mime = PREVIEW_FORMATS[fmt]
+    preview = img
+    if img.width > max_width:
+        preview = img.resize((max_width, max(1, round(img.height * max_width / img.width))),
+                             Image.Resampling.BILINEAR, reducing_gap=2.0)
+    buf = BytesIO()
+    # method=0 / no optimize: favour encode speed over a few percent of size
+    options = {"method": 0} if pil_format == "WEBP" else {"optimize": False}
+    preview.save(buf, format=pil_format, quality=quality, **options)
+    return buf.getvalue(), mime, preview.width, preview.height
+
+
+def load_image(source) -> Image.Image:
+    """
+    Accept a file path, raw bytes, a PIL image or a NumPy array and return
+    an RGB PIL image. Already-decoded images are returned without copying
+    when they are RGB.
+    """
+    if isinstance(source, Image.Image):
+        return source if source.mode == "RGB" else source.convert("RGB")
+    if isinstance(source, np.ndarray):
+        return Image.fromarray(source).convert("RGB")
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return decode_image(bytes(source))
+    with Image.open(source) as img:
+        return img.convert("RGB")
+
+
+def _intersects(a, b) -> bool:
+    return a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]
+
+
+def merge_boxes(regions) -> list:
+    """Merge overlapping [x1, y1, x2, y2] boxes into their union boxes."""
+    merged = []
+    for region in regions:
+        region = list(region)
+        changed = True
+        while changed:
+            changed = False
+            for other in merged:
+                if _intersects(region, other):
+                    merged.remove(other)
+                    region = [min(region[0], other[0]), min(region[1], other[1]),
+                              max(region[2], other[2]), max(region[3], other[3])]
+                    changed = True
+                    break
+        merged.append(region)
+    return merged
+
+
 def draw_boxes(image_path, boxes, out_path):
-    img = Image.open(image_path).convert("RGBA")
+    img = load_image(image_path).convert("RGBA")
     draw = ImageDraw.Draw(img)
     for b in boxes:
         left, top, right, bottom = b
@@ -0,0 +1,65 @@
+# app/utils/ws_protocol.py
+import json
+import struct
+
+try:
+    import msgpack
+except ImportError:  # optional: binary replies fall back to JSON bytes
+    msgpack = None
+
+# Binary request frame:
+#   [uint32 big-endian header length][UTF-8 JSON header][raw PNG/JPEG/WebP bytes]
+# Header fields mirror the JSON mode (frame_id, question, profile, use_cache,
+# stream) plus "encoding" (png/jpeg/webp, informational) and "reply"
+# ("msgpack" or "json") for the format of binary replies.
+HEADER_SIZE = struct.Struct(">I")
+MAX_HEADER_BYTES = 64 * 1024
+
+IMAGE_ENCODINGS = ("png", "jpeg", "webp")
+
+
+class FrameError(ValueError):
+    """A binary frame that cannot be parsed."""
+
+
+def pack_frame(header: dict, image: bytes) -> bytes:
+    """Build a binary request frame (used by clients and tests)."""
+    raw = json.dumps(header, separators=(",", ":")).encode("utf-8")
+    return HEADER_SIZE.pack(len(raw)) + raw + image
+
+
+def unpack_frame(data: bytes):
+    """Split a binary request frame into (header dict, image bytes)."""
+    if len(data) < HEADER_SIZE.size:
+        raise FrameError("frame too short")
+    (size,) = HEADER_SIZE.unpack_from(data)
+    if size > MAX_HEADER_BYTES or HEADER_SIZE.size + size > len(data):
+        raise FrameError("bad header length")
+    try:
+        header = json.loads(data[HEADER_SIZE.size:HEADER_SIZE.size + size])
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        raise FrameError("invalid header")
+    if not isinstance(header, dict):
+        raise FrameError("invalid header")
+    encoding = header.get("encoding")
+    if encoding is not None and encoding not in IMAGE_ENCODINGS:
+        raise FrameError("unsupported encoding")
+    return header, memoryview(data)[HEADER_SIZE.size + size:].tobytes()
+
+
+def reply_format(header: dict) -> str:
+    """Format for binary replies: msgpack when requested and installed, else json."""
+    wanted = header.get("reply", "msgpack")
+    return "msgpack" if wanted == "msgpack" and msgpack is not None else "json"
+
+
+def encode_reply(message: dict, fmt: str) -> bytes:
+    if fmt == "msgpack":
+        return msgpack.packb(message, use_bin_type=True)
+    return json.dumps(message, separators=(",", ":")).encode("utf-8")
+
+
+def decode_reply(data: bytes, fmt: str) -> dict:
+    if fmt == "msgpack":
+        return msgpack.unpackb(data, raw=False)
+    return json.loads(data)
@@ -0,0 +1,95 @@
+# scripts/bench_guide_index.py
+"""
+Guide recommendation and matching latency on a large synthetic index.
+
+    python scripts/bench_guide_index.py                      # 10k guides x 10 steps
+    python scripts/bench_guide_index.py --guides 50000 --steps 8
+
+Prints the build time, the median and p95 latency of recommend() for
+OCR-sized screen texts and of match() for questions, and the cost of
+re-indexing a single guide (what the guide routes do on every write).
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# The index is filled directly; no database is touched
+os.environ.setdefault("DATABASE_URL", "sqlite:///:memory:")
+
+from app.services.guide_index import GuideIndex  # noqa: E402
+
+VERBS = "open click select choose enter type upload download export import save delete share copy".split()
+
+
+def vocabulary(size: int, rng: random.Random) -> list:
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    return ["".join(rng.choice(letters) for _ in range(rng.randint(4, 9))) for _ in range(size)]
+
+
+def synthetic_doc(guide_id: int, steps: int, words: list, rng: random.Random) -> dict:
+    def phrase(n):
+        return " ".join(rng.choice(words) for _ in range(n))
+
+    return {
+        "id": guide_id, "name": phrase(3), "shortcut": f"guide-{guide_id}", "description": phrase(8),
+        "owner_id": guide_id % 500, "is_public": guide_id % 3 == 0, "emails": set(),
+        "steps": [f"{rng.choice(VERBS)} {phrase(4)}" for _ in range(steps)],
+    }
+
+
+def percentiles(times: list) -> str:
+    times = sorted(t * 1000 for t in times)
+    return f"median {statistics.median(times):.2f} ms, p95 {times[int(len(times) * 0.95)]:.2f} ms"
+
+
+def main(args):
+    rng = random.Random(7)
+    words = vocabulary(args.vocabulary, rng)
+    docs = [synthetic_doc(i, args.steps, words, rng) for i in range(args.guides)]
+    index = GuideIndex()
+    started = time.perf_counter()
+    for doc in docs:
+        index.add(doc)
+    print(f"{args.guides} guides, {args.guides * args.steps} steps, {args.vocabulary} words: "
+          f"built in {time.perf_counter() - started:.1f} s")
+
+    user = SimpleNamespace(id=1, email="bench@example.com")
+    screens = [" ".join(rng.choice(words) for _ in range(args.screen_words)) for _ in range(args.queries)]
+    questions = [" ".join(rng.choice(words) for _ in range(6)) for _ in range(args.queries)]
+
+    times = []
+    for screen in screens:
+        started = time.perf_counter()
+        index.recommend(screen, user, limit=10)
+        times.append(time.perf_counter() - started)
+    print(f"recommend ({args.screen_words} screen words): {percentiles(times)}")
+
+    times = []
+    for question, screen in zip(questions, screens):
+        started = time.perf_counter()
+        index.match(question, screen, user)
+        times.append(time.perf_counter() - started)
+    print(f"match (6-word question): {percentiles(times)}")
+
+    times = []
+    for i in range(args.queries):
+        doc = synthetic_doc(rng.randrange(args.guides), args.steps, words, rng)
+        started = time.perf_counter()
+        index.add(doc)
+        times.append(time.perf_counter() - started)
+    print(f"re-index one guide: {percentiles(times)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--guides", type=int, default=10000)
+    parser.add_argument("--steps", type=int, default=10, help="steps per guide")
+    parser.add_argument("--vocabulary", type=int, default=20000, help="distinct words")
+    parser.add_argument("--screen-words", type=int, default=150, help="OCR words per screen")
+    parser.add_argument("--queries", type=int, default=200)
+    main(parser.parse_args())
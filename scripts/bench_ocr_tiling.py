@@ -0,0 +1,104 @@
+# scripts/bench_ocr_tiling.py
+"""
+Single-shot vs tiled OCR on screenshots of increasing size.
+
+    python scripts/bench_ocr_tiling.py                  # synthetic text screens
+    python scripts/bench_ocr_tiling.py shot1.png ...    # your own screenshots
+
+Both modes run through the same OCR process pool (OCR_WORKERS). The output
+shows, per image size, the median latency of each mode and the smallest OCR
+input (in pixels) where tiling wins; use that for OCR_TILE_MIN_PIXELS.
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Large frames on few cores can take longer than a request's OCR budget
+os.environ.setdefault("OCR_CALL_TIMEOUT", "600")
+
+from PIL import Image, ImageDraw, ImageFont  # noqa: E402
+
+from app.services import executor, ocr_service  # noqa: E402
+from app.services.ocr_preprocess import prepare_for_ocr  # noqa: E402
+
+SIZES = [(1280, 720), (1920, 1080), (2560, 1440), (3440, 1440), (3840, 2160), (5120, 2160)]
+WORDS = "open file edit view settings save export share account profile search help".split()
+
+
+def synthetic_screen(width: int, height: int) -> Image.Image:
+    """White screen filled with rows of dark UI-sized words."""
+    img = Image.new("RGB", (width, height), "white")
+    draw = ImageDraw.Draw(img)
+    try:
+        font = ImageFont.load_default(size=18)
+    except TypeError:  # Pillow < 10.1
+        font = ImageFont.load_default()
+    y, i = 12, 0
+    while y < height - 30:
+        x = 12
+        while x < width - 160:
+            word = WORDS[i % len(WORDS)]
+            draw.text((x, y), word, fill=(20, 20, 20), font=font)
+            x += 24 + 11 * len(word)
+            i += 1
+        y += 34
+    return img
+
+
+async def time_mode(img, profile, tiled: bool, runs: int) -> tuple:
+    times, words = [], 0
+    for _ in range(runs):
+        started = time.perf_counter()
+        if tiled:
+            result = await ocr_service.run_ocr_tiled(img, profile)
+        else:
+            (result,), _ = await ocr_service.ocr_images([img], profile=profile)
+        times.append(time.perf_counter() - started)
+        words = len(result)
+    return statistics.median(times) * 1000, words
+
+
+async def main(args):
+    if args.images:
+        images = [(path, Image.open(path).convert("RGB")) for path in args.images]
+    else:
+        images = [(f"{w}x{h}", synthetic_screen(w, h)) for w, h in SIZES]
+
+    # Warm every worker so process start-up and engine load are not timed
+    warm = Image.new("RGB", (64, 32), "white")
+    await asyncio.gather(*(ocr_service.ocr_images([warm]) for _ in range(executor.OCR_WORKERS)))
+
+    print(f"workers={executor.OCR_WORKERS} profile={args.profile} "
+          f"tile={ocr_service.OCR_TILE_SIZE} overlap={ocr_service.OCR_TILE_OVERLAP}")
+    print(f"{'image':>14} {'ocr input':>11} {'tiles':>5} {'single ms':>10} {'tiled ms':>9} "
+          f"{'words':>11} {'speedup':>7}")
+    crossover = None
+    for name, img in images:
+        gray, _ = prepare_for_ocr(img, args.profile)
+        tiles = len(ocr_service.tile_grid(*gray.size))
+        single_ms, single_words = await time_mode(img, args.profile, False, args.runs)
+        tiled_ms, tiled_words = await time_mode(img, args.profile, True, args.runs)
+        speedup = single_ms / tiled_ms
+        pixels = gray.size[0] * gray.size[1]
+        if speedup > 1 and (crossover is None or pixels < crossover):
+            crossover = pixels
+        print(f"{name:>14} {gray.size[0]:>5}x{gray.size[1]:<5} {tiles:>5} {single_ms:>10.0f} "
+              f"{tiled_ms:>9.0f} {single_words:>5}/{tiled_words:<5} {speedup:>6.2f}x")
+
+    if crossover is None:
+        print("\nTiling did not beat single-shot OCR at any size; keep OCR_TILING=off.")
+    else:
+        print(f"\nTiling wins from about {crossover} OCR pixels: OCR_TILE_MIN_PIXELS={crossover}")
+    executor.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("images", nargs="*", help="screenshots to use instead of synthetic screens")
+    parser.add_argument("--profile", default="accurate", help="OCR profile (fast, balanced, accurate)")
+    parser.add_argument("--runs", type=int, default=3, help="timed runs per mode and image")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,229 @@
+import asyncio
+import base64
+import json
+import os
+from io import BytesIO
+from types import SimpleNamespace
+
+import pytest
+from fastapi.testclient import TestClient
+from PIL import Image
+
+# Mock environment variables
+os.environ["SECRET_KEY"] = "test_secret_key"
+os.environ["DATABASE_URL"] = "sqlite:///:memory:"
+
+from app.main import app
+from app import auth
+from app.routes import analyze
+from app.services.ocr_result import OcrResult
+
+
+def _png(size=(1600, 900)):
+    buf = BytesIO()
+    Image.new("RGB", size, "white").save(buf, format="PNG")
+    return buf.getvalue()
+
+
+@pytest.fixture
+def client(monkeypatch):
+    async def fake_ocr(img, profile=None):
+        return OcrResult(["Save"], [91.0], [[10, 10, 50, 30]], [0], [0])
+
+    async def fake_vision(img):
+        return {"width": img.width, "height": img.height, "elements": [], "summary": {}}
+
+    async def fake_plan(vision, ocr, question, use_cache=True):
+        return {"steps": [f"Answer: {question}"]}
+
+    monkeypatch.setattr(analyze, "run_ocr_cached", fake_ocr)
+    monkeypatch.setattr(analyze, "analyze_screen", fake_vision)
+    monkeypatch.setattr(analyze, "plan_actions", fake_plan)
+    app.dependency_overrides[auth.get_current_user] = lambda: SimpleNamespace(id=1, email="a@example.com")
+    with TestClient(app) as c:
+        yield c
+    app.dependency_overrides.clear()
+
+
+def _analyze(client, raw, **form):
+    return client.post("/api/analyze/analyze", data={"question": "save?", **form},
+                       files={"file": ("screen.png", raw, "image/png")})
+
+
+def test_original_echo_returns_upload_bytes_untouched(client):
+    raw = _png()
+    result = _analyze(client, raw).json()["result"]
+
+    assert base64.b64decode(result["image_base64"]) == raw
+    assert result["image_mime"] == "image/png"
+    assert (result["image_width"], result["image_height"]) == (1600, 900)
+    assert result["steps"] == ["Answer: save?"]
+
+
+def test_echo_none_omits_the_image(client):
+    result = _analyze(client, _png(), echo="none").json()["result"]
+
+    assert "image_base64" not in result
+    assert (result["image_width"], result["image_height"]) == (1600, 900)
+
+
+@pytest.mark.parametrize("fmt,pil_format", [("webp", "WEBP"), ("jpeg", "JPEG")])
+def test_preview_echo_is_downscaled(client, fmt, pil_format):
+    result = _analyze(client, _png(), echo="preview", preview_format=fmt).json()["result"]
+
+    preview = Image.open(BytesIO(base64.b64decode(result["image_base64"])))
+    assert preview.format == pil_format
+    assert preview.size == (analyze.PREVIEW_MAX_WIDTH, 540)
+    assert (result["preview_width"], result["preview_height"]) == preview.size
+    assert (result["image_width"], result["image_height"]) == (1600, 900)
+
+
+def _batch(client, images, questions, **form):
+    files = [("files", (f"s{i}.png", raw, "image/png")) for i, raw in enumerate(images)]
+    return client.post("/api/analyze/analyze_batch", data={"questions": questions, **form}, files=files)
+
+
+def test_batch_returns_per_item_results_in_order(client, monkeypatch):
+    calls = []
+    real_ocr = analyze.run_ocr_cached
+
+    async def counting_ocr(img, profile=None):
+        calls.append(img.size)
+        return await real_ocr(img, profile)
+
+    monkeypatch.setattr(analyze, "run_ocr_cached", counting_ocr)
+    raw = _png((400, 300))
+    body = _batch(client, [raw, _png((500, 300)), raw], ["a", "b", "c"]).json()
+
+    assert body["success"] is True
+    assert [r["index"] for r in body["results"]] == [0, 1, 2]
+    assert [r["result"]["steps"] for r in body["results"]] == [["Answer: a"], ["Answer: b"], ["Answer: c"]]
+    assert "image_base64" not in body["results"][0]["result"]
+    # The duplicate image is only OCR'd once
+    assert sorted(calls) == [(400, 300), (500, 300)]
+
+
+def test_batch_items_get_their_own_budget_once_they_start(client, monkeypatch):
+    async def slow_plan(vision, ocr, question, use_cache=True):
+        await asyncio.sleep(0.4)
+        return {"steps": [f"Answer: {question}"]}
+
+    monkeypatch.setattr(analyze, "plan_actions", slow_plan)
+    monkeypatch.setattr(analyze, "ANALYZE_BATCH_CONCURRENCY", 1)
+    images = [_png((400 + i, 300)) for i in range(4)]
+    body = _batch(client, images, ["q"], deadline_ms="3000").json()
+
+    # Items queued behind the others still get their LLM answer
+    assert [r["result"].get("partial", False) for r in body["results"]] == [False] * 4
+    assert [r["result"]["steps"] for r in body["results"]] == [["Answer: q"]] * 4
+
+
+def test_batch_item_errors_do_not_fail_the_batch(client):
+    body = _batch(client, [_png((400, 300)), b"not an image"], ["same question"]).json()
+
+    assert body["results"][0]["success"] is True
+    assert body["results"][1] == {"index": 1, "success": False,
+                                  "error": "An error occurred during screen analysis"}
+
+
+def test_batch_can_stream_ndjson(client):
+    response = _batch(client, [_png((400, 300)), _png((500, 300))], ["q"], stream="true")
+
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    items = [json.loads(line) for line in response.text.splitlines()]
+    assert sorted(item["index"] for item in items) == [0, 1]
+    assert all(item["success"] for item in items)
+
+
+def test_batch_rejects_mismatched_questions(client):
+    assert _batch(client, [_png(), _png(), _png()], ["a", "b"]).status_code == 400
+
+
+def test_async_mode_returns_a_job_to_poll(client):
+    response = _analyze(client, _png((400, 300)), mode="async", echo="none")
+    assert response.status_code == 202
+    job_id = response.json()["job_id"]
+
+    job = client.get(f"/api/analyze/jobs/{job_id}", params={"wait": 5}).json()
+    assert job["status"] == "done"
+    assert job["result"]["result"]["steps"] == ["Answer: save?"]
+    assert "owner" not in job
+
+
+def test_async_mode_is_refused_when_jobs_cannot_be_shared(client, monkeypatch):
+    monkeypatch.setenv("WEB_CONCURRENCY", "4")
+    response = _analyze(client, _png((400, 300)), mode="async", echo="none")
+    assert response.status_code == 501
+
+
+def test_jobs_are_private_to_their_owner(client):
+    job_id = _analyze(client, _png((400, 300)), mode="async").json()["job_id"]
+    app.dependency_overrides[auth.get_current_user] = lambda: SimpleNamespace(id=2, email="b@example.com")
+
+    assert client.get(f"/api/analyze/jobs/{job_id}").status_code == 404
+    assert client.get("/api/analyze/jobs/unknown").status_code == 404
+
+
+def test_full_job_queue_is_rejected(client, monkeypatch):
+    monkeypatch.setattr(analyze.job_queue, "limit", 1)
+    monkeypatch.setattr(analyze.job_queue, "_queue", None)  # rebuild at the new limit
+    monkeypatch.setattr(analyze.job_queue, "workers", 0)  # nothing drains the queue
+    assert _analyze(client, _png((400, 300)), mode="async").status_code == 202
+    assert _analyze(client, _png((400, 300)), mode="async").status_code == 503
+
+
+def test_regions_limit_ocr_to_the_requested_area(client, monkeypatch):
+    seen = []
+
+    async def fake_regions(img, regions, margin=None, profile=None):
+        seen.append((regions, margin))
+        return OcrResult.empty()
+
+    monkeypatch.setattr(analyze, "run_ocr_regions", fake_regions)
+    regions = json.dumps([{"x": 100, "y": 50, "width": 200, "height": 40}])
+    assert _analyze(client, _png(), regions=regions, margin="16").status_code == 200
+    assert seen == [([[100, 50, 300, 90]], 16)]
+
+    assert _analyze(client, _png(), regions="[[1, 2]]").status_code == 400
+    assert _analyze(client, _png(), regions="[[1e400, 0, 5, 5]]").status_code == 400
+
+
+def test_slow_llm_returns_a_partial_result(client, monkeypatch):
+    from app.services import deadline
+
+    assert _analyze(client, _png(), echo="none").json()["result"]["partial"] is False
+
+    async def slow_plan(vision, ocr, question, use_cache=True):
+        await asyncio.sleep(2)
+
+    monkeypatch.setattr(analyze, "plan_actions", slow_plan)
+    monkeypatch.setitem(deadline.STAGE_MIN_BUDGET, "llm", 0)
+    result = _analyze(client, _png(), deadline_ms="500", echo="none").json()["result"]
+
+    assert result["partial"] is True and result["timed_out"] == ["llm"]
+    assert result["steps"] == []
+    assert result["ocr_lines"][0]["text"] == "Save"
+    assert result["vision"]["width"] == 1600
+
+
+def test_matching_guide_answers_without_the_llm(client, monkeypatch):
+    from app.services.guide_index import guide_answer
+
+    async def fake_match(question, ocr, user):
+        if user is None:
+            return None
+        return guide_answer({"id": 7, "name": "Save a file", "shortcut": "save", "score": 0.9,
+                             "steps": ["Click Save"]})
+
+    async def no_llm(*args, **kwargs):
+        raise AssertionError("LLM called")
+
+    monkeypatch.setattr(analyze, "match_guide", fake_match)
+    monkeypatch.setattr(analyze, "plan_actions", no_llm)
+    result = _analyze(client, _png(), echo="none").json()["result"]
+
+    assert result["source"] == "guide" and result["guide"]["id"] == 7
+    assert result["steps"] == ["Click Save"] and result["partial"] is False
+
+    monkeypatch.setattr(analyze, "plan_actions", lambda *a, **k: asyncio.sleep(0, {"steps": ["LLM"]}))
+    assert _analyze(client, _png(), echo="none", use_guides="false").json()["result"]["steps"] == ["LLM"]
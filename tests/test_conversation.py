@@ -0,0 +1,68 @@
+import json
+
+from app.services.conversation import Conversation, screen_delta
+
+SCREEN = {"width": 1200, "height": 900}
+
+
+def _screen(regions, ui=None, **meta):
+    compacted = {"screen": dict(SCREEN, **meta), "regions": regions}
+    if ui:
+        compacted["ui"] = ui
+    return compacted
+
+
+def test_delta_lists_added_and_removed_lines():
+    before = _screen({"top-left": ["File", "Edit"], "bottom-right": ["Save"]})
+    after = _screen({"top-left": ["File", "Edit"], "center": ["Saved!"]})
+
+    assert screen_delta(before, after) == {"added": {"center": ["Saved!"]},
+                                           "removed": {"bottom-right": ["Save"]}}
+    assert screen_delta(before, before) == {}
+    # A different screen size, or mostly new text, needs the whole screen again
+    assert screen_delta(before, _screen(before["regions"], width=800)) is None
+    assert screen_delta(before, _screen({"center": ["Login", "Password"]})) is None
+
+
+def test_follow_up_turns_send_only_the_delta():
+    convo = Conversation()
+    first = _screen({"top-left": ["File", "Edit", "View"], "bottom-right": ["Save"]})
+    messages = convo.messages("SYS", first, "How do I save?")
+    assert [m["role"] for m in messages] == ["system", "user"]
+    assert json.loads(messages[-1]["content"])["regions"] == first["regions"]
+    convo.record({"steps": ["Click Save at the bottom-right"], "highlights": []})
+
+    second = _screen({"top-left": ["File", "Edit", "View"], "bottom-right": ["Save"], "center": ["Saved"]})
+    messages = convo.messages("SYS", second, "And now?")
+    assert [m["role"] for m in messages] == ["system", "user", "assistant", "user"]
+    assert json.loads(messages[2]["content"]) == {"steps": ["Click Save at the bottom-right"]}
+    assert json.loads(messages[-1]["content"]) == {"screen_changes": {"added": {"center": ["Saved"]}},
+                                                   "user_question": "And now?"}
+    convo.record({"steps": ["Done"]})
+
+    messages = convo.messages("SYS", second, "Anything else?")
+    assert json.loads(messages[-1]["content"]) == {"screen_unchanged": True, "user_question": "Anything else?"}
+
+
+def test_unrecorded_turn_is_not_kept():
+    convo = Conversation()
+    convo.messages("SYS", _screen({"top": ["Home"]}), "q1")
+    # The call failed: nothing was recorded, so the next turn is a full screen again
+    messages = convo.messages("SYS", _screen({"top": ["Home"]}), "q2")
+    assert len(convo) == 0 and "regions" in json.loads(messages[-1]["content"])
+
+
+def test_history_is_trimmed_and_the_screen_resent_when_its_base_falls_out():
+    convo = Conversation(budget=120)
+    base = {"top-left": [f"Menu item {i}" for i in range(10)]}
+    convo.messages("SYS", _screen(base), "q0")
+    convo.record({"steps": ["a"]})
+    for i in range(1, 4):
+        regions = dict(base, center=[f"Status {i}"])
+        messages = convo.messages("SYS", _screen(regions), f"q{i}")
+        convo.record({"steps": [f"answer {i}"]})
+
+    last = json.loads(messages[-1]["content"])
+    # The first (full) turn no longer fit, so the screen was sent whole again
+    assert "regions" in last and last["regions"]["center"] == ["Status 3"]
+    assert sum(len(m["content"]) for m in messages[1:]) / 4 <= 120
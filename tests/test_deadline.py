@@ -0,0 +1,60 @@
+import asyncio
+
+import pytest
+
+from app.services import deadline as deadline_mod
+from app.services import metrics
+from app.services.deadline import Deadline, StageTimeout
+
+
+class FakeTimer:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_stage_timeouts_are_slices_of_what_is_left():
+    timer = FakeTimer()
+    deadline = Deadline(10, timer=timer)
+
+    assert deadline.timeout_for("ocr") == 5.0
+    assert deadline.timeout_for("llm") == 10 - deadline_mod.DEADLINE_RESERVE
+    timer.now += 8
+    assert deadline.timeout_for("ocr") == pytest.approx(2 - deadline_mod.DEADLINE_RESERVE)
+    timer.now += 5
+    assert deadline.remaining == 0 and deadline.timeout_for("vision") == 0
+
+
+def test_budget_is_capped_and_defaulted():
+    assert Deadline(None).budget == deadline_mod.ANALYZE_DEADLINE
+    assert Deadline(10_000).budget == deadline_mod.ANALYZE_MAX_DEADLINE
+
+
+def test_slow_stage_raises_and_is_counted():
+    metrics.reset()
+
+    async def main():
+        with pytest.raises(StageTimeout) as exc:
+            await Deadline(0.5).run("vision", asyncio.sleep(5))
+        return exc.value.stage
+
+    assert asyncio.run(main()) == "vision"
+    assert metrics.get("deadline.timeout.vision") == 1
+
+
+def test_llm_is_not_started_without_its_minimum_budget():
+    metrics.reset()
+    started = []
+
+    async def call():
+        started.append(True)
+
+    async def main():
+        with pytest.raises(StageTimeout):
+            await Deadline(1).run("llm", call())
+
+    asyncio.run(main())
+    assert started == []
+    assert metrics.get("deadline.skipped.llm") == 1
@@ -0,0 +1,65 @@
+import asyncio
+import os
+import threading
+from concurrent.futures import BrokenExecutor, ProcessPoolExecutor, ThreadPoolExecutor
+
+import pytest
+
+from app.services import executor
+from app.services.executor import BoundedExecutor, ExecutorSaturated
+
+
+def _thread_factory(max_workers, initializer=None):
+    return ThreadPoolExecutor(max_workers=max_workers, initializer=initializer)
+
+
+def test_bounded_executor_runs_off_event_loop():
+    pool = BoundedExecutor("test", _thread_factory, max_workers=2, queue_limit=4)
+
+    async def main():
+        loop_thread = threading.get_ident()
+        worker_thread = await pool.run(threading.get_ident)
+        return loop_thread, worker_thread
+
+    try:
+        loop_thread, worker_thread = asyncio.run(main())
+        assert loop_thread != worker_thread
+        assert pool.pending == 0
+    finally:
+        pool.shutdown()
+
+
+def test_bounded_executor_rejects_when_saturated():
+    pool = BoundedExecutor("test", _thread_factory, max_workers=1, queue_limit=1)
+    release = threading.Event()
+
+    async def main():
+        first = asyncio.ensure_future(pool.run(release.wait))
+        await asyncio.sleep(0.05)
+        with pytest.raises(ExecutorSaturated):
+            await pool.run(lambda: None)
+        release.set()
+        await first
+
+    try:
+        asyncio.run(main())
+        assert pool.pending == 0
+    finally:
+        pool.shutdown()
+
+
+def test_a_broken_process_pool_is_replaced():
+    pool = BoundedExecutor("test-broken", executor._ocr_factory, max_workers=1, queue_limit=2)
+
+    async def main():
+        first = await pool.run(os.getpid)
+        with pytest.raises(BrokenExecutor):
+            await pool.run(os._exit, 1)  # the worker dies, as on a native crash or OOM kill
+        return first, await pool.run(os.getpid)
+
+    try:
+        first, after = asyncio.run(main())
+        assert first != after != os.getpid()
+        assert pool.pending == 0
+    finally:
+        pool.shutdown()
@@ -0,0 +1,87 @@
+import asyncio
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+from app.services import frame_diff
+from app.services.frame_diff import FrameState, dirty_tiles, tile_regions
+from app.services.ocr_result import OcrResult
+
+
+def _frame(extra=None):
+    img = Image.new("RGB", (640, 384), "white")
+    draw = ImageDraw.Draw(img)
+    draw.rectangle([10, 10, 120, 30], fill="black")
+    if extra:
+        draw.rectangle(extra, fill="black")
+    return img
+
+
+def test_dirty_tiles_marks_only_changed_tiles():
+    prev = np.asarray(_frame().convert("L"))
+    cur = np.asarray(_frame(extra=[300, 200, 340, 220]).convert("L"))
+
+    mask = dirty_tiles(prev, cur, tile=64)
+
+    assert mask.shape == (6, 10)
+    assert np.argwhere(mask).tolist() == [[3, 4], [3, 5]]
+    assert tile_regions(mask, 64, 640, 384) == [[256, 192, 384, 256]]
+
+
+def test_frame_state_reocrs_only_changed_regions(monkeypatch):
+    full_calls, crop_calls = [], []
+    old_word = OcrResult(["Title"], [95.0], [[10, 10, 120, 30]], [0], [0])
+
+    async def fake_full(img, profile=None):
+        full_calls.append(img.size)
+        return old_word
+
+    async def fake_ocr_images(crops, offsets, profile=None):
+        crop_calls.extend((crop.size, offset) for crop, offset in zip(crops, offsets))
+        return [OcrResult(["New"], [90.0], [[300, 200, 340, 220]], [0], [0])], {}
+
+    monkeypatch.setattr(frame_diff, "run_ocr_cached", fake_full)
+    monkeypatch.setattr(frame_diff, "ocr_images", fake_ocr_images)
+
+    async def main():
+        state = FrameState(tile=64)
+        first = await state.ocr(_frame())
+        unchanged = await state.ocr(_frame())
+        changed = await state.ocr(_frame(extra=[300, 200, 340, 220]))
+        return first, unchanged, changed
+
+    first, unchanged, changed = asyncio.run(main())
+
+    assert len(full_calls) == 1
+    assert first is unchanged is old_word
+    assert crop_calls == [((144, 80), (248, 184))]
+    assert changed.text.tolist() == ["Title", "New"]
+    assert changed.line.tolist() == [0, 1]
+
+
+def test_frame_state_keeps_unchanged_neighbours_of_a_grown_region(monkeypatch):
+    # Growing the dirty region over A brings it within padding of B; B must
+    # be re-read with it, not dropped from both the old and the new words
+    words = OcrResult(["A", "B"], [95.0, 95.0], [[100, 100, 150, 120], [156, 100, 200, 120]],
+                      [0, 0], [0, 0])
+    crop_calls = []
+
+    async def fake_full(img, profile=None):
+        return words
+
+    async def fake_ocr_images(crops, offsets, profile=None):
+        crop_calls.extend(offsets)
+        return [words], {}
+
+    monkeypatch.setattr(frame_diff, "run_ocr_cached", fake_full)
+    monkeypatch.setattr(frame_diff, "ocr_images", fake_ocr_images)
+
+    async def main():
+        state = FrameState(tile=64)
+        await state.ocr(_frame())
+        return await state.ocr(_frame(extra=[68, 108, 72, 112]))
+
+    changed = asyncio.run(main())
+
+    assert len(crop_calls) == 1
+    assert changed.text.tolist() == ["A", "B"]
@@ -0,0 +1,133 @@
+import asyncio
+
+from app.services.frame_scheduler import FramePipeline
+
+
+class Recorder:
+    def __init__(self, delay=0.05):
+        self.delay = delay
+        self.done = []
+        self.skipped = []
+
+    async def handler(self, frame):
+        await asyncio.sleep(self.delay)
+        self.done.append(frame)
+
+    async def on_skip(self, frame_id, reason, latest_id):
+        self.skipped.append((frame_id, reason, latest_id))
+
+
+def _run(scenario):
+    return asyncio.run(scenario())
+
+
+def test_waiting_frames_are_superseded_by_the_newest():
+    rec = Recorder()
+
+    async def scenario():
+        sched = FramePipeline([rec.handler], rec.on_skip, cancel_inflight=False)
+        await sched.submit(1, "a")
+        await asyncio.sleep(0.01)  # frame 1 starts
+        await sched.submit(2, "b")
+        await sched.submit(3, "c")
+        await asyncio.sleep(0.2)
+        await sched.close()
+
+    _run(scenario)
+    assert rec.done == ["a", "c"]
+    assert rec.skipped == [(2, "superseded", 3)]
+
+
+def test_inflight_frame_is_cancelled_by_a_newer_one():
+    rec = Recorder()
+
+    async def scenario():
+        sched = FramePipeline([rec.handler], rec.on_skip)
+        await sched.submit(1, "a")
+        await asyncio.sleep(0.01)
+        await sched.submit(2, "b")
+        await asyncio.sleep(0.2)
+        await sched.close()
+
+    _run(scenario)
+    assert rec.done == ["b"]
+    assert rec.skipped == [(1, "cancelled", 2)]
+
+
+def test_consecutive_cancellations_are_bounded():
+    rec = Recorder(delay=0.05)
+
+    async def scenario():
+        sched = FramePipeline([rec.handler], rec.on_skip, max_consecutive_cancels=1)
+        for frame_id in range(1, 5):
+            await sched.submit(frame_id, frame_id)
+            await asyncio.sleep(0.01)
+        await asyncio.sleep(0.3)
+        await sched.close()
+
+    _run(scenario)
+    # Frame 1 is cancelled, frame 2 is then allowed to finish, 3 waits and is superseded by 4
+    assert rec.done == [2, 4]
+    assert rec.skipped == [(1, "cancelled", 2), (3, "superseded", 4)]
+
+
+def test_close_cancels_inflight_work():
+    rec = Recorder(delay=10)
+
+    async def scenario():
+        sched = FramePipeline([rec.handler], rec.on_skip)
+        await sched.submit(1, "a")
+        await asyncio.sleep(0.01)
+        await sched.close()
+
+    _run(scenario)
+    assert rec.done == []
+
+
+def test_stages_overlap_and_deliver_in_order():
+    events = []
+
+    async def perceive(frame):
+        events.append(("perceive start", frame))
+        await asyncio.sleep(0.05)
+        return frame
+
+    async def answer(frame):
+        await asyncio.sleep(0.1)
+        events.append(("answer end", frame))
+
+    async def scenario():
+        rec = Recorder()
+        pipe = FramePipeline([perceive, answer], rec.on_skip, cancel_inflight=False)
+        await pipe.submit(1, 1)
+        await asyncio.sleep(0.06)  # frame 1 is now in the LLM stage
+        await pipe.submit(2, 2)
+        await asyncio.sleep(0.3)
+        await pipe.close()
+        return rec.skipped
+
+    assert _run(scenario) == []
+    # Frame 2's OCR runs while frame 1's LLM call is still in flight
+    assert events == [("perceive start", 1), ("perceive start", 2), ("answer end", 1), ("answer end", 2)]
+
+
+def test_stage_returning_none_stops_the_frame():
+    delivered = []
+
+    async def perceive(frame):
+        return None if frame == "bad" else frame
+
+    async def answer(frame):
+        delivered.append(frame)
+
+    async def scenario():
+        rec = Recorder()
+        pipe = FramePipeline([perceive, answer], rec.on_skip, cancel_inflight=False)
+        await pipe.submit(1, "bad")
+        await asyncio.sleep(0.01)
+        await pipe.submit(2, "good")
+        await asyncio.sleep(0.05)
+        await pipe.close()
+
+    _run(scenario)
+    assert delivered == ["good"]
@@ -0,0 +1,366 @@
+import asyncio
+import os
+import threading
+import time
+from io import BytesIO
+from types import SimpleNamespace
+
+import pytest
+from fastapi.testclient import TestClient
+from PIL import Image
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+# Mock environment variables
+os.environ["SECRET_KEY"] = "test_secret_key"
+os.environ["DATABASE_URL"] = "sqlite:///:memory:"
+
+from app.main import app
+from app.database import Base, get_db
+from app.services import guide_index as guide_index_mod
+from app.services.guide_index import GuideIndex, match_guide, recommend_guides
+from app.services.ocr_result import OcrResult
+
+OWNER = SimpleNamespace(id=1, email="owner@example.com")
+STRANGER = SimpleNamespace(id=2, email="stranger@example.com")
+
+
+def _doc(guide_id, name, steps, description="", owner_id=1, is_public=False, emails=()):
+    return {"id": guide_id, "name": name, "shortcut": f"g{guide_id}", "description": description,
+            "owner_id": owner_id, "is_public": is_public, "emails": set(emails), "steps": steps}
+
+
+def _use_index(monkeypatch, idx):
+    """Serve `idx` without touching the database."""
+    monkeypatch.setattr(idx, "ensure_loaded", lambda: None)
+    monkeypatch.setattr(guide_index_mod, "guide_index", idx)
+    monkeypatch.setattr(guide_index_mod, "confirm_access", lambda ids, user: {i: idx.get(i) for i in ids})
+
+
+@pytest.fixture
+def index(monkeypatch):
+    idx = GuideIndex()
+    idx.add(_doc(1, "Export invoice as PDF", ["Open Billing", "Click Invoices", "Click Export PDF"],
+                 "Download an invoice from the billing page"))
+    idx.add(_doc(2, "Change profile picture", ["Open Settings", "Click Profile", "Upload photo"]))
+    idx.add(_doc(3, "Invite a teammate", ["Open Team", "Click Invite", "Enter email"], is_public=True))
+    _use_index(monkeypatch, idx)
+    return idx
+
+
+def test_question_matching_a_guide_returns_its_steps(index):
+    match = index.match("How do I export an invoice as PDF?", "Billing Invoices Export PDF", OWNER)
+
+    assert match["id"] == 1
+    assert match["steps"] == ["Open Billing", "Click Invoices", "Click Export PDF"]
+    assert 0.55 <= match["score"] <= 1
+
+
+def test_weak_or_inaccessible_matches_fall_back_to_the_llm(index):
+    assert index.match("What is the weather like?", "", OWNER) is None
+    # Guide 1 is private to its owner
+    assert index.match("How do I export an invoice as PDF?", "Billing", STRANGER) is None
+    # Public guides match for everyone; shared ones by email
+    assert index.match("how to invite a teammate", "Team Invite", STRANGER)["id"] == 3
+    index.add(_doc(1, "Export invoice as PDF", ["Click Export PDF"], emails={STRANGER.email}))
+    assert index.match("export invoice pdf", "Export PDF", STRANGER)["id"] == 1
+
+
+def test_unrelated_screens_never_match(index):
+    inbox = "Inbox Compose Sent Drafts Spam Starred"
+    assert index.match("How do I change my profile picture?", inbox, OWNER) is None
+    assert index.match("export invoice as pdf", "", OWNER) is None
+    assert index.match("export invoice as pdf", inbox, OWNER) is None
+
+
+def test_long_guides_match_on_the_screen_of_one_step(index):
+    steps = ["Open Admin console", "Click Security", "Click Single sign-on", "Choose SAML provider",
+             "Paste the metadata URL", "Upload the signing certificate", "Map the email attribute",
+             "Map the name attribute", "Add a test user", "Run the connection test", "Review the logs",
+             "Enable SSO for all members", "Notify members", "Turn on enforcement", "Save the settings"]
+    index.add(_doc(9, "Set up SSO", steps, "Single sign-on with SAML"))
+
+    match = index.match("How do I set up SSO?", "Admin console Security Single sign-on Users Billing", OWNER)
+    assert match is not None and match["id"] == 9
+
+
+def test_removed_guides_are_not_matched(index):
+    index.remove(2)
+    assert index.match("change my profile picture", "Settings Profile", OWNER) is None
+    assert len(index) == 2
+
+
+def test_match_guide_builds_a_plan_shaped_answer(index):
+    ocr = OcrResult(["Settings", "Profile"], [90, 90], [[0, 0, 10, 10], [20, 0, 30, 10]], [0, 0], [0, 0])
+    answer = asyncio.run(match_guide("How do I change my profile picture?", ocr, OWNER))
+
+    assert answer["source"] == "guide" and answer["guide"]["id"] == 2
+    assert answer["steps"] == ["Open Settings", "Click Profile", "Upload photo"]
+    assert asyncio.run(match_guide("How do I change my profile picture?", ocr, None)) is None
+
+
+def test_recommend_ranks_accessible_guides_for_the_screen(index):
+    screen = "Billing Invoices Export PDF Team Invite Settings"
+    ranked = index.recommend(screen, OWNER)
+
+    assert [g["id"] for g in ranked][:1] == [1]
+    assert {g["id"] for g in ranked} == {1, 2, 3}
+    assert ranked[0]["step_count"] == 3 and ranked[0]["score"] >= ranked[-1]["score"]
+    # Private guides of other users are never recommended
+    assert [g["id"] for g in index.recommend(screen, STRANGER)] == [3]
+    # The question reorders screens that fit several guides
+    assert index.recommend(screen, OWNER, question="profile photo", limit=1)[0]["id"] == 2
+    assert index.recommend("", OWNER) == []
+
+
+def test_updates_replace_rows_and_compact(index, monkeypatch):
+    monkeypatch.setattr(guide_index_mod, "GUIDE_INDEX_COMPACT_MIN", 2)
+    for version in range(5):
+        index.add(_doc(2, f"Change avatar v{version}", ["Open Settings", "Upload avatar"]))
+
+    assert len(index) == 3
+    assert len(index._row_docs) <= 2 * len(index)
+    ranked = index.recommend("Settings avatar", OWNER)
+    assert [g["id"] for g in ranked] == [2] and ranked[0]["name"] == "Change avatar v4"
+
+
+# --- Index kept current by the guide routes ---
+engine = create_engine("sqlite:///:memory:", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+
+@pytest.fixture
+def db_client():
+    Base.metadata.create_all(bind=engine)
+    session = TestingSessionLocal()
+
+    def override_get_db():
+        yield session
+
+    app.dependency_overrides[get_db] = override_get_db
+    with TestClient(app) as c:
+        yield c, session
+    app.dependency_overrides.clear()
+    session.close()
+    Base.metadata.drop_all(bind=engine)
+
+
+def test_guide_routes_update_the_index(db_client, monkeypatch):
+    client, session = db_client
+    idx = GuideIndex()
+    idx.load(session)
+    monkeypatch.setattr(guide_index_mod, "guide_index", idx)
+    monkeypatch.setattr("app.routes.guides.guide_index", idx)
+
+    client.post("/api/auth/register", json={"email": "owner@example.com", "password": "password123"})
+    token = client.post("/api/auth/token", data={"username": "owner@example.com",
+                                                 "password": "password123"}).json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+    guide = client.post("/api/guides/", headers=headers, json={
+        "name": "Export invoice", "shortcut": "export-invoice", "description": "Billing export",
+        "steps": [{"selector": "#billing", "instruction": "Open Billing"},
+                  {"selector": "#export", "instruction": "Click Export PDF"}],
+    }).json()
+    user = SimpleNamespace(id=guide_owner_id(session), email="owner@example.com")
+    assert idx.match("how do I export an invoice", "Billing Export", user)["id"] == guide["id"]
+
+    client.put(f"/api/guides/{guide['id']}", headers=headers, json={"name": "Archive invoice"})
+    assert idx.match("how do I archive an invoice", "Billing Export", user)["id"] == guide["id"]
+
+    client.delete(f"/api/guides/{guide['id']}", headers=headers)
+    assert len(idx) == 0
+
+
+def guide_owner_id(session):
+    from app import models
+    return session.query(models.User).filter(models.User.email == "owner@example.com").first().id
+
+
+def test_recommend_endpoint_uses_screen_text_or_ocr(db_client, monkeypatch):
+    client, session = db_client
+    idx = GuideIndex()
+    idx.add(_doc(5, "Export invoice as PDF", ["Click Export PDF"], is_public=True))
+    _use_index(monkeypatch, idx)
+
+    async def fake_ocr(img, profile=None):
+        return OcrResult(["Export", "PDF"], [90, 90], [[0, 0, 10, 10], [20, 0, 30, 10]], [0, 0], [0, 0])
+
+    monkeypatch.setattr("app.routes.guides.run_ocr_cached", fake_ocr)
+    client.post("/api/auth/register", json={"email": "viewer@example.com", "password": "password123"})
+    token = client.post("/api/auth/token", data={"username": "viewer@example.com",
+                                                 "password": "password123"}).json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+
+    resp = client.post("/api/guides/recommend", headers=headers, data={"text": "Invoices Export"})
+    assert resp.status_code == 200 and resp.json()["guides"][0]["id"] == 5
+
+    buf = BytesIO()
+    Image.new("RGB", (64, 32), "white").save(buf, format="PNG")
+    resp = client.post("/api/guides/recommend", headers=headers,
+                       files={"file": ("screen.png", buf.getvalue(), "image/png")})
+    assert resp.json()["guides"][0]["shortcut"] == "g5"
+
+    assert client.post("/api/guides/recommend", headers=headers).status_code == 400
+
+
+def test_load_reads_every_guide_in_a_fixed_number_of_queries(db_client):
+    client, session = db_client
+    from app import models
+    owner = models.User(email="owner@example.com", hashed_password="x")
+    session.add(owner)
+    session.commit()
+    for i in range(5):
+        guide = models.Guide(name=f"Guide {i}", shortcut=f"g{i}", description="", owner_id=owner.id)
+        guide.steps = [models.Step(step_number=1, selector="#save", instruction="Click Save")]
+        guide.access_list = [models.GuideAccess(email="friend@example.com")]
+        session.add(guide)
+    session.commit()
+    session.expunge_all()
+
+    statements = []
+    listener = lambda *args: statements.append(args[2])
+    event.listen(engine, "before_cursor_execute", listener)
+    try:
+        idx = GuideIndex()
+        idx.load(session)
+    finally:
+        event.remove(engine, "before_cursor_execute", listener)
+
+    assert len(idx) == 5
+    assert len(statements) == 3  # guides, steps, access lists
+
+
+def test_concurrent_first_uses_load_once(monkeypatch):
+    idx = GuideIndex()
+    loads = []
+
+    class FakeDb:
+        def close(self):
+            pass
+
+    def slow_load(db):
+        loads.append(db)
+        time.sleep(0.05)
+        idx._loaded_at = time.monotonic()
+
+    monkeypatch.setattr(guide_index_mod.database, "SessionLocal", FakeDb)
+    monkeypatch.setattr(idx, "load", slow_load)
+    threads = [threading.Thread(target=idx.ensure_loaded) for _ in range(5)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert len(loads) == 1 and idx.loaded
+    idx.ensure_loaded()
+    assert len(loads) == 1  # later refreshes happen in the background
+
+
+def test_background_refresh_reloads_the_index(monkeypatch):
+    idx = GuideIndex()
+    idx._loaded_at = time.monotonic()
+    reloads = []
+    monkeypatch.setattr(idx, "reload", lambda: reloads.append(1))
+    monkeypatch.setattr(guide_index_mod, "guide_index", idx)
+    monkeypatch.setattr(guide_index_mod, "GUIDE_INDEX_REFRESH", 0.01)
+
+    async def main():
+        guide_index_mod.start_refresh()
+        await asyncio.sleep(0.1)
+        await guide_index_mod.stop_refresh()
+
+    asyncio.run(main())
+    assert reloads
+
+
+def test_reload_builds_aside_and_keeps_changes_made_meanwhile(monkeypatch):
+    idx = GuideIndex()
+    idx.add(_doc(1, "Change profile picture", ["Open Settings"]))
+    built = []
+
+    class FakeDb:
+        def query(self, model):
+            return self
+
+        def options(self, *args):
+            return self
+
+        def all(self):
+            return [_doc(2, "Export invoice as PDF", ["Open Billing"])]
+
+    def build(doc):
+        # Queries and guide routes carry on while the new index is built
+        assert not idx._lock.locked()
+        idx.add(_doc(3, "Invite a teammate", ["Open Team"]))
+        built.append(doc["id"])
+        return doc
+
+    monkeypatch.setattr(guide_index_mod, "doc_from_guide", build)
+    idx.load(FakeDb())
+
+    assert built == [2]
+    assert idx.get(1) is None and idx.get(2) and idx.get(3)
+    assert sorted(g["id"] for g in idx.recommend("Billing Team", OWNER)) == [2, 3]
+
+
+def test_background_refresh_survives_a_failed_reload(monkeypatch):
+    from app.services.executor import ExecutorSaturated
+
+    idx = GuideIndex()
+    idx._loaded_at = time.monotonic()
+    reloads = []
+
+    def reload():
+        reloads.append(1)
+        if len(reloads) == 1:
+            raise ExecutorSaturated("io pool is saturated")
+
+    monkeypatch.setattr(idx, "reload", reload)
+    monkeypatch.setattr(guide_index_mod, "guide_index", idx)
+    monkeypatch.setattr(guide_index_mod, "GUIDE_INDEX_REFRESH", 0.01)
+
+    async def main():
+        guide_index_mod.start_refresh()
+        await asyncio.sleep(0.1)
+        alive = not guide_index_mod._refresh_task.done()
+        await guide_index_mod.stop_refresh()
+        return alive
+
+    assert asyncio.run(main())
+    assert len(reloads) > 1
+
+
+def test_guides_revoked_by_another_worker_are_not_served(db_client, monkeypatch):
+    client, session = db_client
+    from app import models
+    owner = models.User(email="owner@example.com", hashed_password="x")
+    session.add(owner)
+    session.commit()
+    guides = {}
+    for shortcut, name, is_public in (("invoice", "Export invoice as PDF", True),
+                                      ("avatar", "Change profile picture", True)):
+        guide = models.Guide(name=name, shortcut=shortcut, description="", owner_id=owner.id, is_public=is_public)
+        guide.steps = [models.Step(step_number=1, selector="#a", instruction="Open Billing Export PDF"),
+                       models.Step(step_number=2, selector="#b", instruction="Open Settings Profile")]
+        session.add(guide)
+        session.commit()
+        guides[shortcut] = guide.id
+
+    idx = GuideIndex()
+    idx.load(session)
+    monkeypatch.setattr(guide_index_mod, "guide_index", idx)
+    monkeypatch.setattr(guide_index_mod.database, "SessionLocal", TestingSessionLocal)
+    viewer = SimpleNamespace(id=999, email="viewer@example.com")
+    ocr = OcrResult(["Billing", "Export", "PDF"], [90] * 3, [[0, 0, 1, 1]] * 3, [0] * 3, [0] * 3)
+    assert asyncio.run(match_guide("export invoice as pdf", ocr, viewer))["guide"]["id"] == guides["invoice"]
+
+    # Another worker makes one guide private and deletes the other
+    session.query(models.Guide).filter(models.Guide.id == guides["invoice"]).update({"is_public": False})
+    session.query(models.Step).filter(models.Step.guide_id == guides["avatar"]).delete()
+    session.query(models.Guide).filter(models.Guide.id == guides["avatar"]).delete()
+    session.commit()
+
+    assert asyncio.run(match_guide("export invoice as pdf", ocr, viewer)) is None
+    assert asyncio.run(recommend_guides("Billing Export Settings Profile", viewer)) == []
+    assert len(idx) == 1 and idx.get(guides["invoice"])["is_public"] is False
@@ -0,0 +1,133 @@
+import asyncio
+import uuid
+
+import pytest
+
+from app.services.jobs import JobQueue, JobQueueFull, JobStoreNotShared, MemoryJobStore, RedisJobStore
+
+
+def _run(coro):
+    return asyncio.run(coro)
+
+
+def test_job_runs_and_can_be_awaited():
+    async def scenario():
+        queue = JobQueue(MemoryJobStore(), workers=2, limit=4)
+
+        async def work():
+            await asyncio.sleep(0.05)
+            return {"steps": ["ok"]}
+
+        job = await queue.submit(work, owner=1)
+        assert (await queue.store.get(job["id"]))["status"] in ("queued", "running")
+        done = await queue.store.wait(job["id"], timeout=2)
+        await queue.close()
+        return done
+
+    done = _run(scenario())
+    assert done["status"] == "done" and done["result"] == {"steps": ["ok"]}
+    assert done["finished_at"] >= done["created_at"]
+
+
+def test_failed_job_hides_internal_errors():
+    async def scenario():
+        queue = JobQueue(MemoryJobStore(), workers=1, limit=4)
+
+        async def boom():
+            raise RuntimeError("secret path /etc/x")
+
+        job = await queue.submit(boom, owner=1)
+        done = await queue.store.wait(job["id"], timeout=2)
+        await queue.close()
+        return done
+
+    done = _run(scenario())
+    assert done["status"] == "failed"
+    assert done["error"] == "An error occurred during screen analysis"
+
+
+def test_queue_depth_is_bounded():
+    async def scenario():
+        queue = JobQueue(MemoryJobStore(), workers=1, limit=1)
+        gate = asyncio.Event()
+
+        async def blocked():
+            await gate.wait()
+
+        await queue.submit(blocked, owner=1)
+        await asyncio.sleep(0)  # the worker picks up the first job
+        await queue.submit(blocked, owner=1)
+        with pytest.raises(JobQueueFull):
+            await queue.submit(blocked, owner=1)
+        gate.set()
+        await queue.close()
+
+    _run(scenario())
+
+
+def test_memory_store_expires_jobs():
+    async def scenario():
+        store = MemoryJobStore(ttl=0.05)
+        await store.save({"id": "a", "status": "done"})
+        await asyncio.sleep(0.1)
+        return await store.get("a")
+
+    assert _run(scenario()) is None
+
+
+def test_memory_store_forgets_waiters_that_time_out():
+    async def scenario():
+        store = MemoryJobStore()
+        await store.save({"id": "a", "status": "running"})
+        jobs = await asyncio.gather(store.wait("a", 0.01), store.wait("a", 0.02))
+        return store, jobs
+
+    store, jobs = _run(scenario())
+    assert [job["status"] for job in jobs] == ["running", "running"]
+    assert store._events == {}
+
+
+def test_memory_store_refuses_jobs_when_several_workers_serve(monkeypatch):
+    async def job():
+        return {}
+
+    async def scenario():
+        queue = JobQueue(MemoryJobStore(), workers=1, limit=4)
+        monkeypatch.setenv("WEB_CONCURRENCY", "4")
+        with pytest.raises(JobStoreNotShared):
+            await queue.submit(job, owner=1)
+        monkeypatch.setattr(MemoryJobStore, "shared", True)  # as a shared store would be
+        assert (await queue.submit(job, owner=1))["status"] == "queued"
+        monkeypatch.setenv("WEB_CONCURRENCY", "1")
+        monkeypatch.setattr(MemoryJobStore, "shared", False)
+        assert (await queue.submit(job, owner=1))["status"] == "queued"
+        await queue.close()
+
+    _run(scenario())
+
+
+def test_redis_store_round_trip():
+    """Needs a local redis-server (REDIS_URL); skipped when none is running."""
+    async def scenario():
+        store = RedisJobStore(ttl=30, prefix=f"test:{uuid.uuid4().hex}:")
+        try:
+            await store.redis.ping()
+        except Exception:
+            await store.close()
+            pytest.skip("redis-server not available")
+        try:
+            job = {"id": "j1", "status": "running"}
+            await store.save(job)
+
+            async def finish():
+                await asyncio.sleep(0.05)
+                await store.save(dict(job, status="done", result={"ok": True}))
+
+            waiter = asyncio.ensure_future(store.wait("j1", timeout=2))
+            await finish()
+            return await waiter
+        finally:
+            await store.close()
+
+    done = _run(scenario())
+    assert done["status"] == "done" and done["result"] == {"ok": True}
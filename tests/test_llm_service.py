@@ -0,0 +1,143 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+import httpx
+import openai
+import pytest
+
+from app.services import llm_service
+
+
+class StubCompletions:
+    def __init__(self, content):
+        self.content = content
+        self.calls = []
+        self.failures = []
+
+    async def create(self, **kwargs):
+        self.calls.append(kwargs)
+        if self.failures:
+            raise self.failures.pop(0)
+        message = SimpleNamespace(content=self.content)
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+
+@pytest.fixture
+def stub_client(monkeypatch):
+    completions = StubCompletions(json.dumps({"steps": ["Click Save"]}))
+    monkeypatch.setattr(llm_service, "_client", SimpleNamespace(chat=SimpleNamespace(completions=completions)))
+    llm_service.clear_plan_cache()
+    yield completions
+    llm_service.clear_plan_cache()
+
+
+def plan(*args, **kwargs):
+    return asyncio.run(llm_service.plan_actions(*args, **kwargs))
+
+
+VISION = {"width": 1280, "height": 720, "note": "stub"}
+OCR = [
+    {"text": "Settings", "conf": 95.0, "box": [10, 10, 80, 30]},
+    {"text": "Save", "conf": 91.0, "box": [600, 650, 640, 670]},
+]
+
+
+def test_repeated_question_is_served_from_cache(stub_client):
+    first = plan(VISION, OCR, "How do I save?")
+    # Same screen text, different confidences and question formatting
+    noisy_ocr = [dict(item, conf=item["conf"] - 3) for item in OCR]
+    second = plan(VISION, noisy_ocr, "  how do I SAVE ")
+
+    assert first == second == {"steps": ["Click Save"]}
+    assert len(stub_client.calls) == 1
+
+
+def test_cache_opt_out_and_different_screens_call_the_llm(stub_client):
+    plan(VISION, OCR, "How do I save?")
+    plan(VISION, OCR, "How do I save?", use_cache=False)
+    plan(VISION, OCR[:1], "How do I save?")
+
+    assert len(stub_client.calls) == 3
+
+
+def test_unparseable_answers_are_not_cached(stub_client):
+    stub_client.content = "not json"
+    assert plan(VISION, OCR, "q") == llm_service.FALLBACK_RESULT
+
+    stub_client.content = json.dumps({"steps": ["ok"]})
+    assert plan(VISION, OCR, "q") == {"steps": ["ok"]}
+    assert len(stub_client.calls) == 2
+
+
+def test_retryable_errors_are_retried_within_budget(stub_client, monkeypatch):
+    monkeypatch.setattr(llm_service, "LLM_RETRY_BASE_DELAY", 0.001)
+    request = httpx.Request("POST", "http://stub/v1/chat/completions")
+    stub_client.failures = [openai.APITimeoutError(request), openai.APIConnectionError(request=request)]
+
+    assert plan(VISION, OCR, "q", use_cache=False) == {"steps": ["Click Save"]}
+    assert len(stub_client.calls) == 3
+    assert all(0 < call["timeout"] <= llm_service.LLM_TIMEOUT for call in stub_client.calls)
+
+
+def test_retries_are_bounded(stub_client, monkeypatch):
+    monkeypatch.setattr(llm_service, "LLM_RETRY_BASE_DELAY", 0.001)
+    request = httpx.Request("POST", "http://stub/v1/chat/completions")
+    stub_client.failures = [openai.APITimeoutError(request) for _ in range(5)]
+
+    with pytest.raises(openai.APITimeoutError):
+        plan(VISION, OCR, "q", use_cache=False)
+    assert len(stub_client.calls) == llm_service.LLM_MAX_RETRIES + 1
+
+
+def test_client_uses_configured_base_url(monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "test")
+    monkeypatch.setattr(llm_service, "OPENAI_BASE_URL", "http://127.0.0.1:9999/v1")
+
+    async def build():
+        client = llm_service._build_client()
+        await client.close()
+        return client
+
+    client = asyncio.run(build())
+    assert str(client.base_url) == "http://127.0.0.1:9999/v1/"
+    assert client.max_retries == 0
+
+
+def test_concurrent_identical_questions_share_one_completion(stub_client):
+    async def main():
+        return await asyncio.gather(*(llm_service.plan_actions(VISION, OCR, "How do I save?") for _ in range(3)))
+
+    results = asyncio.run(main())
+
+    assert results == [{"steps": ["Click Save"]}] * 3
+    assert results[0] is not results[1]
+    assert len(stub_client.calls) == 1
+
+
+def test_session_follow_ups_send_history_and_only_screen_changes(stub_client):
+    from app.services.conversation import Conversation
+
+    session = Conversation()
+    plan(VISION, OCR, "How do I save?", session=session)
+    plan(VISION, OCR, "How do I save?", session=session)  # same screen, asked again
+
+    assert len(stub_client.calls) == 2  # follow-ups skip the shared cache
+    first, second = (call["messages"] for call in stub_client.calls)
+    assert len(first) == 2 and len(second) == 4
+    assert json.loads(second[-1]["content"]) == {"screen_unchanged": True, "user_question": "How do I save?"}
+    assert len(second[-1]["content"]) < len(first[-1]["content"])
+    assert len(session) == 2
+
+
+def test_session_turns_compact_the_screen_once(stub_client, monkeypatch):
+    from app.services.conversation import Conversation
+
+    calls = []
+    real = llm_service.compact_screen
+    monkeypatch.setattr(llm_service, "compact_screen", lambda *a, **k: calls.append(1) or real(*a, **k))
+    session = Conversation()
+    plan(VISION, OCR, "How do I save?", session=session)  # first turn, through the shared path
+    plan(VISION, OCR, "And then?", session=session)
+
+    assert len(calls) == 2 and len(session) == 2
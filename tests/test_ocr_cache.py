@@ -0,0 +1,105 @@
+import asyncio
+
+from PIL import Image, ImageDraw
+
+from app.services import metrics, ocr_service
+from app.services.ocr_cache import OcrCache, pixel_digest
+from app.services.ocr_result import OcrResult
+
+
+def _screen(text_x=None):
+    img = Image.new("RGB", (1280, 720), "white")
+    draw = ImageDraw.Draw(img)
+    draw.rectangle([40, 40, 400, 80], fill=(30, 30, 30))
+    if text_x is not None:
+        draw.rectangle([text_x, 300, text_x + 60, 316], fill=(0, 0, 0))
+    return img
+
+
+def _text_screen(label):
+    img = Image.new("RGB", (1920, 1080), "white")
+    ImageDraw.Draw(img).text((900, 520), label, fill=(0, 0, 0))
+    return img
+
+
+def test_pixel_digest_is_stable_and_detects_small_changes():
+    assert pixel_digest(_screen()) == pixel_digest(_screen())
+    assert pixel_digest(_screen()) != pixel_digest(_screen(text_x=600))
+    for before, after in (("Enabled", "Disabled"), ("3 unread", "8 unread"), ("Invoice #4821", "Invoice #4827")):
+        assert pixel_digest(_text_screen(before)) != pixel_digest(_text_screen(after))
+
+
+def test_one_word_change_misses_the_cache(monkeypatch):
+    monkeypatch.setattr(ocr_service, "ocr_cache", OcrCache(max_bytes=1024 * 1024, ttl=60))
+    seen = []
+
+    async def fake_ocr_images(images, profile=None):
+        seen.append(images[0])
+        return [OcrResult([f"frame{len(seen)}"], [90.0], [[0, 0, 10, 10]], [0], [0])], {}
+
+    monkeypatch.setattr(ocr_service, "ocr_images", fake_ocr_images)
+
+    async def main():
+        return [await ocr_service.run_ocr_cached(_text_screen(label)) for label in ("3 unread", "8 unread")]
+
+    first, second = asyncio.run(main())
+    assert len(seen) == 2
+    assert first.text.tolist() != second.text.tolist()
+
+
+def test_cache_hits_skip_ocr(monkeypatch):
+    cache = OcrCache(max_bytes=1024 * 1024, ttl=60)
+    monkeypatch.setattr(ocr_service, "ocr_cache", cache)
+    calls = []
+
+    async def fake_ocr_images(images, profile=None):
+        calls.append(images)
+        return [OcrResult(["Save"], [90.0], [[0, 0, 10, 10]], [0], [0])], {}
+
+    monkeypatch.setattr(ocr_service, "ocr_images", fake_ocr_images)
+    metrics.reset()
+
+    async def main():
+        first = await ocr_service.run_ocr_cached(_screen())
+        second = await ocr_service.run_ocr_cached(_screen())
+        return first, second
+
+    first, second = asyncio.run(main())
+    assert first is second
+    assert len(calls) == 1
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+
+def test_cache_respects_byte_cap_and_ttl():
+    now = [0.0]
+    cache = OcrCache(max_bytes=600, ttl=10, timer=lambda: now[0])
+    item = OcrResult(["x" * 25], [1.0], [[0, 0, 1, 1]], [0], [0])  # ~400 bytes each
+
+    for i in range(5):
+        cache.put(("k", i), item)
+    assert cache.stats()["bytes"] <= 600
+    assert cache.get(("k", 0)) is None  # evicted as least recently used
+    assert cache.get(("k", 4)) is item
+
+    now[0] = 11
+    assert cache.get(("k", 4)) is None
+
+
+def test_concurrent_misses_for_the_same_frame_share_one_ocr_run(monkeypatch):
+    monkeypatch.setattr(ocr_service, "ocr_cache", OcrCache(max_bytes=1024 * 1024, ttl=60))
+    calls = []
+
+    async def fake_ocr_images(images, profile=None):
+        calls.append(images)
+        await asyncio.sleep(0.05)
+        return [OcrResult(["Save"], [90.0], [[0, 0, 10, 10]], [0], [0])], {}
+
+    monkeypatch.setattr(ocr_service, "ocr_images", fake_ocr_images)
+
+    async def main():
+        return await asyncio.gather(*(ocr_service.run_ocr_cached(_screen()) for _ in range(3)))
+
+    results = asyncio.run(main())
+    assert len(calls) == 1
+    assert results[0] is results[1] is results[2]
@@ -0,0 +1,52 @@
+from app.services.ocr_result import OcrResult
+
+
+def _tesseract_data():
+    # Two lines in block 1, one line in block 2, plus empty and noisy rows
+    return {
+        "text": ["", "Sign", "in", "Forgot", "password?", " ", "Help", "~"],
+        "conf": [-1, 96, 95, 90, 88, -1, 93, 5],
+        "left": [0, 10, 60, 10, 80, 0, 500, 700],
+        "top": [0, 10, 12, 40, 41, 0, 10, 300],
+        "width": [800, 45, 20, 65, 90, 0, 40, 8],
+        "height": [600, 20, 18, 20, 20, 0, 20, 8],
+        "block_num": [0, 1, 1, 1, 1, 2, 2, 3],
+        "par_num": [0, 1, 1, 1, 1, 1, 1, 1],
+        "line_num": [0, 1, 1, 2, 2, 1, 1, 1],
+    }
+
+
+def test_from_tesseract_filters_empty_and_low_confidence_words():
+    result = OcrResult.from_tesseract(_tesseract_data(), min_conf=30)
+
+    assert result.text.tolist() == ["Sign", "in", "Forgot", "password?", "Help"]
+    assert result.boxes[0].tolist() == [10, 10, 55, 30]
+
+
+def test_from_tesseract_applies_scale_and_offset():
+    result = OcrResult.from_tesseract(_tesseract_data(), scale=0.5, offset=(100, 0), min_conf=30)
+
+    assert result.boxes[0].tolist() == [120, 20, 210, 60]
+
+
+def test_lines_and_blocks_merge_boxes():
+    result = OcrResult.from_tesseract(_tesseract_data(), min_conf=30)
+
+    lines = result.lines()
+    assert [l["text"] for l in lines] == ["Sign in", "Help", "Forgot password?"]
+    assert lines[0]["box"] == [10, 10, 80, 30]
+    assert lines[2]["box"] == [10, 40, 170, 61]
+
+    blocks = result.blocks()
+    assert blocks[0]["text"] == "Sign in\nForgot password?"
+    assert blocks[0]["box"] == [10, 10, 170, 61]
+    assert blocks[1]["text"] == "Help"
+
+
+def test_concat_keeps_group_ids_unique():
+    a = OcrResult.from_tesseract(_tesseract_data(), min_conf=30)
+    merged = OcrResult.concat([a, a])
+
+    assert len(merged) == 10
+    assert len(merged.lines()) == 6
+    assert len(merged.blocks()) == 4
@@ -0,0 +1,277 @@
+import asyncio
+import json
+import time
+from io import BytesIO
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from app.services import executor, ocr_service
+from app.services.ocr_preprocess import prepare_for_ocr
+
+
+def _png_bytes(size=(64, 32)):
+    buf = BytesIO()
+    Image.new("RGB", size, "white").save(buf, format="PNG")
+    return buf.getvalue()
+
+
+@pytest.fixture
+def thread_ocr_pool(monkeypatch):
+    # Keep OCR in-process so the patched engine is visible to the workers
+    monkeypatch.setattr(executor, "OCR_EXECUTOR", "thread")
+    executor.cpu_pool.shutdown()
+    yield
+    executor.cpu_pool.shutdown()
+
+
+@pytest.fixture
+def fake_tesseract(monkeypatch):
+    seen = []
+
+    def image_to_data(img, output_type=None, **kwargs):
+        seen.append(img)
+        return {
+            "text": ["", "Save", "  "],
+            "conf": ["-1", "91.5", "-1"],
+            "left": [0, 4, 0],
+            "top": [0, 6, 0],
+            "width": [64, 20, 0],
+            "height": [32, 10, 0],
+            "block_num": [0, 1, 1],
+            "par_num": [0, 1, 1],
+            "line_num": [0, 1, 1],
+        }
+
+    monkeypatch.setattr(ocr_service.pytesseract, "image_to_data", image_to_data)
+    # Pin the engine: on hosts where tesserocr works it is the default
+    monkeypatch.setattr(ocr_service, "get_engine", lambda: ocr_service.PytesseractEngine())
+    return seen
+
+
+@pytest.mark.parametrize("make_source", [
+    _png_bytes,
+    lambda: Image.new("RGB", (64, 32), "white"),
+    lambda: np.full((32, 64, 3), 255, dtype=np.uint8),
+])
+def test_run_ocr_accepts_in_memory_images(fake_tesseract, make_source):
+    items = ocr_service.run_ocr(make_source()).to_items()
+
+    assert items == [{"text": "Save", "conf": 91.5, "box": [4, 6, 24, 16]}]
+    assert fake_tesseract[0].size == (64, 32)
+
+
+def test_tesserocr_engine_parses_tsv(monkeypatch):
+    class FakeApi:
+        def SetImage(self, img):
+            self.img = img
+
+        def Recognize(self, timeout=0):
+            self.timeout = timeout
+            return True
+
+        def GetTSVText(self, page):
+            return ("1\t1\t0\t0\t0\t0\t0\t0\t64\t32\t-1\t\n"
+                    "5\t1\t1\t1\t1\t1\t4\t6\t20\t10\t91.500000\tSave")
+
+    engine = ocr_service.TesserocrEngine.__new__(ocr_service.TesserocrEngine)
+    engine.api = FakeApi()
+    monkeypatch.setattr(ocr_service._local, "engine", engine, raising=False)
+
+    items = ocr_service.run_ocr(Image.new("RGB", (64, 32), "white")).to_items()
+
+    assert items == [{"text": "Save", "conf": 91.0, "box": [4, 6, 24, 16]}]
+    ocr_service.run_ocr(Image.new("RGB", (64, 32), "white"), expires=time.time() + 2)
+    assert 0 < engine.api.timeout <= 2000
+
+
+def test_tesserocr_is_the_default_engine_with_pytesseract_fallback(monkeypatch):
+    class FakeApi:
+        def __init__(self, lang):
+            self.lang = lang
+
+    monkeypatch.setattr(ocr_service, "tesserocr", SimpleNamespace(PyTessBaseAPI=FakeApi))
+    assert ocr_service._new_engine().name == "tesserocr"
+
+    monkeypatch.setattr(ocr_service, "OCR_ENGINE", "pytesseract")
+    assert ocr_service._new_engine().name == "pytesseract"
+
+    monkeypatch.setattr(ocr_service, "OCR_ENGINE", "tesserocr")
+    monkeypatch.setattr(ocr_service, "tesserocr", None)
+    assert ocr_service._new_engine().name == "pytesseract"
+
+
+def test_tesseract_calls_are_bounded_by_the_ocr_stage_budget(thread_ocr_pool, monkeypatch):
+    from app.services.deadline import Deadline
+
+    timeouts = []
+
+    def image_to_data(img, output_type=None, timeout=0, **kwargs):
+        timeouts.append(timeout)
+        return {k: [] for k in ("text", "conf", "left", "top", "width", "height",
+                                "block_num", "par_num", "line_num")}
+
+    monkeypatch.setattr(ocr_service.pytesseract, "image_to_data", image_to_data)
+    monkeypatch.setattr(ocr_service, "get_engine", lambda: ocr_service.PytesseractEngine())
+    img = Image.new("RGB", (64, 32), "white")
+
+    async def main():
+        await ocr_service.ocr_images([img])
+        await Deadline(2.0).run("ocr", ocr_service.ocr_images([img]))
+
+    asyncio.run(main())
+    assert 0 < timeouts[0] <= ocr_service.OCR_CALL_TIMEOUT
+    assert 0 < timeouts[1] <= 1.0  # OCR gets half of a 2 s analysis
+    with pytest.raises(TimeoutError):
+        ocr_service.run_ocr(img, expires=time.time() - 1)
+
+
+def test_pytesseract_timeouts_are_raised_as_timeout_error(monkeypatch):
+    from app.services.deadline import Deadline, StageTimeout
+
+    def image_to_data(img, output_type=None, timeout=0, **kwargs):
+        raise RuntimeError("Tesseract process timeout")
+
+    monkeypatch.setattr(ocr_service.pytesseract, "image_to_data", image_to_data)
+    engine = ocr_service.PytesseractEngine()
+    img = Image.new("RGB", (64, 32), "white")
+
+    async def ocr():
+        return engine.image_to_data(img, 1.0)
+
+    with pytest.raises(StageTimeout):
+        asyncio.run(Deadline(10).run("ocr", ocr()))
+
+
+def test_ocr_images_batches_and_reports_timing(thread_ocr_pool, fake_tesseract):
+    images = [Image.new("RGB", (64, 32), "white") for _ in range(3)]
+
+    results, timing = asyncio.run(ocr_service.ocr_images(images, [(0, 0), (100, 0), (0, 50)]))
+
+    assert [r.boxes[0].tolist() for r in results] == [[4, 6, 24, 16], [104, 6, 124, 16], [4, 56, 24, 66]]
+    assert timing["images"] == 3
+    assert timing["queue_ms"] >= 0 and timing["exec_ms"] >= 0
+
+
+@pytest.mark.parametrize("profile, ocr_width", [("fast", 1600), ("balanced", 1920), ("accurate", 2560)])
+def test_run_ocr_downscales_and_maps_boxes_back(fake_tesseract, profile, ocr_width):
+    items = ocr_service.run_ocr(Image.new("RGB", (3840, 2160), "white"), profile=profile).to_items()
+
+    scale = ocr_width / 3840
+    assert fake_tesseract[0].size[0] == ocr_width
+    assert fake_tesseract[0].mode == "L"
+    assert items[0]["box"] == [round(4 / scale), round(6 / scale), round(24 / scale), round(16 / scale)]
+
+
+def test_prepare_for_ocr_keeps_small_images():
+    img, scale = prepare_for_ocr(Image.new("RGB", (1280, 720), "white"), "fast")
+    assert scale == 1.0
+    assert img.size == (1280, 720)
+
+
+def test_parse_regions_accepts_boxes_and_bbox_dicts():
+    assert ocr_service.parse_regions([[10, 20, 110, 70], {"x": 5, "y": 6, "width": 50, "height": 40}]) == \
+        [[10, 20, 110, 70], [5, 6, 55, 46]]
+    assert ocr_service.parse_regions(None) == []
+    for bad in ([[10, 10, 5, 50]], [[1, 2, 3]], [{"x": 1}]):
+        with pytest.raises((ValueError, KeyError)):
+            ocr_service.parse_regions(bad)
+    for bad in ("[[1e400, 0, 5, 5]]", "[[0, 0, Infinity, 5]]", "[[NaN, 0, 5, 5]]",
+                '[{"x": 0, "y": 0, "width": 1e400, "height": 5}]'):
+        with pytest.raises(ValueError):
+            ocr_service.parse_regions(json.loads(bad))
+
+
+def test_roi_crops_pad_clamp_and_merge():
+    crops = ocr_service.roi_crops((1000, 800), [[10, 10, 100, 50], [90, 40, 200, 80], [900, 700, 990, 790]], 20)
+    assert crops == [[0, 0, 220, 100], [880, 680, 1000, 800]]
+
+
+def test_run_ocr_regions_reads_only_the_crops(monkeypatch, thread_ocr_pool, fake_tesseract):
+    from app.services.ocr_cache import OcrCache
+
+    monkeypatch.setattr(ocr_service, "ocr_cache", OcrCache())
+    img = Image.new("RGB", (3840, 2160), "white")
+
+    result = asyncio.run(ocr_service.run_ocr_regions(img, [[1000, 500, 1200, 560]], margin=40, profile="accurate"))
+
+    assert [im.size for im in fake_tesseract] == [(280, 140)]
+    # boxes come back in full-image coordinates
+    assert result.boxes.tolist() == [[964, 466, 984, 476]]
+
+
+def test_tile_grid_covers_the_image_with_overlap():
+    grid = ocr_service.tile_grid(2560, 1440, size=1024, overlap=128)
+
+    assert [t[0] for t in grid[:3]] == [0, 896, 1536]
+    assert {(t[1], t[3]) for t in grid} == {(0, 1024), (416, 1440)}
+    assert all(t[2] - t[0] == 1024 for t in grid)
+    assert ocr_service.tile_grid(800, 600, size=1024) == [[0, 0, 800, 600]]
+
+
+def test_merge_tiles_dedupes_words_and_joins_split_lines():
+    from app.services.ocr_result import OcrResult
+
+    tiles = [[0, 0, 1024, 600], [896, 0, 1920, 600]]
+    left = OcrResult(["Open", "recent", "fil"], [90, 92, 60],
+                     [[850, 100, 900, 120], [910, 100, 980, 120], [990, 100, 1024, 120]], [0, 0, 0], [0, 0, 0])
+    right = OcrResult(["recent", "files"], [85, 91],
+                      [[910, 101, 980, 120], [990, 100, 1045, 120]], [0, 0], [0, 0])
+
+    merged = ocr_service.merge_tiles([left, right], tiles, (1920, 600)).sorted()
+
+    assert merged.text.tolist() == ["Open", "recent", "files"]
+    assert merged.conf.tolist() == [90, 92, 91]
+    assert [l["text"] for l in merged.lines()] == ["Open recent files"]
+
+
+def test_run_ocr_tiled_spreads_tiles_and_keeps_each_word_once(thread_ocr_pool, fake_tesseract):
+    img = Image.new("RGB", (2560, 1440), "white")
+
+    result = asyncio.run(ocr_service.run_ocr_tiled(img, "accurate", tile_size=1024, overlap=128))
+
+    assert len(fake_tesseract) == 6 and {t.size for t in fake_tesseract} == {(1024, 1024)}
+    # The fake engine reports "Save" at (4, 6) in every tile
+    assert result.text.tolist() == ["Save"] * 6
+    assert result.boxes[:, :2].tolist() == [[4, 6], [900, 6], [1540, 6], [4, 422], [900, 422], [1540, 422]]
+
+
+def test_tiling_is_chosen_from_the_ocr_input_size(monkeypatch):
+    monkeypatch.setattr(ocr_service, "OCR_TILING", "auto")
+    monkeypatch.setattr(ocr_service, "OCR_TILE_MIN_PIXELS", 2560 * 1440)
+    assert ocr_service.tiling_wanted((3840, 2160), "accurate")
+    assert not ocr_service.tiling_wanted((3840, 2160), "fast")
+    assert not ocr_service.tiling_wanted((1920, 1080), "accurate")
+
+
+def test_a_short_deadline_does_not_bound_a_shared_ocr_run(monkeypatch, thread_ocr_pool):
+    from app.services.deadline import Deadline, StageTimeout
+    from app.services.ocr_cache import OcrCache
+
+    timeouts = []
+
+    class SlowEngine(ocr_service.OcrEngine):
+        def image_to_data(self, img, timeout=None):
+            timeouts.append(timeout)
+            time.sleep(0.5)
+            return {k: [] for k in ("text", "conf", "left", "top", "width", "height",
+                                    "block_num", "par_num", "line_num")}
+
+    monkeypatch.setattr(ocr_service, "get_engine", SlowEngine)
+    monkeypatch.setattr(ocr_service, "ocr_cache", OcrCache())
+    img = Image.new("RGB", (64, 32), "white")
+
+    async def main():
+        return await asyncio.gather(
+            Deadline(0.6).run("ocr", ocr_service.run_ocr_cached(img)),
+            Deadline(30).run("ocr", ocr_service.run_ocr_cached(img)),
+            return_exceptions=True,
+        )
+
+    short, long = asyncio.run(main())
+    assert isinstance(short, StageTimeout)
+    assert len(long) == 0
+    assert timeouts[0] > 1.0  # not the 0.3 s OCR share of the short request
+    assert len(timeouts) == 1 and ocr_service.ocr_cache.stats()["entries"] == 1
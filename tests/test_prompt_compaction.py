@@ -0,0 +1,97 @@
+import json
+
+from app.services import llm_service
+from app.services.ocr_result import OcrResult
+from app.services.prompt_compaction import compact_screen, estimate_tokens, region_of
+
+VISION = {"width": 1200, "height": 900, "note": "stub"}
+
+
+def _result(words):
+    """words: [(text, conf, box, line_id), ...]"""
+    return OcrResult(
+        [w[0] for w in words], [w[1] for w in words], [w[2] for w in words],
+        [0] * len(words), [w[3] for w in words],
+    )
+
+
+def test_region_of_uses_a_three_by_three_grid():
+    assert region_of([10, 10, 50, 30], 1200, 900) == "top-left"
+    assert region_of([580, 440, 620, 460], 1200, 900) == "center"
+    assert region_of([1100, 850, 1190, 890], 1200, 900) == "bottom-right"
+
+
+def test_lines_are_grouped_deduped_and_filtered():
+    ocr = _result([
+        ("File", 95, [10, 10, 40, 30], 0),
+        ("Edit", 94, [50, 10, 80, 30], 0),
+        ("Save", 90, [1000, 800, 1040, 820], 1),
+        ("Save", 88, [1000, 840, 1040, 860], 2),
+        ("~|", 90, [600, 450, 610, 460], 3),       # punctuation noise
+        ("blurry", 12, [600, 480, 650, 500], 4),   # low confidence
+    ])
+    compacted, stats = compact_screen(VISION, ocr)
+
+    assert compacted["screen"] == {"width": 1200, "height": 900}
+    assert compacted["regions"] == {"top-left": ["File Edit"], "bottom-right": ["Save x2"]}
+    assert stats["lines"] == 5 and stats["kept_lines"] == 2
+    assert stats["compacted_tokens"] < stats["original_tokens"]
+
+
+def test_budget_keeps_most_confident_lines_in_reading_order():
+    ocr = _result([
+        ("first line of low confidence text", 50, [10, 10, 300, 30], 0),
+        ("second", 99, [10, 60, 80, 80], 1),
+        ("third", 98, [10, 110, 80, 130], 2),
+    ])
+    base, _ = compact_screen(VISION, OcrResult.empty())
+    budget = estimate_tokens(json.dumps(base)) + 6  # room for "second" and "third"
+    compacted, _ = compact_screen(VISION, ocr, budget=budget)
+
+    assert compacted["regions"] == {"top-left": ["second", "third"]}
+
+
+def test_legacy_item_lists_are_still_accepted():
+    items = [{"text": "Settings", "conf": 95.0, "box": [10, 10, 80, 30]}]
+    compacted, _ = compact_screen(VISION, items)
+    assert compacted["regions"] == {"top-left": ["Settings"]}
+
+
+def test_request_uses_compact_prompt():
+    ocr = _result([("Save", 90, [1000, 800, 1040, 820], 0)])
+    args = llm_service._request_args(VISION, ocr, "How do I save?")
+    prompt = json.loads(args["messages"][1]["content"])
+
+    assert prompt == {
+        "screen": {"width": 1200, "height": 900},
+        "regions": {"bottom-right": ["Save"]},
+        "user_question": "How do I save?",
+    }
+    # OcrResult and legacy items describing the same screen share a cache key
+    assert llm_service.plan_fingerprint(VISION, ocr, "q") == \
+        llm_service.plan_fingerprint(VISION, ocr.to_items(), "q")
+
+
+def test_ui_elements_are_labelled_with_the_text_inside_them():
+    vision = dict(VISION, elements=[
+        {"type": "button", "box": [990, 790, 1060, 830], "score": 1.0},
+        {"type": "panel", "box": [0, 0, 600, 450], "score": 1.0},
+    ], summary={"button": 1, "panel": 1})
+    ocr = _result([
+        ("File", 95, [10, 10, 40, 30], 0),
+        ("Save", 90, [1000, 800, 1040, 820], 1),
+    ])
+    compacted, _ = compact_screen(vision, ocr)
+
+    assert compacted["screen"] == {"width": 1200, "height": 900, "summary": {"button": 1, "panel": 1}}
+    assert compacted["ui"] == {"top-left": ["panel"], "bottom-right": ['button "Save"']}
+
+
+def test_original_size_is_estimated_without_building_the_old_prompt():
+    words = [(f"word{i}", 90, [1000 + i, 500, 1040 + i, 520], i // 5) for i in range(300)]
+    ocr = _result(words)
+    exact = estimate_tokens(json.dumps({"vision": VISION, "ocr_items": ocr.to_items()}, indent=2))
+
+    _, stats = compact_screen(VISION, ocr)
+    assert abs(stats["original_tokens"] - exact) / exact < 0.1
+    assert compact_screen(VISION, ocr.to_items())[1]["original_tokens"] == stats["original_tokens"]
@@ -0,0 +1,76 @@
+import asyncio
+import contextvars
+
+import pytest
+
+from app.services import metrics
+from app.services.singleflight import SingleFlight
+
+
+def test_concurrent_callers_share_one_run():
+    metrics.reset()
+    flight = SingleFlight("test")
+    runs = []
+
+    async def work(value):
+        runs.append(value)
+        await asyncio.sleep(0.05)
+        return value * 2
+
+    async def main():
+        together = await asyncio.gather(*(flight.do("k", work, 21) for _ in range(4)))
+        later = await flight.do("k", work, 5)
+        return together, later
+
+    together, later = asyncio.run(main())
+    assert together == [42] * 4 and later == 10
+    assert runs == [21, 5]
+    assert flight.stats() == {"calls": 5, "shared": 3, "dedupe_rate": 0.6, "in_flight": 0}
+
+
+def test_a_caller_giving_up_does_not_cancel_the_shared_run():
+    flight = SingleFlight("test-cancel")
+
+    async def work():
+        await asyncio.sleep(0.05)
+        return "done"
+
+    async def main():
+        impatient = asyncio.ensure_future(flight.do("k", work))
+        patient = asyncio.ensure_future(flight.do("k", work))
+        await asyncio.sleep(0.01)
+        impatient.cancel()
+        return await patient
+
+    assert asyncio.run(main()) == "done"
+
+
+def test_errors_reach_every_caller_and_are_not_kept():
+    flight = SingleFlight("test-error")
+
+    async def boom():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("nope")
+
+    async def main():
+        results = await asyncio.gather(flight.do("k", boom), flight.do("k", boom), return_exceptions=True)
+        return results, flight.in_flight
+
+    results, in_flight = asyncio.run(main())
+    assert all(isinstance(r, RuntimeError) for r in results)
+    assert in_flight == 0
+
+
+def test_the_shared_run_does_not_inherit_the_leaders_context():
+    flight = SingleFlight("test-context")
+    var = contextvars.ContextVar("var", default="unset")
+
+    async def work():
+        await asyncio.sleep(0.01)
+        return var.get()
+
+    async def main():
+        var.set("leader")
+        return await flight.do("k", work)
+
+    assert asyncio.run(main()) == "unset"
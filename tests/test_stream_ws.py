@@ -0,0 +1,183 @@
+import asyncio
+import base64
+import json
+import os
+from io import BytesIO
+from types import SimpleNamespace
+
+import pytest
+from fastapi.testclient import TestClient
+from PIL import Image
+
+# Mock environment variables
+os.environ["SECRET_KEY"] = "test_secret_key"
+os.environ["DATABASE_URL"] = "sqlite:///:memory:"
+
+from app.main import app
+from app.auth import create_access_token
+from app.routes import stream_ws
+from app.services import executor, llm_service
+from app.services.ocr_result import OcrResult
+from app.utils.ws_protocol import pack_frame, unpack_frame, decode_reply, FrameError
+
+
+def _image_png():
+    buf = BytesIO()
+    Image.new("RGB", (320, 200), "white").save(buf, format="PNG")
+    return buf.getvalue()
+
+
+def _image_b64():
+    return "data:image/png;base64," + base64.b64encode(_image_png()).decode()
+
+
+class FakeFrameState:
+    async def ocr(self, img, profile=None):
+        return OcrResult(["Save"], [91.0], [[10, 10, 50, 30]], [0], [0])
+
+
+class StubStream:
+    def __init__(self, fragments):
+        self.fragments = fragments
+
+    def __aiter__(self):
+        return self._gen()
+
+    async def _gen(self):
+        for fragment in self.fragments:
+            delta = SimpleNamespace(content=fragment)
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=delta)])
+
+
+class StubCompletions:
+    answer = json.dumps({"steps": ["Open the menu", "Click Save"]})
+
+    async def create(self, stream=False, **kwargs):
+        if stream:
+            text = self.answer
+            return StubStream([text[i:i + 7] for i in range(0, len(text), 7)])
+        message = SimpleNamespace(content=self.answer)
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+
+@pytest.fixture
+def ws_client(monkeypatch):
+    monkeypatch.setattr(stream_ws, "FrameState", FakeFrameState)
+    # OCR is faked; keep engine warm-up out of the deadline-sensitive tests
+    executor.cpu_pool.shutdown()
+    monkeypatch.setattr(executor.cpu_pool, "initializer", None)
+    monkeypatch.setattr(llm_service, "_client", SimpleNamespace(chat=SimpleNamespace(completions=StubCompletions())))
+    llm_service.clear_plan_cache()
+    token = create_access_token({"sub": "ws@example.com"})
+    with TestClient(app) as client:
+        with client.websocket_connect(f"/api/ws/screen?token={token}") as ws:
+            yield ws
+    llm_service.clear_plan_cache()
+    executor.cpu_pool.shutdown()
+
+
+def test_legacy_frame_gets_single_combined_reply(ws_client):
+    ws_client.send_text(json.dumps({"image": _image_b64(), "question": "save?"}))
+    reply = json.loads(ws_client.receive_text())
+
+    assert reply["frame_id"] == 1
+    assert reply["ocr"][0]["text"] == "Save"
+    assert reply["vision"]["width"] == 320
+    assert reply["llm"] == {"steps": ["Open the menu", "Click Save"]}
+
+
+def test_streaming_frame_pushes_each_stage(ws_client):
+    ws_client.send_text(json.dumps({
+        "image": _image_b64(), "question": "save?", "stream": True, "frame_id": "f-7",
+    }))
+    messages = [json.loads(ws_client.receive_text()) for _ in range(5)]
+
+    assert [m["type"] for m in messages] == ["ocr", "vision", "llm_step", "llm_step", "llm"]
+    assert all(m["frame_id"] == "f-7" for m in messages)
+    assert [m["step"] for m in messages[2:4]] == ["Open the menu", "Click Save"]
+    assert messages[4]["llm"]["steps"] == ["Open the menu", "Click Save"]
+
+
+def test_binary_frame_gets_msgpack_reply_with_columns(ws_client):
+    ws_client.send_bytes(pack_frame({"frame_id": 9, "question": "save?", "encoding": "png"}, _image_png()))
+    reply = decode_reply(ws_client.receive_bytes(), "msgpack")
+
+    assert reply["frame_id"] == 9
+    assert reply["ocr"] == {"text": ["Save"], "conf": [91.0], "boxes": [[10, 10, 50, 30]]}
+    assert reply["vision"]["width"] == 320
+    assert reply["llm"]["steps"] == ["Open the menu", "Click Save"]
+
+
+def test_binary_frame_can_ask_for_json_reply_and_text_mode_still_works(ws_client):
+    ws_client.send_bytes(pack_frame({"question": "save?", "reply": "json"}, _image_png()))
+    assert decode_reply(ws_client.receive_bytes(), "json")["frame_id"] == 1
+
+    ws_client.send_text(json.dumps({"image": _image_b64(), "question": "save?"}))
+    assert json.loads(ws_client.receive_text())["frame_id"] == 2
+
+
+def test_malformed_binary_frame_is_rejected(ws_client):
+    ws_client.send_bytes(b"\x00\x00\xff\xffnot a header")
+    assert decode_reply(ws_client.receive_bytes(), "json") == {"error": "bad header length"}
+
+
+def test_frame_round_trip():
+    header, image = unpack_frame(pack_frame({"frame_id": "a"}, b"\x89PNG"))
+    assert header == {"frame_id": "a"} and image == b"\x89PNG"
+    with pytest.raises(FrameError):
+        unpack_frame(pack_frame({"encoding": "gif"}, b""))
+
+
+def test_stale_frames_are_skipped(ws_client, monkeypatch):
+    async def slow_ocr(self, img, profile=None):
+        await asyncio.sleep(0.3)
+        return OcrResult(["Save"], [91.0], [[10, 10, 50, 30]], [0], [0])
+
+    monkeypatch.setattr(FakeFrameState, "ocr", slow_ocr)
+    for frame_id in (1, 2, 3):
+        ws_client.send_text(json.dumps({"image": _image_b64(), "question": "save?", "frame_id": frame_id}))
+
+    skipped = [json.loads(ws_client.receive_text()) for _ in range(2)]
+    reply = json.loads(ws_client.receive_text())
+
+    assert [m["type"] for m in skipped] == ["skipped", "skipped"]
+    assert {m["frame_id"] for m in skipped} == {1, 2}
+    assert all(m["latest_frame_id"] in (2, 3) for m in skipped)
+    assert reply["frame_id"] == 3 and "llm" in reply
+
+
+def test_regions_bypass_the_full_frame_ocr(ws_client, monkeypatch):
+    async def fake_regions(img, regions, margin=None, profile=None):
+        assert (regions, margin) == ([[20, 20, 120, 60]], 8)
+        return OcrResult(["Open"], [88.0], [[30, 30, 60, 50]], [0], [0])
+
+    monkeypatch.setattr(stream_ws, "run_ocr_regions", fake_regions)
+    ws_client.send_text(json.dumps({"image": _image_b64(), "question": "open?",
+                                    "regions": [[20, 20, 120, 60]], "margin": 8}))
+    assert json.loads(ws_client.receive_text())["ocr"][0]["text"] == "Open"
+
+    ws_client.send_text(json.dumps({"image": _image_b64(), "regions": [[5, 5]]}))
+    assert json.loads(ws_client.receive_text())["error"] == "invalid regions"
+
+    # Non-finite numbers are valid JSON but must not kill the connection
+    ws_client.send_text('{"image": "%s", "regions": [[1e400, 0, 5, 5]]}' % _image_b64())
+    assert json.loads(ws_client.receive_text())["error"] == "invalid regions"
+    ws_client.send_text(json.dumps({"image": _image_b64(), "question": "open?",
+                                    "regions": [[20, 20, 120, 60]], "margin": 8}))
+    assert json.loads(ws_client.receive_text())["ocr"][0]["text"] == "Open"
+
+
+def test_frame_past_its_deadline_is_answered_without_llm(ws_client, monkeypatch):
+    from app.services import deadline
+
+    async def slow_plan(vision, ocr, question, use_cache=True, session=None):
+        await asyncio.sleep(2)
+
+    monkeypatch.setattr(stream_ws, "plan_actions", slow_plan)
+    monkeypatch.setitem(deadline.STAGE_MIN_BUDGET, "llm", 0)
+    ws_client.send_text(json.dumps({"image": _image_b64(), "question": "save?", "deadline_ms": 500}))
+    reply = json.loads(ws_client.receive_text())
+
+    assert reply["llm"] is None
+    assert reply["partial"] is True and reply["timed_out"] == ["llm"]
+    assert reply["ocr"][0]["text"] == "Save"
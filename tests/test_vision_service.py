@@ -0,0 +1,62 @@
+import asyncio
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+from app.services import vision_service
+from app.services.vision_service import analyze_ui, connected_components
+
+
+def _screen():
+    img = Image.new("RGB", (1920, 1080), "white")
+    d = ImageDraw.Draw(img)
+    d.rectangle([100, 100, 900, 900], outline=(200, 200, 200), width=2)       # panel
+    d.rectangle([150, 200, 650, 240], outline=(180, 180, 180), width=1)       # text input
+    d.rounded_rectangle([150, 300, 330, 350], radius=6, fill=(30, 100, 220))  # filled button
+    d.text((170, 315), "Save changes", fill="white")
+    d.rectangle([1700, 20, 1732, 52], outline=(120, 120, 120), width=2)       # icon
+    for i in range(20):
+        d.text((1200, 150 + i * 20), "lorem ipsum dolor sit amet", fill="black")
+    return img
+
+
+def _near(box, expected, tol=8):
+    return all(abs(a - b) <= tol for a, b in zip(box, expected))
+
+
+def test_connected_components_handles_diagonals_and_separate_blobs():
+    mask = np.zeros((6, 8), dtype=bool)
+    mask[0, 0] = mask[1, 1] = mask[2, 2] = True  # one diagonal component
+    mask[4:6, 5:8] = True
+    boxes, pixels = connected_components(mask)
+
+    order = np.argsort(boxes[:, 0])
+    assert boxes[order].tolist() == [[0, 0, 2, 2], [5, 4, 7, 5]]
+    assert pixels[order].tolist() == [3, 6]
+
+
+def test_detects_typed_elements():
+    result = analyze_ui(_screen())
+
+    assert (result["width"], result["height"]) == (1920, 1080)
+    by_type = {e["type"]: e["box"] for e in result["elements"]}
+    assert _near(by_type["panel"], [100, 100, 901, 901])
+    assert _near(by_type["input"], [150, 200, 651, 241])
+    assert _near(by_type["button"], [150, 300, 331, 351])
+    assert _near(by_type["icon"], [1700, 20, 1733, 53])
+    # Paragraph text is not mistaken for widgets
+    assert result["summary"] == {"panel": 1, "input": 1, "button": 1, "icon": 1}
+
+
+def test_blank_screen_has_no_elements():
+    assert analyze_ui(np.full((200, 300, 3), 255, dtype=np.uint8))["elements"] == []
+
+
+def test_analyze_screen_matches_analyze_ui(monkeypatch):
+    async def inline(fn, *args):
+        return fn(*args)
+
+    monkeypatch.setattr(vision_service, "run_io", inline)
+    monkeypatch.setattr(vision_service, "run_cpu", inline)
+    img = _screen()
+    assert asyncio.run(vision_service.analyze_screen(img)) == analyze_ui(img)